@@ -0,0 +1,39 @@
+import pytest
+
+from .synthetic import write_synthetic_files
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("synthetic", "The size of the synthetic TEI files for the benchmarks")
+    group.addoption("--synthetic-verses", type=int, default=200, help="The number of verses in the synthetic apparatus and document.")
+    group.addoption("--synthetic-apps-per-verse", type=int, default=5, help="The number of <app> elements in each verse.")
+    group.addoption("--synthetic-readings-per-app", type=int, default=3, help="The number of <rdg> elements in each <app>.")
+    group.addoption("--synthetic-witnesses", type=int, default=8, help="The number of witnesses in the apparatus.")
+    group.addoption("--synthetic-run-verses", type=int, default=20, help="The number of verses to process when benchmarking the `run` pipeline.")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def snapshot_cache_directory(tmp_path_factory):
+    """ Keeps the cached snapshots of the synthetic TEI files out of the user's cache directory. """
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("VORLAGELLM_CACHE_DIR", str(tmp_path_factory.mktemp("snapshots")))
+        yield
+
+
+@pytest.fixture(scope="session")
+def synthetic(request, tmp_path_factory) -> dict:
+    """ Writes the synthetic document, apparatus and predictions once for all the benchmarks. """
+    options = request.config.option
+    return write_synthetic_files(
+        tmp_path_factory.mktemp("synthetic"),
+        verses=options.synthetic_verses,
+        apps_per_verse=options.synthetic_apps_per_verse,
+        readings_per_app=options.synthetic_readings_per_app,
+        witnesses=options.synthetic_witnesses,
+    )
+
+
+@pytest.fixture
+def fake_models() -> dict:
+    """ The arguments to `run` to use the offline fake LLM and embeddings (see `vorlagellm.fake`) so that the pipeline can be benchmarked without API calls. """
+    return dict(model="fake://benchmark", embedding_model="fake://embeddings?size=64")
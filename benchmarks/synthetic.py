@@ -0,0 +1,138 @@
+"""
+Generators of synthetic TEI apparatus and documents of any size for the benchmarks.
+
+The files have the same structure as the apparatus and transcriptions used by VorlageLLM
+(i.e. <ab> elements with an 'n' attribute for each verse, <app> elements with <rdg> elements, a <listWit> and a language)
+so that the whole pipeline can run on them.
+"""
+import copy
+import random
+from pathlib import Path
+from lxml import etree as ET
+from lxml.etree import _ElementTree as ElementTree
+
+from vorlagellm.tei import find_elements, add_witness_readings, write_tei
+
+TEI_NAMESPACE = "http://www.tei-c.org/ns/1.0"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+WORDS = ["και", "ο", "θεος", "λογος", "εν", "αρχη", "ην", "προς", "τον", "ουτος", "παυλος", "κλητος", "αποστολος", "χριστου", "ιησου"]
+LATIN_WORDS = ["et", "deus", "verbum", "in", "principio", "erat", "apud", "hic", "paulus", "vocatus", "apostolus", "christi", "iesu"]
+DEFAULT_SIGLA = ["WH", "NA28", "RP", "Treg"]
+
+
+def verse_id(index:int) -> str:
+    return f"B07K1V{index + 1}"
+
+
+def make_sigla(witnesses:int) -> list[str]:
+    """ The sigla of the witnesses in a synthetic apparatus (the first four are the sigla of the editions in the test data). """
+    return (DEFAULT_SIGLA + [f"W{index}" for index in range(len(DEFAULT_SIGLA) + 1, witnesses + 1)])[:witnesses]
+
+
+def sub_element(parent, tag:str, **attributes):
+    return ET.SubElement(parent, f"{{{TEI_NAMESPACE}}}{tag}", **attributes)
+
+
+def make_header(tei, title:str, sigla:list[str]=(), document_siglum:str="") -> None:
+    header = sub_element(tei, "teiHeader")
+    file_description = sub_element(header, "fileDesc")
+    title_statement = sub_element(file_description, "titleStmt")
+    sub_element(title_statement, "title").text = title
+    if document_siglum:
+        sub_element(title_statement, "title", type="document", n=document_siglum).text = document_siglum
+    source_description = sub_element(file_description, "sourceDesc")
+    if sigla:
+        list_wit = sub_element(source_description, "listWit")
+        for siglum in sigla:
+            sub_element(list_wit, "witness", n=siglum)
+
+
+def make_apparatus(
+    verses:int=100,
+    apps_per_verse:int=5,
+    readings_per_app:int=3,
+    words_between_apps:int=4,
+    sigla:list[str]|None=None,
+    seed:int=0,
+    witnesses:int=4,
+) -> ElementTree:
+    """
+    Makes a synthetic TEI apparatus with the same structure as the apparatus files used by VorlageLLM.
+
+    Each verse is an <ab> with words between <app> elements and each reading is witnessed by a random subset of the sigla.
+    The sigla are given with `sigla` or made for the number of `witnesses`.
+    """
+    rng = random.Random(seed)
+    sigla = sigla or make_sigla(witnesses)
+
+    tei = ET.Element(f"{{{TEI_NAMESPACE}}}TEI", nsmap={None: TEI_NAMESPACE})
+    make_header(tei, "Synthetic apparatus", sigla=sigla)
+
+    body = sub_element(sub_element(tei, "text", **{XML_LANG: "grc"}), "body")
+    for verse_index in range(verses):
+        ab = sub_element(body, "ab", n=verse_id(verse_index))
+        ab.text = " ".join(rng.choices(WORDS, k=words_between_apps)) + " "
+        for _ in range(apps_per_verse):
+            app = sub_element(ab, "app")
+            for reading_index in range(readings_per_app):
+                reading_witnesses = [siglum for siglum in sigla if rng.random() < 0.5] or [rng.choice(sigla)]
+                reading = sub_element(app, "rdg", wit=" ".join(reading_witnesses))
+                for word in rng.choices(WORDS, k=rng.randint(0 if reading_index else 1, 3)):
+                    sub_element(reading, "w").text = word
+            app.tail = " " + " ".join(rng.choices(WORDS, k=words_between_apps)) + " "
+
+    return ET.ElementTree(tei)
+
+
+def make_document(verses:int=100, words_per_verse:int=20, siglum:str="51", seed:int=0) -> ElementTree:
+    """ Makes a synthetic TEI transcription of a Latin witness with a <ab> for each verse (matching the verses of `make_apparatus`). """
+    rng = random.Random(seed)
+    tei = ET.Element(f"{{{TEI_NAMESPACE}}}TEI", nsmap={None: TEI_NAMESPACE})
+    make_header(tei, f"Synthetic transcription of {siglum}", document_siglum=siglum)
+
+    body = sub_element(sub_element(tei, "text", **{XML_LANG: "lat"}), "body")
+    for verse_index in range(verses):
+        ab = sub_element(body, "ab", n=verse_id(verse_index))
+        for word in rng.choices(LATIN_WORDS, k=words_per_verse):
+            sub_element(ab, "w").text = word
+
+    return ET.ElementTree(tei)
+
+
+def make_predictions(apparatus:ElementTree, siglum:str, runs:int=3, seed:int=0) -> list[ElementTree]:
+    """ Makes copies of an apparatus where the witness is added to random readings of each <app> (like the outputs of `vorlagellm run`). """
+    rng = random.Random(seed)
+    predictions = []
+    for _ in range(runs):
+        prediction = copy.deepcopy(apparatus)
+        for app in find_elements(prediction, ".//app"):
+            readings = find_elements(app, ".//rdg")
+            add_witness_readings(rng.sample(readings, rng.randint(1, len(readings))), siglum)
+        predictions.append(prediction)
+    return predictions
+
+
+def write_synthetic_files(
+    directory:Path,
+    verses:int=100,
+    apps_per_verse:int=5,
+    readings_per_app:int=3,
+    witnesses:int=4,
+    runs:int=3,
+    siglum:str="51",
+) -> dict[str, Path|list[Path]]:
+    """
+    Writes a synthetic document, apparatus and predicted apparatus files for the ensemble to a directory.
+
+    Returns the paths with the keys 'doc', 'apparatus' and 'predictions'.
+    """
+    directory = Path(directory)
+    apparatus = make_apparatus(verses=verses, apps_per_verse=apps_per_verse, readings_per_app=readings_per_app, witnesses=witnesses)
+    paths = dict(doc=directory/"doc.xml", apparatus=directory/"apparatus.xml", predictions=[])
+    write_tei(make_document(verses=verses, siglum=siglum), paths['doc'])
+    write_tei(apparatus, paths['apparatus'])
+    for index, prediction in enumerate(make_predictions(apparatus, siglum, runs=runs)):
+        path = directory/f"prediction{index}.xml"
+        write_tei(prediction, path)
+        paths['predictions'].append(path)
+    return paths
@@ -0,0 +1,48 @@
+"""
+Micro-benchmark of the text extraction functions in vorlagellm.tei on a large synthetic apparatus.
+
+Usage:
+    python -m benchmarks.tei_text [--verses 2000] [--repeat 5]
+"""
+import argparse
+import timeit
+
+from vorlagellm.tei import extract_text, find_parent, get_apparatus_verse_texts, get_reading_permutations, find_elements
+
+from .synthetic import make_apparatus
+
+
+def report(name:str, seconds:float, count:int, unit:str="node") -> None:
+    print(f"{name:<32} {seconds * 1e6 / count:8.2f} µs per {unit} ({count} {unit}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verses", type=int, default=2000)
+    parser.add_argument("--apps-per-verse", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    apparatus = make_apparatus(verses=args.verses, apps_per_verse=args.apps_per_verse)
+    nodes = list(apparatus.getroot().iter())
+    verses = find_elements(apparatus, ".//ab")
+    apps = find_elements(apparatus, ".//app")
+
+    def best(function) -> float:
+        return min(timeit.repeat(function, number=1, repeat=args.repeat))
+
+    report("extract_text (every element)", best(lambda: [extract_text(node) for node in nodes]), len(nodes))
+    report("extract_text (verses)", best(lambda: [extract_text(verse) for verse in verses]), len(nodes))
+    report("find_parent (ab of each node)", best(lambda: [find_parent(node, "ab") for node in nodes]), len(nodes))
+    report("get_apparatus_verse_texts", best(lambda: [get_apparatus_verse_texts(verse) for verse in verses]), len(apps), unit="<app>")
+    sample = verses[:200]
+    report(
+        "get_reading_permutations", 
+        best(lambda: [get_reading_permutations(apparatus, verse.attrib["n"], max_permutations=10) for verse in sample]), 
+        len(sample),
+        unit="verse",
+    )
+
+
+if __name__ == "__main__":
+    main()
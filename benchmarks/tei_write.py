@@ -0,0 +1,58 @@
+"""
+Measures the throughput of writing and reading a large synthetic apparatus with `write_tei` and `read_tei`.
+
+Usage:
+    python -m benchmarks.tei_write [--verses 2000] [--repeat 3]
+"""
+import argparse
+import tempfile
+import timeit
+from pathlib import Path
+
+from vorlagellm.tei import write_tei, read_tei
+
+from .synthetic import make_apparatus
+
+
+FORMATS = [
+    ("pretty", "apparatus.xml", True),
+    ("compact", "apparatus.xml", False),
+    ("compact gzip", "apparatus.xml.gz", False),
+    ("compact zstd", "apparatus.xml.zst", False),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verses", type=int, default=2000)
+    parser.add_argument("--apps-per-verse", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    apparatus = make_apparatus(verses=args.verses, apps_per_verse=args.apps_per_verse)
+
+    def best(function) -> float:
+        return min(timeit.repeat(function, number=1, repeat=args.repeat))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uncompressed_size = None
+        for name, filename, pretty_print in FORMATS:
+            path = Path(tmpdir)/filename
+            try:
+                write_seconds = best(lambda: write_tei(apparatus, path, pretty_print=pretty_print))
+            except ImportError as err:
+                print(f"{name:<14} skipped: {err}")
+                continue
+            read_seconds = best(lambda: read_tei(path))
+            size = path.stat().st_size
+            uncompressed_size = uncompressed_size or size
+            megabytes = uncompressed_size / 1e6
+            print(
+                f"{name:<14} write {megabytes / write_seconds:7.1f} MB/s  "
+                f"read {megabytes / read_seconds:7.1f} MB/s  "
+                f"size {size / 1e6:7.2f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmarks of VorlageLLM on synthetic TEI files.
+
+Usage:
+    pytest benchmarks --benchmark-only [--synthetic-verses 200 --synthetic-apps-per-verse 5 --synthetic-readings-per-app 3 --synthetic-witnesses 8]
+
+These need the `pytest-benchmark` plugin (in the dev dependencies). 
+They are not part of the tests (which are only in `tests/`) so they only run when the `benchmarks` directory is given.
+"""
+import subprocess
+import sys
+
+from vorlagellm.tei import read_tei, get_verses, get_reading_permutations, extract_text, find_element, find_elements
+from vorlagellm.agreements import count_witness_agreements, all_witness_agreements
+from vorlagellm.ensemble import do_ensemble
+from vorlagellm.rag import build_apparatus_embeddingdocs
+from vorlagellm.main import evaluate, run
+
+
+def test_read_tei(benchmark, synthetic):
+    apparatus = benchmark(read_tei, synthetic['apparatus'])
+    assert get_verses(apparatus)
+
+
+def test_get_reading_permutations(benchmark, synthetic):
+    apparatus = read_tei(synthetic['apparatus'])
+    verses = get_verses(apparatus)[:50]
+
+    def permutations():
+        return [get_reading_permutations(apparatus, verse, max_permutations=10) for verse in verses]
+
+    assert all(benchmark(permutations))
+
+
+def test_extract_text(benchmark, synthetic):
+    apparatus = read_tei(synthetic['apparatus'])
+    elements = find_elements(apparatus, ".//ab") + find_elements(apparatus, ".//rdg")
+    texts = benchmark(lambda: [extract_text(element) for element in elements])
+    assert len(texts) == len(elements)
+
+
+def test_build_apparatus_embeddingdocs(benchmark, synthetic):
+    apparatus = read_tei(synthetic['apparatus'])
+    documents = benchmark.pedantic(build_apparatus_embeddingdocs, args=(apparatus,), rounds=3)
+    assert documents
+
+
+def test_evaluate(benchmark, synthetic):
+    benchmark.pedantic(evaluate, args=(synthetic['apparatus'], "WH", ["NA28", "RP"]), kwargs=dict(cache=False), rounds=3)
+
+
+def test_evaluate_cached(benchmark, synthetic):
+    evaluate(synthetic['apparatus'], "WH", ["NA28", "RP"], cache=True)
+    benchmark(evaluate, synthetic['apparatus'], "WH", ["NA28", "RP"], cache=True)
+
+
+def test_count_witness_agreements(benchmark, synthetic):
+    apparatus = read_tei(synthetic['apparatus'])
+    counter = benchmark(count_witness_agreements, apparatus, "WH", "NA28")
+    assert sum(counter.values()) == len(find_elements(apparatus, ".//app"))
+
+
+def test_all_witness_agreements(benchmark, synthetic):
+    apparatus = read_tei(synthetic['apparatus'])
+    sigla, _ = benchmark.pedantic(all_witness_agreements, args=(apparatus,), rounds=3)
+    assert len(sigla) == len(find_elements(apparatus, ".//witness"))
+
+
+def test_do_ensemble(benchmark, synthetic):
+    result = benchmark.pedantic(do_ensemble, args=(synthetic['predictions'], "51"), rounds=3)
+    assert find_element(result, ".//witDetail") is not None
+
+
+def test_run(benchmark, synthetic, fake_models, tmp_path, request):
+    verses = get_verses(read_tei(synthetic['doc']))[:request.config.option.synthetic_run_verses]
+    output = tmp_path/"output.xml"
+
+    def run_pipeline():
+        output.unlink(missing_ok=True)
+        return run(synthetic['doc'], synthetic['apparatus'], output, include=verses, **fake_models)
+
+    benchmark.pedantic(run_pipeline, rounds=3)
+    assert find_element(read_tei(output), ".//witDetail[@wit=$wit]", wit="51") is not None
+
+
+def test_run_with_databases(benchmark, synthetic, fake_models, tmp_path, request):
+    verses = get_verses(read_tei(synthetic['doc']))[:request.config.option.synthetic_run_verses]
+    output = tmp_path/"output.xml"
+
+    def run_pipeline():
+        output.unlink(missing_ok=True)
+        return run(
+            synthetic['doc'], 
+            synthetic['apparatus'], 
+            output, 
+            include=verses, 
+            doc_db=tmp_path/"doc-db", 
+            apparatus_db=tmp_path/"apparatus-db",
+            **fake_models,
+        )
+
+    benchmark.pedantic(run_pipeline, rounds=2)
+    assert output.exists()
+
+
+def test_main_import_time(benchmark):
+    """ The time to start Python and import the CLI, which every command pays before it starts. """
+    benchmark.pedantic(subprocess.run, args=([sys.executable, "-c", "import vorlagellm.main"],), kwargs=dict(check=True), rounds=5)
@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def snapshot_cache_directory(tmp_path, monkeypatch):
+    """ Keeps the cached snapshots of TEI files made during the tests out of the user's cache directory. """
+    monkeypatch.setenv("VORLAGELLM_CACHE_DIR", str(tmp_path/"snapshots"))
@@ -1,6 +1,8 @@
 from lxml import etree as ET
 from collections import Counter
-from vorlagellm.agreements import WitnessComparison, get_app_witness_agreements, count_witness_agreements
+from vorlagellm.agreements import WitnessComparison, get_app_witness_agreements, count_witness_agreements, all_witness_agreements, get_all_sigla
+from vorlagellm.tei import read_tei
+from .test_tei import TEST_APPARATUS
 
 def test_witness_missing():
     xml_data = '''<app>
@@ -68,3 +70,45 @@ def test_all_witness_agreements():
         WitnessComparison.MISSING: 2,
     })
     assert result == expected
+
+
+def test_get_all_sigla():
+    xml_data = '''<root>
+        <listWit><witness n="B"/><witness n="A"/></listWit>
+        <app>
+            <rdg wit="#A C">Text 1</rdg>
+        </app>
+    </root>'''
+    root = ET.fromstring(xml_data)
+    assert get_all_sigla(root) == ["B", "A", "C"]
+
+
+def test_all_witness_agreements_matches_pairs():
+    apparatus = read_tei(TEST_APPARATUS)
+    sigla, results = all_witness_agreements(apparatus)
+    assert sigla == ["WH", "NA28", "RP", "Holmes", "Treg", "NIV"]
+    for index1, siglum1 in enumerate(sigla):
+        for index2, siglum2 in enumerate(sigla):
+            counter = count_witness_agreements(apparatus, siglum1, siglum2)
+            for category in WitnessComparison:
+                assert results[category][index1, index2] == counter[category]
+
+
+def test_all_witness_agreements_ambiguous():
+    xml_data = '''<root>
+        <app>
+            <rdg wit="SIGLUM1">Text 1</rdg>
+        </app>
+        <app>
+            <rdg wit="SIGLUM1">Text 4</rdg>
+            <rdg wit="SIGLUM2">Text 5</rdg>
+            <rdg wit="SIGLUM1 SIGLUM2">Text 6</rdg>
+        </app>
+        <app>
+        </app>
+    </root>'''
+    root = ET.fromstring(xml_data)
+    sigla, results = all_witness_agreements(root, ["SIGLUM1", "SIGLUM2"])
+    assert results[WitnessComparison.MISSING].tolist() == [[1, 2], [2, 2]]
+    assert results[WitnessComparison.AMBIGUOUS_AGREEMENT].tolist() == [[1, 1], [1, 1]]
+    assert results[WitnessComparison.UNAMBIGUOUS_AGREEMENT].tolist() == [[1, 0], [0, 0]]
@@ -0,0 +1,118 @@
+import json
+import pytest
+from pathlib import Path
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from vorlagellm.batch import (
+    messages_to_openai,
+    openai_to_messages,
+    batch_request,
+    batch_response,
+    write_batch_requests,
+    read_batch_results,
+    LocalBatchBackend,
+    BatchState,
+    run_batch_phase,
+)
+
+
+MESSAGES = [SystemMessage(content="system"), HumanMessage(content="question"), AIMessage(content="answer")]
+
+
+def test_messages_round_trip():
+    openai_messages = messages_to_openai(MESSAGES)
+    assert [message['role'] for message in openai_messages] == ["system", "user", "assistant"]
+    assert openai_to_messages(openai_messages) == MESSAGES
+
+
+def test_batch_request():
+    request = batch_request("corresponding-1", MESSAGES, model="gpt-4.1", temperature=0.0)
+    assert request['custom_id'] == "corresponding-1"
+    assert request['url'] == "/v1/chat/completions"
+    assert request['body']['model'] == "gpt-4.1"
+    assert request['body']['temperature'] == 0.0
+    assert "temperature" not in batch_request("x", MESSAGES, model="gpt-4.1")['body']
+    assert "response_format" not in batch_request("x", MESSAGES, model="gpt-4.1")['body']
+    assert batch_request("x", MESSAGES, model="gpt-4.1", json_mode=True)['body']['response_format'] == {"type": "json_object"}
+
+
+def test_read_batch_results(tmp_path):
+    path = tmp_path/"output.jsonl"
+    lines = [batch_response("a", "1,2"), batch_response("b", None, error="failed")]
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+    assert read_batch_results(path) == {"a": "1,2"}
+
+
+def test_local_batch_backend(tmp_path):
+    path = write_batch_requests([batch_request("a", MESSAGES, model="m"), batch_request("b", MESSAGES[:1], model="m")], tmp_path/"requests.jsonl")
+    backend = LocalBatchBackend(lambda messages: f"{len(messages)} messages")
+    batch_id = backend.submit(path)
+    assert backend.status(batch_id) == "completed"
+    output = backend.download(batch_id, tmp_path/"downloaded.jsonl")
+    assert read_batch_results(output) == {"a": "3 messages", "b": "1 messages"}
+
+
+def test_batch_state(tmp_path):
+    state = BatchState.load(tmp_path/"run.batch.json")
+    assert state.batches == {}
+    state.apps["0"] = dict(corresponding_text="text")
+    state.save()
+    assert BatchState.load(tmp_path/"run.batch.json").apps == {"0": dict(corresponding_text="text")}
+    assert state.phase_file("source", "-output") == tmp_path/"run-source-output.jsonl"
+
+
+class PendingBackend(LocalBatchBackend):
+    """ A local backend which reports that batches are still in progress for a number of status checks. """
+    def __init__(self, llm, pending_checks:int):
+        super().__init__(llm)
+        self.pending_checks = pending_checks
+        self.submitted = 0
+
+    def submit(self, path):
+        self.submitted += 1
+        return super().submit(path)
+
+    def status(self, batch_id):
+        if self.pending_checks:
+            self.pending_checks -= 1
+            return "in_progress"
+        return "completed"
+
+
+def test_run_batch_phase_resume(tmp_path):
+    backend = PendingBackend(lambda messages: "1", pending_checks=1)
+    requests = lambda: [batch_request("a", MESSAGES, model="m")]
+
+    state = BatchState.load(tmp_path/"run.batch.json")
+    assert run_batch_phase(state, backend, "source", requests) is None
+    assert state.batches['source']['status'] == "in_progress"
+
+    # Resuming from the saved state does not submit the batch again
+    state = BatchState.load(tmp_path/"run.batch.json")
+    assert run_batch_phase(state, backend, "source", requests) == {"a": "1"}
+    assert backend.submitted == 1
+    assert BatchState.load(tmp_path/"run.batch.json").batches['source']['status'] == "completed"
+
+
+def test_run_batch_phase_wait(tmp_path):
+    backend = PendingBackend(lambda messages: "1", pending_checks=3)
+    sleeps = []
+    state = BatchState.load(tmp_path/"run.batch.json")
+    results = run_batch_phase(state, backend, "source", lambda: [batch_request("a", MESSAGES, model="m")], wait=True, poll_interval=5, sleep=sleeps.append)
+    assert results == {"a": "1"}
+    assert sleeps == [5, 5, 5]
+
+
+def test_run_batch_phase_failed(tmp_path):
+    class FailedBackend(LocalBatchBackend):
+        def status(self, batch_id):
+            return "expired"
+
+    state = BatchState.load(tmp_path/"run.batch.json")
+    with pytest.raises(AssertionError):
+        run_batch_phase(state, FailedBackend(lambda messages: "1"), "source", lambda: [batch_request("a", MESSAGES, model="m")])
+
+
+def test_run_batch_phase_empty(tmp_path):
+    state = BatchState.load(tmp_path/"run.batch.json")
+    assert run_batch_phase(state, None, "source", lambda: []) == {}
@@ -1,6 +1,19 @@
 
 
-from vorlagellm.chains import build_chain
+from langchain_core.runnables import RunnableLambda
+import pytest
+from vorlagellm.chains import (
+    build_chain, 
+    vote_on_results, 
+    invoke_self_consistency, 
+    needs_escalation, 
+    build_source_chain, 
+    build_corresponding_text_chain, 
+    extract_json, 
+    parse_structured_result, 
+    StructuredOutputError, 
+    ParseStats,
+)
 from vorlagellm.prompts import readings_list_to_str
 
 
@@ -25,3 +38,154 @@ def test_build_chain():
     assert chain is not None
     result = chain.invoke(dict(text="صباح الخير", readings=readings_str, similar_verse_examples=""))
     assert result[0] == [0,2]
+
+
+def test_vote_on_results():
+    assert vote_on_results([[0, 1], [0], [0, 2]]) == [0]
+    assert vote_on_results([[0, 1], [1], [0, 2], [2]]) == [0, 1, 2]
+    assert vote_on_results([[0, 1], [0], [0, 2]], threshold=0.3) == [0, 1, 2]
+
+
+def mock_sampled_chain(outputs:list):
+    calls = []
+    def sample(inputs):
+        calls.append(inputs)
+        return outputs[len(calls) - 1]
+    return RunnableLambda(sample), calls
+
+
+def test_invoke_self_consistency_single():
+    chain, calls = mock_sampled_chain([([0], "first")])
+    assert invoke_self_consistency(chain, dict(text="x")) == ([0], "first")
+    assert len(calls) == 1
+
+
+def test_invoke_self_consistency_vote():
+    chain, calls = mock_sampled_chain([([0, 1], "first"), ([1], "second"), ([1, 2], "third")])
+    assert invoke_self_consistency(chain, dict(text="x"), samples=3) == ([1], "second")
+    assert len(calls) == 3
+    assert all(call == dict(text="x") for call in calls)
+
+
+def test_invoke_self_consistency_adaptive_agree():
+    chain, calls = mock_sampled_chain([([1], "first"), ([1], "second"), ([2], "third")])
+    assert invoke_self_consistency(chain, dict(text="x"), samples=3, adaptive=True) == ([1], "first")
+    assert len(calls) == 2
+
+
+def test_invoke_self_consistency_adaptive_disagree():
+    chain, calls = mock_sampled_chain([([0], "first"), ([1], "second"), ([1], "third")])
+    assert invoke_self_consistency(chain, dict(text="x"), samples=3, adaptive=True) == ([1], "second")
+    assert len(calls) == 3
+
+
+def test_needs_escalation():
+    assert needs_escalation([], 3)
+    assert needs_escalation([0, 1, 2], 3)
+    assert needs_escalation([0, 5], 3)
+    assert needs_escalation([-1], 3)
+    assert not needs_escalation([0, 2], 3)
+    assert not needs_escalation([0], 1)
+
+
+def test_extract_json():
+    assert extract_json('```json\n{"readings": [1], "justification": "x"}\n```') == {"readings": [1], "justification": "x"}
+    with pytest.raises(StructuredOutputError):
+        extract_json("1,3")
+    with pytest.raises(StructuredOutputError):
+        extract_json("{readings: 1}")
+
+
+def test_parse_structured_result():
+    inputs = dict(readings=readings_list_to_str(["good morning", "good day", "good afternoon"]))
+    assert parse_structured_result('{"readings": [1, "3"], "justification": " Both fit. "}', inputs) == ([0, 2], "Both fit.")
+    assert parse_structured_result('{"readings": []}', inputs) == ([], "")
+    with pytest.raises(StructuredOutputError):
+        parse_structured_result('{"readings": [4]}', inputs)
+    with pytest.raises(StructuredOutputError):
+        parse_structured_result('{"readings": ["good day"]}', inputs)
+    with pytest.raises(StructuredOutputError):
+        parse_structured_result('{"readings": 1}', inputs)
+
+
+def mock_responses(outputs:list):
+    prompts = []
+    def llm(prompt):
+        prompts.append(prompt.to_string())
+        return outputs[len(prompts) - 1]
+    return llm, prompts
+
+
+SOURCE_INPUTS = dict(
+    doc_verse_text="اهلا، صباح الخير", 
+    doc_corresponding_text="صباح الخير", 
+    apparatus_verse_text="Hello, ⸂good morning⸃", 
+    readings=readings_list_to_str(["good morning", "good day", "good afternoon"]),
+    similar_verse_examples="",
+)
+
+
+def test_structured_source_chain():
+    llm, prompts = mock_responses(['{"readings": [2], "justification": "Because."}'])
+    parse_stats = ParseStats()
+    chain = build_source_chain(llm, doc_language="Arabic", apparatus_language="English", notes="", structured=True, parse_stats=parse_stats)
+    assert chain.invoke(SOURCE_INPUTS) == ([1], "Because.")
+    assert "JSON" in prompts[0]
+    assert parse_stats == ParseStats(responses=1, failures=0, fallbacks=0)
+
+
+def test_structured_source_chain_reask():
+    llm, prompts = mock_responses(['{"readings": [5]}', '{"readings": [1, 3], "justification": "Fixed."}'])
+    parse_stats = ParseStats()
+    chain = build_source_chain(llm, doc_language="Arabic", apparatus_language="English", notes="", structured=True, parse_stats=parse_stats)
+    assert chain.invoke(SOURCE_INPUTS) == ([0, 2], "Fixed.")
+    assert len(prompts) == 2
+    assert "AI: {\"readings\": [5]}" in prompts[1]
+    assert "The reading 5 is not between 1 and 3." in prompts[1]
+    assert parse_stats.failure_rate == 0.5
+    assert parse_stats.fallbacks == 0
+
+
+def test_structured_source_chain_fallback():
+    llm, prompts = mock_responses(["2", "2", "2"])
+    parse_stats = ParseStats()
+    chain = build_source_chain(llm, doc_language="Arabic", apparatus_language="English", notes="", structured=True, max_reasks=2, parse_stats=parse_stats)
+    assert chain.invoke(SOURCE_INPUTS) == ([1], "2")
+    assert len(prompts) == 3
+    assert parse_stats == ParseStats(responses=3, failures=3, fallbacks=1)
+
+
+def test_parse_stats_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    parse_stats = ParseStats()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(1000):
+            executor.submit(parse_stats.count, responses=1, failures=1, fallbacks=1)
+    assert parse_stats == ParseStats(responses=1000, failures=1000, fallbacks=1000)
+
+
+def test_structured_corresponding_text_chain():
+    llm, prompts = mock_responses(['{"text": "صباح الخير"}'])
+    chain = build_corresponding_text_chain(llm, doc_language="Arabic", apparatus_language="English", structured=True)
+    result = chain.invoke(dict(doc_verse_text="اهلا، صباح الخير", permutations="Hello, ⸂good morning⸃", reading_list="⸂good morning⸃"))
+    assert result == "صباح الخير"
+
+
+def test_structured_chain_verbose(capsys):
+    llm, prompts = mock_responses(['{"readings": [5]}', '{"readings": [1, 3], "justification": "Fixed."}'])
+    chain = build_source_chain(llm, doc_language="Arabic", apparatus_language="English", notes="", structured=True, verbose=True)
+    assert chain.invoke(SOURCE_INPUTS) == ([0, 2], "Fixed.")
+    printed = capsys.readouterr().out
+    assert prompts[0] in printed
+    assert "The reading 5 is not between 1 and 3." in printed
+    assert '{"readings": [1, 3], "justification": "Fixed."}' in printed
+
+
+def test_structured_corresponding_text_chain_verbose(capsys):
+    llm, prompts = mock_responses(['{"text": "صباح الخير"}'])
+    chain = build_corresponding_text_chain(llm, doc_language="Arabic", apparatus_language="English", structured=True, verbose=True)
+    chain.invoke(dict(doc_verse_text="اهلا، صباح الخير", permutations="Hello, ⸂good morning⸃", reading_list="⸂good morning⸃"))
+    printed = capsys.readouterr().out
+    assert prompts[0] in printed
+    assert '{"text": "صباح الخير"}' in printed
@@ -0,0 +1,194 @@
+import tempfile
+import pytest
+from pathlib import Path
+from lxml import etree as ET
+from vorlagellm.ensemble import do_ensemble, iter_verse_elements, find_wit_detail, contested_verses, load_weights, readings_match, reading_string, AppVotes
+from vorlagellm.tei import read_tei, write_tei, find_elements, reading_has_witness
+
+
+def make_apparatus(wits:list[list[str]]) -> str:
+    apps = ""
+    for verse_index, app_wits in enumerate(wits):
+        readings = "".join(f'<rdg wit="A {wit}">Text {index}</rdg>' for index, wit in enumerate(app_wits))
+        apps += f'<ab n="V{verse_index}"><app>{readings}<witDetail wit="X"><note>Note</note></witDetail></app></ab>'
+    return f'''<TEI xmlns="http://www.tei-c.org/ns/1.0">
+        <teiHeader><fileDesc><titleStmt><title>Test</title><respStmt><resp>Run</resp></respStmt></titleStmt></fileDesc></teiHeader>
+        <text><body>{apps}</body></text>
+    </TEI>'''
+
+
+APPARATUS_WITS = [
+    [["X", ""], ["X", "X"]],
+    [["X", ""], ["", ""]],
+    [["", "X"], ["", "X"]],
+]
+
+
+def write_apparatuses(tmpdirname:str) -> list[Path]:
+    paths = []
+    for index, wits in enumerate(APPARATUS_WITS):
+        path = Path(tmpdirname)/f"apparatus{index}.xml"
+        path.write_text(make_apparatus(wits))
+        paths.append(path)
+    return paths
+
+
+def check_result(result):
+    readings = find_elements(result, ".//rdg")
+    assert [reading_has_witness(reading, "X") for reading in readings] == [True, False, False, True]
+    assert len(result.getroot().findall(".//{*}respStmt")) == 4
+    for app in find_elements(result, ".//app"):
+        ensemble_wit_detail = app.findall("{*}witDetail")[-1]
+        assert ensemble_wit_detail.attrib['resp'] == "VorlageLLM-Ensemble"
+        assert len(ensemble_wit_detail) == 3
+
+
+def test_do_ensemble_paths():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        check_result(do_ensemble(paths, "X"))
+
+
+def test_do_ensemble_trees():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        check_result(do_ensemble([read_tei(path) for path in paths], "X"))
+
+
+def test_iter_verse_elements():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        resp_statements = []
+        verses = [verse.attrib['n'] for verse in iter_verse_elements(paths[0], resp_statements)]
+        assert len(verses) == 2
+        assert len(resp_statements) == 1
+
+
+def write_apparatuses_without_ab(tmpdirname:str) -> list[Path]:
+    paths = []
+    for index, wits in enumerate(APPARATUS_WITS):
+        text = make_apparatus(wits)
+        # Move the <app> of the first verse out of its <ab> and into a <p>
+        text = text.replace('<ab n="V0">', '<p>', 1).replace('</ab>', '</p>', 1)
+        path = Path(tmpdirname)/f"apparatus{index}.xml"
+        path.write_text(text)
+        paths.append(path)
+    return paths
+
+
+def test_iter_verse_elements_app_outside_ab():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses_without_ab(tmpdirname)
+        units = [ET.QName(unit).localname for unit in iter_verse_elements(paths[0], [])]
+        assert units == ["app", "ab"]
+        units = [ET.QName(unit).localname for unit in iter_verse_elements(read_tei(paths[0]), [])]
+        assert units == ["app", "ab"]
+
+
+def test_do_ensemble_app_outside_ab():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses_without_ab(tmpdirname)
+        check_result(do_ensemble(paths, "X"))
+        assert contested_verses(paths, "X", remaining_weight=1.0) == ["V1"]
+
+
+def test_readings_match():
+    reference = [ET.fromstring('<rdg>Text <w>one</w></rdg>'), ET.fromstring('<rdg>Text two</rdg>')]
+    reference_strings = [reading_string(reading) for reading in reference]
+    indented = [ET.fromstring('<rdg>Text\n    <w>one</w>\n</rdg>'), ET.fromstring('<rdg>Text two</rdg>')]
+    assert readings_match(reference, reference_strings, indented)
+    assert not readings_match(reference, reference_strings, [reference[0], ET.fromstring('<rdg>Text three</rdg>')])
+
+
+def test_find_wit_detail():
+    app = ET.fromstring('<app><rdg/><witDetail wit="Y"/><witDetail wit="X"><note>x</note></witDetail></app>')
+    assert find_wit_detail(app, "X")[0].text == "x"
+    assert find_wit_detail(app, "Z") is None
+
+
+def test_do_ensemble_weights():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        result = do_ensemble(paths, "X", weights=[1.0, 3.0, 1.0])
+        readings = find_elements(result, ".//rdg")
+        assert [reading_has_witness(reading, "X") for reading in readings] == [True, False, False, False]
+
+
+def test_do_ensemble_threshold():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        result = do_ensemble(paths, "X", threshold=0.9)
+        readings = find_elements(result, ".//rdg")
+        assert [reading_has_witness(reading, "X") for reading in readings] == [False, False, False, False]
+
+
+def test_do_ensemble_abstain():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        # The third file has not been run on the second verse
+        path = paths[2]
+        path.write_text(make_apparatus([["", "X"], ["", ""]]).replace('<witDetail wit="X"><note>Note</note></witDetail></app></ab></body>', '</app></ab></body>'))
+        result = do_ensemble(paths, "X", threshold=0.6)
+        readings = find_elements(result, ".//rdg")
+        assert [reading_has_witness(reading, "X") for reading in readings] == [True, False, False, False]
+
+
+def test_app_votes_contested():
+    app_votes = AppVotes(apps=(), readings=[], votes=[2.0, 1.0, 0.0], voting_weight=3.0)
+    assert app_votes.decisions() == [True, False, False]
+    assert not app_votes.is_contested()
+    assert app_votes.is_contested(remaining_weight=1.0)
+    assert not app_votes.is_contested(remaining_weight=0.0, threshold=0.3)
+    assert app_votes.is_contested(remaining_weight=1.0, threshold=0.3)
+
+    unanimous = AppVotes(apps=(), readings=[], votes=[3.0, 0.0], voting_weight=3.0)
+    assert not unanimous.is_contested(remaining_weight=5.0)
+
+
+def test_contested_verses():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        assert contested_verses(paths, "X") == []
+        assert contested_verses(paths, "X", remaining_weight=1.0) == ["V0", "V1"]
+        assert contested_verses(paths[1:], "X", remaining_weight=1.0) == ["V0", "V1"]
+        assert contested_verses(paths[:2], "X", remaining_weight=1.0) == ["V1"]
+
+
+def test_load_weights():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        table = Path(tmpdirname)/"results.csv"
+        table.write_text(
+            "apparatus,prediction_siglum,f1\n" + 
+            "".join(f"{path},X,{index/10}\n" for index, path in enumerate(paths))
+        )
+        assert load_weights(table, paths[::-1], "X") == [0.2, 0.1, 0.0]
+
+
+def test_load_weights_prediction_siglum():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        table = Path(tmpdirname)/"results.csv"
+        table.write_text(
+            "apparatus,gold_siglum,prediction_siglum,f1\n" + 
+            "".join(f"{path},G,X,{index/10}\n{path},G,Y,0.9\n{path},H,Y,0.5\n" for index, path in enumerate(paths))
+        )
+        assert load_weights(table, paths, "X") == [0.0, 0.1, 0.2]
+        assert load_weights(table, paths, "Y", gold_siglum="H") == [0.5, 0.5, 0.5]
+        with pytest.raises(AssertionError, match="Give the gold siglum"):
+            load_weights(table, paths, "Y")
+        with pytest.raises(AssertionError, match="Could not find a score"):
+            load_weights(table, paths, "Z")
+
+
+def test_load_weights_invalid():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)[:1]
+        table = Path(tmpdirname)/"results.csv"
+        table.write_text(f"apparatus,prediction_siglum,f1\n{paths[0]},X,\n")
+        with pytest.raises(AssertionError, match="empty"):
+            load_weights(table, paths, "X")
+
+        table.write_text(f"apparatus,prediction_siglum,f1\n{paths[0]},X,nan\n")
+        with pytest.raises(AssertionError, match="not a number"):
+            load_weights(table, paths, "X")
@@ -0,0 +1,101 @@
+import math
+import tempfile
+import numpy as np
+from pathlib import Path
+from lxml import etree as ET
+import json
+from vorlagellm.evaluation import (
+    ConfusionMatrix, 
+    get_book, 
+    reading_verses, 
+    grouped_confusion_matrices, 
+    write_confusion_matrices, 
+    confusion_matrices_from_membership, 
+    write_evaluation_table,
+)
+from vorlagellm.tei import find_elements
+
+
+def test_confusion_matrix_from_masks():
+    gold = np.array([True, True, False, False, True])
+    prediction = np.array([True, False, True, False, True])
+    confusion_matrix = ConfusionMatrix.from_masks(gold, prediction)
+    assert confusion_matrix == ConfusionMatrix(true_positives=2, false_positives=1, false_negatives=1, true_negatives=1)
+    assert confusion_matrix.recall == 2/3
+    assert confusion_matrix.precision == 2/3
+    assert math.isclose(confusion_matrix.f1, 2/3)
+    assert confusion_matrix.false_positive_rate == 0.5
+    assert confusion_matrix.false_negative_rate == 1/3
+
+
+def test_confusion_matrices_from_membership():
+    gold = np.array([True, True, False, False, True])
+    predictions = np.array([
+        [True, True],
+        [False, True],
+        [True, False],
+        [False, False],
+        [True, True],
+    ])
+    result = confusion_matrices_from_membership(gold, predictions)
+    assert len(result) == 2
+    assert result[0] == ConfusionMatrix.from_masks(gold, predictions[:,0])
+    assert result[1] == ConfusionMatrix(true_positives=3, false_positives=0, false_negatives=0, true_negatives=2)
+
+
+def test_confusion_matrix_empty():
+    confusion_matrix = ConfusionMatrix.from_masks(np.zeros(0, dtype=bool), np.zeros(0, dtype=bool))
+    assert math.isnan(confusion_matrix.recall)
+    assert math.isnan(confusion_matrix.f1)
+
+
+def test_get_book():
+    assert get_book("B07K1V1") == "B07"
+    assert get_book("1Cor.1.1") == "1Cor"
+
+
+def test_grouped_confusion_matrices():
+    gold = np.array([True, True, False, False])
+    prediction = np.array([True, False, True, False])
+    labels = np.array(["V1", "V2", "V1", "V2"])
+    result = grouped_confusion_matrices(gold, prediction, labels)
+    assert list(result.keys()) == ["V1", "V2"]
+    assert result["V1"] == ConfusionMatrix(true_positives=1, false_positives=1)
+    assert result["V2"] == ConfusionMatrix(false_negatives=1, true_negatives=1)
+
+
+def test_reading_verses():
+    root = ET.fromstring("""<body>
+        <ab n="V1"><app><rdg>a</rdg><rdg>b</rdg></app></ab>
+        <ab n="V2"><app><rdg>c</rdg></app></ab>
+        <app><rdg>d</rdg></app>
+    </body>""")
+    verses = reading_verses(find_elements(root, ".//rdg"))
+    assert verses.tolist() == ["V1", "V1", "V2", ""]
+
+
+def test_write_confusion_matrices():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"by-verse.csv"
+        write_confusion_matrices({"V1": ConfusionMatrix(true_positives=1, false_positives=1)}, output)
+        lines = output.read_text().splitlines()
+        assert lines[0].startswith("verse,true_positives,false_positives,false_negatives,true_negatives,recall,precision")
+        assert lines[1].startswith("V1,1,1,0,0,1.0,0.5")
+
+
+def test_write_evaluation_table():
+    rows = [
+        dict(apparatus="a.xml", prediction_siglum="X", **ConfusionMatrix(true_positives=1).as_dict()),
+        dict(apparatus="b.xml", prediction_siglum="Y", **ConfusionMatrix(false_positives=1).as_dict()),
+    ]
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        csv_path = Path(tmpdirname)/"results.csv"
+        write_evaluation_table(rows, csv_path)
+        lines = csv_path.read_text().splitlines()
+        assert len(lines) == 3
+        assert lines[0].startswith("apparatus,prediction_siglum,true_positives")
+
+        json_path = Path(tmpdirname)/"results.json"
+        write_evaluation_table(rows, json_path)
+        data = json.loads(json_path.read_text())
+        assert [row['prediction_siglum'] for row in data] == ["X", "Y"]
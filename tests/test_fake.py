@@ -0,0 +1,107 @@
+import json
+import pytest
+
+from vorlagellm.fake import (
+    FakeAPIError,
+    FakeEmbeddings,
+    fake_response,
+    is_fake,
+    load_fake_embeddings,
+    load_fake_llm,
+    parse_fake_url,
+)
+from vorlagellm.prompts import build_source_prompt, build_corresponding_text_prompt
+from vorlagellm.scheduler import RequestScheduler, ScheduledLLM, is_retryable
+
+
+def source_prompt(structured:bool=False) -> str:
+    prompt = build_source_prompt(structured=structured, doc_language="Latin", apparatus_language="Greek")
+    return prompt.format(
+        doc_verse_text="et uocatus apostolus",
+        doc_corresponding_text="apostolus",
+        apparatus_verse_text="κλητος ⸂αποστολος⸃",
+        readings="1. αποστολος\n2. αποστολου\n3. OMISSION",
+        similar_verse_examples="",
+    )
+
+
+def test_is_fake():
+    assert is_fake("fake://model")
+    assert not is_fake("gpt-4.1")
+    assert not is_fake("")
+
+
+def test_parse_fake_url():
+    name, options = parse_fake_url("fake://model?latency=0.5&errors=rate_limit,server")
+    assert name == "model"
+    assert options == dict(latency="0.5", errors="rate_limit,server")
+
+
+def test_load_fake_llm_options():
+    llm = load_fake_llm("fake://model?latency=0.5&jitter=0.1&error_rate=0.2&errors=rate_limit,%20timeout&seed=4")
+    assert llm.latency == 0.5
+    assert llm.jitter == 0.1
+    assert llm.error_rate == 0.2
+    assert llm.errors == ["rate_limit", "timeout"]
+    assert llm.seed == 4
+
+
+def test_fake_response_source():
+    response = fake_response(source_prompt())
+    assert response == fake_response(source_prompt())
+    readings, justification = response.split("\n-----\n")
+    assert justification
+    assert all(1 <= int(reading) <= 3 for reading in readings.split(", "))
+
+
+def test_fake_response_source_structured():
+    response = json.loads(fake_response(source_prompt(structured=True)))
+    assert set(response) == {"readings", "justification"}
+    assert all(1 <= reading <= 3 for reading in response['readings'])
+
+
+def test_fake_response_corresponding_text():
+    prompt = build_corresponding_text_prompt(structured=True, doc_language="Latin", apparatus_language="Greek").format(
+        doc_verse_text="paulus uocatus apostolus",
+        reading_list="αποστολος | αποστολου",
+        permutations="παυλος κλητος ⸂αποστολος⸃",
+    )
+    text = json.loads(fake_response(prompt))['text']
+    assert text in "paulus uocatus apostolus"
+
+
+def test_fake_chat_model_invoke():
+    llm = load_fake_llm("fake://model")
+    message = llm.invoke(source_prompt())
+    assert message.content == fake_response(source_prompt())
+    assert message.usage_metadata['total_tokens'] == message.usage_metadata['input_tokens'] + message.usage_metadata['output_tokens']
+    assert llm.bind(stop=["-----"]).invoke("hello").content == "1"
+
+
+def test_fake_chat_model_errors():
+    llm = load_fake_llm("fake://model?error_rate=1&errors=server")
+    with pytest.raises(FakeAPIError) as error:
+        llm.invoke("hello")
+    assert error.value.status_code == 500
+    assert is_retryable(error.value)
+
+
+def test_fake_chat_model_errors_retried():
+    delays = []
+    scheduler = RequestScheduler(max_retries=20, sleep=delays.append)
+    llm = ScheduledLLM(load_fake_llm("fake://model?error_rate=0.5&errors=rate_limit,timeout&seed=1"), scheduler)
+    results = [llm.invoke("hello").content for _ in range(10)]
+    assert results == ["1"] * 10
+    assert scheduler.stats.retries > 0
+    assert len(delays) == scheduler.stats.retries
+
+
+def test_fake_embeddings():
+    embeddings = load_fake_embeddings("fake://embeddings?size=32")
+    assert isinstance(embeddings, FakeEmbeddings)
+    vectors = embeddings.embed_documents(["paulus apostolus", "paulus apostolus", "deus"])
+    assert len(vectors[0]) == 32
+    assert vectors[0] == vectors[1]
+    assert vectors[0] != vectors[2]
+    assert embeddings.embed_query("paulus apostolus") == vectors[0]
+    assert sum(value * value for value in vectors[0]) == pytest.approx(1.0)
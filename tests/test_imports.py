@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+from .test_tei import TEST_APPARATUS
+
+HEAVY_MODULES = ["langchain", "langchain_core", "langchain_openai", "langchain_chroma", "chromadb", "openai", "llmloader"]
+
+
+def import_times(code:str) -> dict[str, float]:
+    """ Runs Python code with `-X importtime` and returns the cumulative import time of each module in seconds. """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_main_import_time():
+    times = import_times("import vorlagellm.main")
+    assert "vorlagellm.main" in times
+    assert not [module for module in HEAVY_MODULES if module in times]
+
+
+def test_agreements_does_not_import_llm_modules():
+    code = (
+        "import sys\n"
+        "from typer.testing import CliRunner\n"
+        "from vorlagellm.main import app\n"
+        f"result = CliRunner().invoke(app, ['agreements', {str(TEST_APPARATUS)!r}, 'NA28', 'WH'])\n"
+        "assert result.exit_code == 0, result.output\n"
+        f"print([module for module in {HEAVY_MODULES!r} if module in sys.modules])\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "[]"
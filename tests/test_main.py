@@ -1,9 +1,12 @@
+import json
 import tempfile
 from typer.testing import CliRunner
 from pathlib import Path
 from vorlagellm.main import app
 from unittest.mock import patch
 
+from vorlagellm.tei import read_tei, find_element, find_elements
+
 from .test_tei import TEST_DOC, TEST_APPARATUS
 
 def my_get_llm(*args, **kwargs):
@@ -30,3 +33,450 @@ def test_main_run():
         assert result.exit_code == 0
         output_text = output.read_text()
         assert '<rdg wit="Treg NA28 #51">' in output_text
+
+
+def test_main_evaluate():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        by_verse = Path(tmpdirname)/"by-verse.csv"
+        false_positives = Path(tmpdirname)/"false-positives.xml"
+        result = runner.invoke(app, [
+            "evaluate",
+            str(TEST_APPARATUS),
+            "NA28",
+            "WH",
+            "--by-verse", str(by_verse),
+            "--false-positives", str(false_positives),
+        ])
+        assert result.exit_code == 0
+        assert "Recall:" in result.stdout
+        assert "F1:" in result.stdout
+        assert by_verse.read_text().startswith("verse,true_positives")
+        assert false_positives.exists()
+
+
+def test_main_evaluate_many():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        table = Path(tmpdirname)/"results.csv"
+        result = runner.invoke(app, [
+            "evaluate",
+            str(TEST_APPARATUS),
+            "NA28",
+            "WH",
+            "RP",
+            "Treg",
+            "--additional-apparatus", str(TEST_APPARATUS),
+            "--table", str(table),
+        ])
+        assert result.exit_code == 0
+        lines = table.read_text().splitlines()
+        assert len(lines) == 7
+        assert lines[1].split(",")[2] == "WH"
+        assert lines[1].split(",")[3:] == lines[4].split(",")[3:]
+
+
+def test_main_agreements_all():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"agreements"
+        result = runner.invoke(app, [
+            "agreements",
+            str(TEST_APPARATUS),
+            "--all",
+            "--output", str(output),
+        ])
+        assert result.exit_code == 0
+        assert "Unambiguous_Agreements" in result.stdout
+        lines = (output/"unambiguous_agreement.csv").read_text().splitlines()
+        assert lines[0] == ",WH,NA28,RP,Holmes,Treg,NIV"
+        assert len(lines) == 7
+
+
+def test_main_ensemble():
+    from .test_ensemble import write_apparatuses, check_result
+    from vorlagellm.tei import read_tei
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        output = Path(tmpdirname)/"ensemble.xml"
+        result = runner.invoke(app, ["ensemble", "X", str(output), *[str(path) for path in paths]])
+        assert result.exit_code == 0
+        check_result(read_tei(output))
+
+
+def test_main_ensemble_direct_call():
+    from vorlagellm.main import ensemble
+    from .test_ensemble import write_apparatuses, check_result
+    from vorlagellm.tei import read_tei
+
+    # The options have plain defaults so that the command can also be called as a function
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        paths = write_apparatuses(tmpdirname)
+        output = Path(tmpdirname)/"ensemble.xml"
+        ensemble("X", output, paths)
+        check_result(read_tei(output))
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_adaptive_ensemble():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"ensemble.xml"
+        result = runner.invoke(app, [
+            "adaptive-ensemble",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--model", "model1",
+            "--model", "model2",
+            "--model", "model3",
+            "--min-runs", "2",
+        ])
+        assert result.exit_code == 0
+        assert "No contested verses remain." in result.stdout
+        assert (Path(tmpdirname)/"ensemble-runs/run1.xml").exists()
+        assert not (Path(tmpdirname)/"ensemble-runs/run2.xml").exists()
+        assert '<rdg wit="Treg NA28 #51">' in output.read_text()
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_run_samples():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--samples", "3",
+            "--adaptive-samples",
+        ])
+        
+        assert result.exit_code == 0
+        assert '<rdg wit="Treg NA28 #51">' in output.read_text()
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_run_prefilter():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--prefilter",
+            "--prefilter-similarity", "0.0",
+        ])
+        
+        assert result.exit_code == 0
+        assert "The pre-filter resolved 12 <app> elements, avoiding 24 LLM calls." in result.stdout
+        output_text = output.read_text()
+        assert '<rdg wit="Treg NA28 #51">' in output_text
+        assert '<rdg wit="WH RP #51">' in output_text
+
+
+def my_cascade_get_llm(model, *args, **kwargs):
+    def my_llm(prompt):
+        if model == "large":
+            return "2"
+        return "NONE" if "Now list the numbers" in prompt.to_string() else "Corresponding text"
+
+    return my_llm
+
+
+@patch('llmloader.load', my_cascade_get_llm)
+def test_main_run_cascade():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--cascade", "small,large",
+        ])
+        
+        assert result.exit_code == 0
+        assert "13 escalations in the model cascade." in result.stdout
+        assert result.stdout.count("Corresponding text from 'large': 2") == 13
+        output_text = output.read_text()
+        assert '<rdg wit="WH RP #51">' in output_text
+        assert 'xml:id="VorlageLLM-51-small-large"' in output_text
+        assert "using LLM 'small+large'" in output_text
+
+
+def my_structured_get_llm(*args, **kwargs):
+    def my_llm(prompt):
+        if "key 'readings'" in prompt.to_string():
+            return '{"readings": [1], "justification": "The first reading."}'
+        return "not json"
+
+    return my_llm
+
+
+@patch('llmloader.load', my_structured_get_llm)
+def test_main_run_structured():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--structured",
+            "--max-reasks", "1",
+        ])
+        
+        assert result.exit_code == 0
+        stdout = " ".join(result.stdout.split())
+        assert "26 of 39 structured responses could not be parsed (failure rate 66.7%), 13 fell back to the free-text parser." in stdout
+        output_text = output.read_text()
+        assert '<rdg wit="Treg NA28 #51">' in output_text
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_run_batch_api():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--batch-api",
+            "--batch-backend", "local",
+        ])
+        
+        assert result.exit_code == 0
+        assert "Applied the batch results to 13 of 13 <app> elements." in result.stdout
+        output_text = output.read_text()
+        assert '<rdg wit="Treg NA28 #51">' in output_text
+
+        state = Path(tmpdirname)/"test-apparatus.batch.json"
+        assert state.exists()
+        assert len((Path(tmpdirname)/"test-apparatus-corresponding.jsonl").read_text().splitlines()) == 13
+        assert len((Path(tmpdirname)/"test-apparatus-source.jsonl").read_text().splitlines()) == 13
+
+
+def test_main_run_batch_api_structured():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--model", "fake://test?seed=3",
+            "--structured",
+            "--batch-api",
+            "--batch-backend", "local",
+        ])
+        
+        assert result.exit_code == 0
+        stdout = " ".join(result.stdout.split())
+        assert "cannot be re-asked with the batch API" in stdout
+        assert "0 of 26 structured responses could not be parsed" in stdout
+        requests = [json.loads(line) for line in (Path(tmpdirname)/"test-apparatus-source.jsonl").read_text().splitlines()]
+        assert requests[0]['body']['response_format'] == {"type": "json_object"}
+        assert "JSON" in requests[0]['body']['messages'][-1]['content']
+        assert len(find_elements(read_tei(output), ".//witDetail[@wit=$wit]", wit="51")) == 13
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_run_batch_api_prefilter():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--batch-api",
+            "--batch-backend", "local",
+            "--prefilter",
+            "--prefilter-similarity", "0.0",
+        ])
+        
+        assert result.exit_code == 0
+        stdout = " ".join(result.stdout.split())
+        assert "The pre-filter resolved 12 <app> elements, avoiding 24 LLM calls." in stdout
+        assert "Applied the batch results to 1 of 1 <app> elements." in stdout
+        assert len((Path(tmpdirname)/"test-apparatus-source.jsonl").read_text().splitlines()) == 1
+        output_text = output.read_text()
+        assert '<rdg wit="Treg NA28 #51">' in output_text
+        assert '<rdg wit="WH RP #51">' in output_text
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_run_batch_api_adaptive_samples():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--batch-api",
+            "--batch-backend", "local",
+            "--samples", "3",
+            "--adaptive-samples",
+        ])
+        
+        assert result.exit_code != 0
+        assert "adaptive samples" in str(result.exception)
+
+
+def test_main_run_fake_model():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--model", "fake://test?seed=3",
+            "--structured",
+            "--doc-db", str(Path(tmpdirname)/"doc-db"),
+            "--embedding-model", "fake://embeddings?size=32",
+        ])
+        
+        assert result.exit_code == 0
+        stdout = " ".join(result.stdout.split())
+        assert "0 of 26 structured responses could not be parsed" in stdout
+        output = read_tei(output)
+        assert len(find_elements(output, ".//witDetail[@wit=$wit]", wit="51")) == 13
+        assert find_element(output, ".//respStmt[@xml:id='VorlageLLM-51-fake-test-seed-3']") is not None
+
+
+def test_main_doc_db_openai_embeddings():
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    models = []
+    def my_embeddings(model):
+        models.append(model)
+        return DeterministicFakeEmbedding(size=16)
+
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname, patch('langchain_openai.OpenAIEmbeddings', my_embeddings):
+        result = runner.invoke(app, [
+            "doc-db",
+            str(TEST_DOC),
+            str(Path(tmpdirname)/"doc-db"),
+        ])
+        
+        assert result.exit_code == 0, result.output
+        assert models == ["text-embedding-3-large"]
+        assert (Path(tmpdirname)/"doc-db"/"chroma.sqlite3").exists()
+
+
+def test_main_run_trace():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        trace = Path(tmpdirname)/"trace.json"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--model", "fake://test",
+            "--trace", str(trace),
+            "--trace-format", "chrome",
+            "--no-progress",
+        ])
+        
+        assert result.exit_code == 0
+        stdout = " ".join(result.stdout.split())
+        assert "Stages of the run" in stdout
+        assert "'fake://test' was called 26 times" in stdout
+        events = json.loads(trace.read_text())['traceEvents']
+        source_events = [event for event in events if event['name'] == "source"]
+        assert len(source_events) == 13
+        assert source_events[0]['args']['verse'] == "B07K1V1"
+        retrieval_events = [event for event in events if event['name'] == "retrieval"]
+        assert len(retrieval_events) == 13
+        assert [event['args']['app'] for event in retrieval_events] == [event['args']['app'] for event in source_events]
+
+
+def test_main_run_no_metrics():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        trace = Path(tmpdirname)/"trace.jsonl"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--model", "fake://test",
+            "--trace", str(trace),
+            "--no-progress",
+            "--no-metrics",
+        ])
+        
+        assert result.exit_code == 0
+        assert "Stages of the run" not in result.stdout
+        assert "was called" not in result.stdout
+        assert trace.exists()
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_plan_and_run():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        plan = Path(tmpdirname)/"plan.jsonl"
+        result = runner.invoke(app, [
+            "plan",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(plan),
+        ])
+        assert result.exit_code == 0
+        assert "Wrote a plan for 13 <app> elements" in result.stdout
+        assert len(plan.read_text().splitlines()) == 14
+
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(output),
+            "--plan", str(plan),
+            "--workers", "4",
+        ])
+        
+        assert result.exit_code == 0
+        output_text = output.read_text()
+        assert '<rdg wit="Treg NA28 #51">' in output_text
+        assert output_text.count('<witDetail wit="51"') == 13
+
+
+@patch('llmloader.load', my_get_llm)
+def test_main_plan_different_siglum():
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        plan = Path(tmpdirname)/"plan.jsonl"
+        result = runner.invoke(app, ["plan", str(TEST_DOC), str(TEST_APPARATUS), str(plan), "--siglum", "X"])
+        assert result.exit_code == 0
+
+        result = runner.invoke(app, [
+            "run",
+            str(TEST_DOC),
+            str(TEST_APPARATUS),
+            str(Path(tmpdirname)/"test-apparatus.xml"),
+            "--plan", str(plan),
+        ])
+        assert result.exit_code != 0
+        assert "was made for the siglum 'X' and not '51'" in str(result.exception)
@@ -0,0 +1,115 @@
+import json
+from langchain_core.messages import AIMessage
+from rich.console import Console
+
+from vorlagellm.metrics import RunMetrics, usage_tokens, cached_tokens, percentile, stage
+
+
+class FakeClock():
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_usage_tokens():
+    message = AIMessage(content="1", usage_metadata=dict(input_tokens=10, output_tokens=2, total_tokens=12))
+    assert usage_tokens(message) == (10, 2)
+    message = AIMessage(content="1", response_metadata=dict(token_usage=dict(prompt_tokens=7, completion_tokens=3)))
+    assert usage_tokens(message) == (7, 3)
+    assert usage_tokens("1") is None
+
+
+def test_cached_tokens():
+    message = AIMessage(content="1", usage_metadata=dict(input_tokens=10, output_tokens=2, total_tokens=12, input_token_details=dict(cache_read=8)))
+    assert cached_tokens(message) == 8
+    message = AIMessage(content="1", response_metadata=dict(token_usage=dict(prompt_tokens=7, completion_tokens=3, prompt_tokens_details=dict(cached_tokens=4))))
+    assert cached_tokens(message) == 4
+    assert cached_tokens(AIMessage(content="1")) == 0
+    assert cached_tokens("1") == 0
+
+
+def test_run_metrics_cache_hit_rate():
+    metrics = RunMetrics()
+    assert metrics.cache_hit_rate() is None
+    metrics.record_usage("gpt", AIMessage(content="1", usage_metadata=dict(input_tokens=100, output_tokens=5, total_tokens=105, input_token_details=dict(cache_read=75))))
+    metrics.record_usage("gpt", AIMessage(content="1", usage_metadata=dict(input_tokens=100, output_tokens=5, total_tokens=105)))
+    assert metrics.cache_hit_rate() == 0.375
+    assert "37.5% of the prompt tokens were read from the prompt cache." in metrics.summary_lines()
+
+
+def test_percentile():
+    assert percentile([], 0.95) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 0.5) == 2.0
+    assert percentile(list(range(1, 101)), 0.95) == 95
+
+
+def test_run_metrics_stages():
+    clock = FakeClock()
+    metrics = RunMetrics(clock=clock)
+    with metrics.stage("source", app=3, verse="B07K1V1"):
+        clock.time += 0.5
+    with metrics.stage("source", app=4, verse="B07K1V1"):
+        clock.time += 1.5
+    with stage(metrics, "write_tei"):
+        clock.time += 0.25
+    with stage(None, "write_tei"):
+        clock.time += 1.0
+
+    assert metrics.stage_durations() == dict(source=[0.5, 1.5], write_tei=[0.25])
+    assert metrics.stages[1].start == 0.5
+    assert metrics.stages[1].args == dict(app=4, verse="B07K1V1")
+
+
+def test_run_metrics_summary():
+    clock = FakeClock()
+    metrics = RunMetrics(clock=clock)
+    with metrics.stage("corresponding_text", app=0):
+        clock.time += 2.0
+    metrics.record_usage("gpt", AIMessage(content="1", usage_metadata=dict(input_tokens=100, output_tokens=5, total_tokens=105)))
+    metrics.record_usage("gpt", AIMessage(content="2", usage_metadata=dict(input_tokens=50, output_tokens=5, total_tokens=55)))
+    metrics.record_usage("mock", "1")
+    metrics.count("similarity searches", 3)
+
+    assert metrics.token_totals() == dict(gpt=(150, 10))
+    assert metrics.summary_lines() == [
+        "'gpt' was called 2 times and used 150 prompt tokens and 10 completion tokens.",
+        "'mock' was called 1 times.",
+        "Counts: similarity searches: 3",
+    ]
+
+    console = Console(width=120, record=True)
+    metrics.print_summary(console)
+    text = console.export_text()
+    assert "corresponding_text" in text
+    assert "2000.0" in text
+
+
+def test_run_metrics_write_trace(tmp_path):
+    clock = FakeClock()
+    metrics = RunMetrics(clock=clock)
+    clock.time = 1.0
+    with metrics.stage("source", app=1):
+        clock.time += 0.5
+    metrics.record_usage("gpt", AIMessage(content="1", usage_metadata=dict(input_tokens=100, output_tokens=5, total_tokens=105)))
+    metrics.count("similar verses retrieved", 2)
+
+    jsonl = tmp_path/"trace.jsonl"
+    metrics.write_trace(jsonl)
+    records = [json.loads(line) for line in jsonl.read_text().splitlines()]
+    assert records[0]['type'] == "stage"
+    assert records[0]['stage'] == "source"
+    assert records[0]['app'] == 1
+    assert records[0]['start'] == 1.0
+    assert records[1] == dict(type="tokens", model="gpt", time=1.5, input_tokens=100, output_tokens=5, cached_tokens=0)
+    assert dict(type="count", name="similar verses retrieved", value=2) in records
+
+    chrome = tmp_path/"trace.json"
+    metrics.write_trace(chrome, format="chrome")
+    events = json.loads(chrome.read_text())['traceEvents']
+    assert events[0]['ph'] == "X"
+    assert events[0]['ts'] == 1.0e6
+    assert events[0]['dur'] == 0.5e6
+    assert events[1]['ph'] == "C"
+    assert events[1]['args'] == {"gpt prompt": 100, "gpt completion": 5}
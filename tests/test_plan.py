@@ -0,0 +1,39 @@
+from vorlagellm.tei import read_tei, find_elements
+from vorlagellm.plan import iter_plan_rows, write_plan, read_plan, similar_verse_examples_text
+
+from .test_tei import TEST_DOC, TEST_APPARATUS
+
+
+def test_iter_plan_rows():
+    doc = read_tei(TEST_DOC)
+    apparatus = read_tei(TEST_APPARATUS)
+    apps = find_elements(apparatus, ".//app")
+    rows = list(iter_plan_rows(doc, apparatus, apps, siglum="51", doc_language="Arabic", apparatus_language="Greek"))
+    assert len(rows) == len(apps)
+    assert [row['index'] for row in rows] == list(range(len(apps)))
+    row = rows[0]
+    assert row['readings'].startswith("1. ")
+    assert "⸂" in row['permutations']
+    assert row['similar_verse_context'] == ""
+
+
+def test_iter_plan_rows_include():
+    doc = read_tei(TEST_DOC)
+    apparatus = read_tei(TEST_APPARATUS)
+    apps = find_elements(apparatus, ".//app")
+    verse = next(iter_plan_rows(doc, apparatus, apps, siglum="51", doc_language="Arabic", apparatus_language="Greek"))['verse']
+    rows = list(iter_plan_rows(doc, apparatus, apps, siglum="51", doc_language="Arabic", apparatus_language="Greek", include=[verse]))
+    assert rows
+    assert all(row['verse'] == verse for row in rows)
+
+
+def test_write_read_plan(tmp_path):
+    rows = [dict(index=0, verse="B10K1V1", readings="1. α\n")]
+    assert write_plan(dict(apps=1), iter(rows), tmp_path/"plan.jsonl") == 1
+    assert read_plan(tmp_path/"plan.jsonl") == (dict(apps=1), rows)
+
+
+def test_similar_verse_examples_text():
+    assert similar_verse_examples_text("", "verse", "text", "app", "1. a", "Arabic", "Greek") == ""
+    examples = similar_verse_examples_text("Examples\n", "verse", "text", "app", "1. a", "Arabic", "Greek")
+    assert examples.startswith("Examples\nHere is the Arabic text to analyze:\ntext")
@@ -0,0 +1,31 @@
+from vorlagellm.prefilter import normalize_reading_text, readings_indistinguishable
+
+
+def test_normalize_reading_text():
+    assert normalize_reading_text("Ἰησοῦ Χριστοῦ,") == "ιησου χριστου"
+    assert normalize_reading_text("  Paulus   uocatus. ") == "paulus uocatus"
+    assert normalize_reading_text("") == ""
+    assert normalize_reading_text(None) == ""
+
+
+def test_normalize_reading_text_final_sigma():
+    assert normalize_reading_text("Παῦλος") == normalize_reading_text("ΠΑΥΛΟΣ")
+
+
+def test_readings_indistinguishable_orthography():
+    assert readings_indistinguishable(["Ἰησοῦ", "Ιησου"])
+    assert readings_indistinguishable(["ἀπόστολος", "αποστολος", "ἀπόστολος."])
+
+
+def test_readings_indistinguishable_similar():
+    assert readings_indistinguishable(["Ἱεροσόλυμα", "Ἱεροσολυμα"])
+    assert readings_indistinguishable(["Ἰσραήλ", "Ἰσραὴλ", "Ισραηλ"])
+    assert not readings_indistinguishable(["Δαυίδ", "Δαυείδ"])
+    assert readings_indistinguishable(["Δαυίδ", "Δαυείδ"], min_similarity=0.8)
+    assert not readings_indistinguishable(["Δαυίδ", "Δαυείδ"], min_similarity=0.95)
+
+
+def test_readings_distinguishable():
+    assert not readings_indistinguishable(["Χριστοῦ Ἰησοῦ", "Ἰησοῦ Χριστοῦ"])
+    assert not readings_indistinguishable(["αὐτῶν", "αὐτῶν τε"])
+    assert not readings_indistinguishable(["αὐτῶν", ""])
@@ -0,0 +1,97 @@
+import pstats
+import sys
+import tracemalloc
+import pytest
+from typer.testing import CliRunner
+
+from vorlagellm.main import app
+from vorlagellm.tei import read_tei, get_verses
+from vorlagellm.profiling import profile_format, start_profiler, start_memory_profiler, package_allocations, format_size, PeakSampler, PACKAGE_DIRECTORY
+
+from .test_tei import TEST_APPARATUS
+
+
+def test_profile_format():
+    assert profile_format("run.prof") == "pstats"
+    assert profile_format("run.pstats") == "pstats"
+    assert profile_format("run.speedscope.json") == "speedscope"
+
+
+def test_format_size():
+    assert format_size(512) == "512.0 B"
+    assert format_size(2048) == "2.0 KiB"
+    assert format_size(3 * 1024**3) == "3.0 GiB"
+
+
+def test_main_profile(tmp_path):
+    profile = tmp_path/"agreements.prof"
+    result = CliRunner().invoke(app, ["--profile", str(profile), "agreements", str(TEST_APPARATUS), "--all"])
+    assert result.exit_code == 0
+    stats = pstats.Stats(str(profile))
+    assert any(function_name == "all_witness_agreements" for _, _, function_name in stats.stats)
+
+
+def test_main_profile_memory(tmp_path):
+    report = tmp_path/"memory.txt"
+    result = CliRunner().invoke(app, ["--profile-memory", str(report), "agreements", str(TEST_APPARATUS), "--all"])
+    assert result.exit_code == 0
+    assert not tracemalloc.is_tracing()
+    text = report.read_text()
+    assert text.startswith("Peak traced memory: ")
+    assert "Top 25 lines of VorlageLLM" in text
+
+
+def test_package_allocations():
+    tracemalloc.start(25)
+    try:
+        verses = get_verses(read_tei(TEST_APPARATUS))
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    allocations = package_allocations(snapshot)
+    assert allocations
+    assert all(filename.startswith(PACKAGE_DIRECTORY) for filename, _ in allocations)
+    assert any(filename.endswith("tei.py") for filename, _ in allocations)
+
+
+def test_start_memory_profiler(tmp_path):
+    report = tmp_path/"memory.txt"
+    stop = start_memory_profiler(report, top=3)
+    data = [bytes(1000) for _ in range(100)]
+    stop()
+    assert not tracemalloc.is_tracing()
+    text = report.read_text()
+    assert "Top 3 lines by memory allocated during the command and held at the largest sampled point" in text
+    assert "Top 3 lines by memory allocated during the command and still held at the end" in text
+
+
+def test_peak_sampler():
+    tracemalloc.start(5)
+    try:
+        sampler = PeakSampler(interval=60)
+        sampler.start()
+        data = [bytes(1000) for _ in range(1000)]
+        sampler.sample()
+        peak_size = sampler.size
+        del data
+        sampler.stop()
+    finally:
+        tracemalloc.stop()
+    assert sampler.size == peak_size >= 1000 * 1000
+    statistics = sampler.snapshot.statistics("lineno")
+    assert any(statistic.traceback[0].filename == __file__ and statistic.size >= 1000 * 1000 for statistic in statistics)
+
+
+def test_start_profiler_speedscope_missing(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyinstrument", None)
+    with pytest.raises(ImportError, match="pyinstrument"):
+        start_profiler(tmp_path/"profile.json")
+
+
+def test_start_profiler_speedscope(tmp_path):
+    pytest.importorskip("pyinstrument")
+    path = tmp_path/"profile.json"
+    stop = start_profiler(path)
+    sum(range(100000))
+    stop()
+    assert "speedscope" in path.read_text()
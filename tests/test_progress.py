@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import AIMessage
+
+from vorlagellm.metrics import RunMetrics
+from vorlagellm.progress import RunProgress, format_duration, format_count
+
+
+class FakeClock():
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_format_duration():
+    assert format_duration(None) == "-:--:--"
+    assert format_duration(0) == "0:00:00"
+    assert format_duration(3725.4) == "1:02:05"
+
+
+def test_format_count():
+    assert format_count(12) == "12"
+    assert format_count(1520) == "1.5k"
+    assert format_count(2_300_000) == "2.3M"
+
+
+def test_run_progress_out_of_order():
+    clock = FakeClock()
+    progress = RunProgress(4, clock=clock, disable=True)
+    assert progress.eta() is None
+
+    clock.time = 30.0
+    progress.complete(3)
+    progress.complete(1)
+    progress.complete(3)
+    assert progress.completed_count == 2
+    assert progress.units_per_minute() == 4.0
+    assert progress.eta() == 30.0
+    assert progress.progress.tasks[0].completed == 2
+
+    progress.complete(0)
+    progress.complete(2)
+    assert progress.eta() == 0.0
+
+
+def test_run_progress_skip():
+    clock = FakeClock()
+    progress = RunProgress(6, clock=clock, disable=True)
+    progress.skip(0)
+    progress.skip(1)
+    progress.skip(1)
+    assert progress.completed_count == 2
+    assert progress.processed_count == 0
+    assert progress.units_per_minute() == 0.0
+    assert progress.eta() is None
+
+    clock.time = 30.0
+    progress.complete(2)
+    progress.complete(0)
+    assert progress.completed_count == 3
+    assert progress.processed_count == 1
+    assert progress.units_per_minute() == 2.0
+    assert progress.eta() == 90.0
+    assert progress.progress.tasks[0].completed == 3
+
+
+def test_run_progress_threads():
+    progress = RunProgress(200, disable=True)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(progress.complete, reversed(range(200))))
+    assert progress.completed_count == 200
+    assert progress.eta() == 0.0
+
+
+def test_run_progress_tokens_and_cache():
+    clock = FakeClock()
+    metrics = RunMetrics()
+    progress = RunProgress(10, metrics=metrics, clock=clock, disable=True)
+    assert progress.cache_hit_rate() is None
+
+    metrics.record_usage("gpt", AIMessage(content="1", usage_metadata=dict(input_tokens=1000, output_tokens=200, total_tokens=1200, input_token_details=dict(cache_read=500))))
+    clock.time = 30.0
+    progress.complete(0)
+    assert progress.tokens_per_minute() == 2400.0
+    assert progress.cache_hit_rate() == 0.5
+    assert progress.status() == "ETA 0:04:30 • 2.0 apps/min • 2.4k tokens/min • cache 50%"
+
+
+def test_run_progress_set_total():
+    progress = RunProgress(10, disable=True)
+    progress.set_total(3)
+    assert progress.total == 3
+    assert progress.progress.tasks[0].total == 3
@@ -0,0 +1,69 @@
+from lxml import etree as ET
+
+from vorlagellm.queries import compile_query, query, query_first, Query
+
+TEI_NAMESPACE = "http://www.tei-c.org/ns/1.0"
+
+XML = f"""
+<TEI xmlns="{TEI_NAMESPACE}">
+    <teiHeader><title type="document" n="51"/></teiHeader>
+    <text>
+        <ab n="B07K1V1"><app><rdg wit="O'Brien">a</rdg><rdg wit="WH">b</rdg></app></ab>
+        <ab n="B07K1V2"><app><lem>c</lem><rdg wit="WH">d</rdg></app></ab>
+    </text>
+</TEI>
+"""
+
+
+def parse():
+    return ET.ElementTree(ET.fromstring(XML))
+
+
+def test_compile_query_cached():
+    assert compile_query(".//rdg", TEI_NAMESPACE) is compile_query(".//rdg", TEI_NAMESPACE)
+    assert compile_query(".//rdg", TEI_NAMESPACE) is not compile_query(".//rdg", None)
+
+
+def test_query():
+    doc = parse()
+    assert [reading.text for reading in query(doc, ".//rdg")] == ["a", "b", "d"]
+    assert query(doc, ".//ab[@n=$verse]", verse="B07K1V2")[0].attrib['n'] == "B07K1V2"
+    assert query_first(doc, ".//title[@type='document']").attrib['n'] == "51"
+
+
+def test_query_not_self():
+    doc = parse()
+    app = query_first(doc, ".//app")
+    assert query(app, ".//app") == []
+
+
+def test_query_apostrophe():
+    doc = parse()
+    assert query_first(doc, ".//rdg[@wit=$wit]", wit="O'Brien").text == "a"
+    assert query_first(doc, ".//rdg[@wit=$wit]", wit="O") is None
+
+
+def test_query_xml_id():
+    doc = parse()
+    ab = query_first(doc, ".//ab")
+    ab.attrib["{http://www.w3.org/XML/1998/namespace}id"] = "first"
+    assert query_first(doc, ".//ab[@xml:id=$xml_id]", xml_id="first") is ab
+
+
+def test_query_first_falls_back_to_no_namespace():
+    doc = parse()
+    app = query_first(doc, ".//app")
+    wit_detail = ET.SubElement(app, "witDetail", wit="51")
+    assert query(app, ".//witDetail") == []
+    assert query_first(app, ".//witDetail[@wit=$wit]", wit="51") is wit_detail
+
+
+def test_query_no_namespace():
+    doc = ET.fromstring("<ab><app><rdg>a</rdg></app></ab>")
+    assert [reading.text for reading in query(doc, ".//rdg")] == ["a"]
+
+
+def test_query_xpath_fallback():
+    query_object = Query(".//app/rdg[2]", TEI_NAMESPACE)
+    assert query_object.xpath is not None
+    assert [reading.text for reading in query(parse(), ".//app/rdg[2]")] == ["b"]
@@ -0,0 +1,151 @@
+import pytest
+from langchain_core.prompt_values import StringPromptValue
+
+from vorlagellm.scheduler import (
+    TokenBucket,
+    RequestScheduler,
+    ScheduledLLM,
+    estimate_tokens,
+    is_retryable,
+    backoff_delay,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class BadRequestError(Exception):
+    status_code = 400
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("a" * 40) == 10
+    assert estimate_tokens("a" * 41) == 11
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)
+    for _ in range(60):
+        assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    clock.now += 10
+    assert bucket.reserve(1) == 0
+
+
+def test_token_bucket_large_request():
+    clock = FakeClock()
+    bucket = TokenBucket(100, clock=clock)
+    # requests larger than the capacity are capped so that they do not wait forever
+    assert bucket.reserve(1000) == 0
+    assert bucket.reserve(50) == pytest.approx(30.0)
+
+
+def test_is_retryable():
+    assert is_retryable(RateLimitError())
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(BadRequestError())
+    assert not is_retryable(ValueError())
+
+    class APIConnectionError(Exception):
+        pass
+
+    assert is_retryable(APIConnectionError())
+
+
+def test_is_retryable_status_codes():
+    from vorlagellm.fake import FakeAPIError
+
+    assert is_retryable(FakeAPIError("Rate limit", status_code=429))
+    assert is_retryable(FakeAPIError("Timeout", status_code=408))
+    assert is_retryable(FakeAPIError("Server error", status_code=503))
+    assert not is_retryable(FakeAPIError("Conflict", status_code=409))
+    assert not is_retryable(FakeAPIError("Bad request", status_code=400))
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, initial_backoff=1.0, max_backoff=8.0) <= min(8.0, 2 ** attempt)
+
+
+def test_scheduler_requests_per_minute():
+    clock = FakeClock()
+    scheduler = RequestScheduler(requests_per_minute=30, clock=clock, sleep=clock.sleep)
+    for _ in range(31):
+        scheduler.call(lambda: None)
+    assert clock.sleeps == [pytest.approx(2.0)]
+    assert scheduler.stats.requests == 31
+
+
+def test_scheduler_tokens_per_minute():
+    clock = FakeClock()
+    scheduler = RequestScheduler(tokens_per_minute=1000, clock=clock, sleep=clock.sleep)
+    scheduler.call(lambda: None, tokens=900)
+    scheduler.call(lambda: None, tokens=200)
+    assert clock.sleeps == [pytest.approx(6.0)]
+    assert scheduler.stats.tokens == 1100
+
+
+def test_scheduler_retries():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_retries=3, clock=clock, sleep=clock.sleep)
+    errors = [RateLimitError(), RateLimitError()]
+
+    def request():
+        if errors:
+            raise errors.pop()
+        return "done"
+
+    assert scheduler.call(request) == "done"
+    assert scheduler.stats.retries == 2
+    assert len(clock.sleeps) == 2
+
+
+def test_scheduler_gives_up():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_retries=2, clock=clock, sleep=clock.sleep)
+
+    def request():
+        raise RateLimitError()
+
+    with pytest.raises(RateLimitError):
+        scheduler.call(request)
+    assert scheduler.stats.retries == 2
+
+
+def test_scheduler_does_not_retry_other_errors():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_retries=2, clock=clock, sleep=clock.sleep)
+
+    def request():
+        raise BadRequestError()
+
+    with pytest.raises(BadRequestError):
+        scheduler.call(request)
+    assert scheduler.stats.retries == 0
+
+
+def test_scheduled_llm():
+    clock = FakeClock()
+    scheduler = RequestScheduler(tokens_per_minute=60, clock=clock, sleep=clock.sleep)
+    llm = ScheduledLLM(lambda prompt: prompt.to_string().upper(), scheduler)
+    assert llm.invoke(StringPromptValue(text="a" * 200)) == "A" * 200
+    assert llm.batch([StringPromptValue(text="b"), StringPromptValue(text="c")]) == ["B", "C"]
+    assert scheduler.stats.requests == 3
+    assert scheduler.stats.tokens == 52
@@ -0,0 +1,106 @@
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+from vorlagellm.agreements import all_witness_agreements, count_witness_agreements, get_all_sigla
+from vorlagellm.snapshot import build_snapshot, load_snapshot, snapshot_cache_path, clear_snapshot_cache, default_cache_directory, TeiSnapshot
+from vorlagellm.tei import read_tei, find_elements, extract_text, get_verses, get_verse_text, witness_matrix
+from vorlagellm.evaluation import reading_verses
+
+from .test_tei import TEST_DOC, TEST_APPARATUS
+
+
+def test_build_snapshot_apparatus():
+    apparatus = read_tei(TEST_APPARATUS)
+    snapshot = build_snapshot(apparatus)
+    readings = find_elements(apparatus, ".//rdg")
+    apps = find_elements(apparatus, ".//app")
+
+    assert snapshot.verses == get_verses(apparatus)
+    assert snapshot.reading_texts == [extract_text(reading) for reading in readings]
+    assert snapshot.reading_verses == list(reading_verses(readings))
+    assert len(snapshot.app_readings()) == len(apps)
+    assert snapshot.app_reading_texts()[0] == [extract_text(reading) for reading in find_elements(apps[0], ".//rdg")]
+    assert (snapshot.witness_matrix(["NA28", "WH"]) == witness_matrix(readings, ["NA28", "WH"])).all()
+    assert snapshot.witness_list == ["WH", "NA28", "RP", "Holmes", "Treg", "NIV"]
+
+
+def test_build_snapshot_doc():
+    doc = read_tei(TEST_DOC)
+    snapshot = build_snapshot(doc)
+    for verse in snapshot.verses:
+        assert snapshot.verse_text(verse) == get_verse_text(doc, verse)
+    assert snapshot.verse_text("missing") is None
+
+
+def test_agreements_snapshot():
+    apparatus = read_tei(TEST_APPARATUS)
+    snapshot = build_snapshot(apparatus)
+    assert get_all_sigla(snapshot) == get_all_sigla(apparatus)
+    assert count_witness_agreements(snapshot, "NA28", "WH") == count_witness_agreements(apparatus, "NA28", "WH")
+    sigla, results = all_witness_agreements(apparatus)
+    snapshot_sigla, snapshot_results = all_witness_agreements(snapshot)
+    assert sigla == snapshot_sigla
+    assert all((results[category] == snapshot_results[category]).all() for category in results)
+
+
+def test_load_snapshot_cache(tmp_path):
+    path = tmp_path/"apparatus.xml"
+    shutil.copyfile(TEST_APPARATUS, path)
+    cache_directory = tmp_path/"cache"
+
+    snapshot = load_snapshot(path, cache=True, cache_directory=cache_directory)
+    assert isinstance(snapshot, TeiSnapshot)
+    assert snapshot_cache_path(path, cache_directory).exists()
+
+    # Loaded from the cache without parsing the file
+    with patch("vorlagellm.snapshot.read_tei", side_effect=AssertionError("parsed")):
+        assert load_snapshot(path, cache=True, cache_directory=cache_directory) == snapshot
+
+        # The contents are the same after touching the file
+        os.utime(path, ns=(0, 0))
+        assert load_snapshot(path, cache=True, cache_directory=cache_directory) == snapshot
+
+    # The snapshot is rebuilt when the file changes
+    path.write_text(path.read_text().replace('wit="WH', 'wit="XX'))
+    changed = load_snapshot(path, cache=True, cache_directory=cache_directory)
+    assert "XX" in get_all_sigla(changed)
+
+
+def test_load_snapshot_no_cache(tmp_path):
+    snapshot = load_snapshot(TEST_APPARATUS, cache=False, cache_directory=tmp_path)
+    assert snapshot.verses
+    assert not list(tmp_path.iterdir())
+
+
+def test_load_snapshot_corrupt_cache(tmp_path):
+    cache_path = snapshot_cache_path(TEST_APPARATUS, tmp_path)
+    cache_path.write_bytes(b"not a pickle")
+    snapshot = load_snapshot(TEST_APPARATUS, cache=True, cache_directory=tmp_path)
+    assert snapshot.verses
+
+
+def test_load_snapshot_default_no_cache():
+    load_snapshot(TEST_APPARATUS)
+    assert not default_cache_directory().exists()
+
+
+def test_clear_snapshot_cache(tmp_path):
+    assert clear_snapshot_cache(tmp_path/"missing") == 0
+    load_snapshot(TEST_APPARATUS, cache=True, cache_directory=tmp_path)
+    assert clear_snapshot_cache(tmp_path) == 1
+    assert not list(tmp_path.glob("*.pickle"))
+
+
+def test_main_clear_cache():
+    from typer.testing import CliRunner
+    from vorlagellm.main import app
+
+    runner = CliRunner()
+    assert runner.invoke(app, ["agreements", str(TEST_APPARATUS), "NA28", "WH", "--cache"]).exit_code == 0
+    assert len(list(default_cache_directory().glob("*.pickle"))) == 1
+    result = runner.invoke(app, ["clear-cache"])
+    assert result.exit_code == 0
+    assert "Deleted 1 cached snapshots" in result.stdout
+    assert not list(default_cache_directory().glob("*.pickle"))
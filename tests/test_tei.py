@@ -13,15 +13,26 @@ from vorlagellm.tei import (
     find_elements,
     add_wit_detail,
     reading_has_witness,
+    reading_witnesses,
+    witness_matrix,
+    add_witness_readings,
+    remove_witnesss_readings,
     find_parent,
     app_has_witness,
+    get_witnessed_app_indexes,
     write_elements,
     get_apparatus_verse_text,
+    get_apparatus_verse_texts,
+    local_name,
+    element_local_name,
     readings_for_witness,
     add_responsibility_statement_llm,
     add_doc_metadata,
+    detect_compression,
 )
 from pathlib import Path
+import gzip
+import pytest
 from lxml import etree as ET
 from lxml.etree import Element
 from lxml.etree import _ElementTree as ElementTree
@@ -105,6 +116,60 @@ def test_write_tei():
         assert has_witness(new_apparatus, "51")
 
 
+def test_write_tei_compact():
+    apparatus = read_tei(TEST_APPARATUS)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        pretty = Path(tmpdirname)/"pretty.xml"
+        compact = Path(tmpdirname)/"compact.xml"
+        write_tei(apparatus, pretty)
+        write_tei(apparatus, compact, pretty_print=False)
+        assert compact.stat().st_size < pretty.stat().st_size
+        assert ET.tostring(read_tei(compact)) == ET.tostring(read_tei(pretty))
+
+
+@pytest.mark.parametrize("suffix,compression", [(".xml.gz", "gzip"), (".xml.zst", "zstd")])
+def test_write_tei_compressed(suffix, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    apparatus = read_tei(TEST_APPARATUS)
+    add_siglum(apparatus, "51")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/f"test-apparatus{suffix}"
+        write_tei(apparatus, output, pretty_print=False)
+        assert detect_compression(output) == compression
+        new_apparatus = read_tei(output)
+        assert has_witness(new_apparatus, "51")
+        assert ET.tostring(new_apparatus) == ET.tostring(apparatus)
+
+
+def test_read_tei_detects_compression():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"compressed.xml"
+        output.write_bytes(gzip.compress(TEST_APPARATUS.read_bytes()))
+        assert detect_compression(output) == "gzip"
+        assert detect_compression(TEST_APPARATUS) is None
+        assert len(find_elements(read_tei(output), ".//app")) == len(find_elements(read_tei(TEST_APPARATUS), ".//app"))
+
+
+def test_write_tei_atomic():
+    class Interrupted():
+        def write(self, f, **kwargs):
+            f.write(b"<partial")
+            raise RuntimeError("interrupted")
+
+    apparatus = read_tei(TEST_APPARATUS)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        output = Path(tmpdirname)/"test-apparatus.xml"
+        write_tei(apparatus, output)
+        original = output.read_bytes()
+
+        with pytest.raises(RuntimeError):
+            write_tei(Interrupted(), output)
+
+        assert output.read_bytes() == original
+        assert [path.name for path in Path(tmpdirname).iterdir()] == ["test-apparatus.xml"]
+
+
 def test_add_with_detail():
     apparatus = read_tei(TEST_APPARATUS)
     apps = find_elements(apparatus, ".//app")
@@ -146,6 +211,36 @@ def test_reading_has_witness_with_multiple_witnesses():
 
 
 
+def test_reading_witnesses_in_sync():
+    reading = Element('rdg', wit="#NIV #WH")
+    assert reading_witnesses(reading) == frozenset(["#NIV", "#WH"])
+    add_witness_readings(reading, "Treg")
+    assert reading_witnesses(reading) == frozenset(["#NIV", "#WH", "#Treg"])
+    assert reading_has_witness(reading, "Treg")
+    remove_witnesss_readings(reading, "NIV")
+    assert reading_witnesses(reading) == frozenset(["#WH", "#Treg"])
+    assert not reading_has_witness(reading, "NIV")
+
+
+def test_reading_witnesses_without_wit_attribute():
+    assert reading_witnesses(Element('rdg')) == frozenset()
+
+
+def test_witness_matrix():
+    readings = [
+        Element('rdg', wit="#NIV #WH"),
+        Element('rdg', wit="Treg"),
+        Element('rdg'),
+    ]
+    matrix = witness_matrix(readings, ["NIV", "WH", "Treg", "RP"])
+    assert matrix.dtype == bool
+    assert matrix.tolist() == [
+        [True, True, False, False],
+        [False, False, True, False],
+        [False, False, False, False],
+    ]
+
+
 def test_find_parent_ab():
     xml_data = """
     <root>
@@ -318,6 +413,34 @@ def test_app_has_witness_multiple_sigla():
     assert app_has_witness(app, siglum) == True
 
 
+def test_get_witnessed_app_indexes():
+    xml_str = """
+    <ab>
+        <app>
+            <rdg wit="A B">Text 1</rdg>
+            <rdg wit="C">Text 2</rdg>
+        </app>
+        <app>
+            <rdg wit="C">Text 3</rdg>
+        </app>
+        <app>
+            <rdgGrp><rdg wit="#B">Text 4</rdg></rdgGrp>
+        </app>
+    </ab>
+    """
+    ab = ET.fromstring(xml_str)
+    assert get_witnessed_app_indexes(ab, "B") == {0, 2}
+    assert get_witnessed_app_indexes(ab, "C") == {0, 1}
+    assert get_witnessed_app_indexes(ab, "D") == set()
+
+
+def test_get_witnessed_app_indexes_apparatus():
+    apparatus = read_tei(TEST_APPARATUS)
+    apps = find_elements(apparatus, ".//app")
+    assert get_witnessed_app_indexes(apparatus, "NA28") == set(range(len(apps)))
+    assert get_witnessed_app_indexes(apparatus, "51") == set()
+
+
 def test_extract_text_app_plain():
     xml_str = """
         <app>with apparatus</app> 
@@ -548,3 +671,44 @@ def test_add_responsibility_statement_llm_test_doc():
     assert result[0].tag == "resp"
     assert "Witness 'A' added using VorlageLLM using LLM 'model_123'" == result[0].text
 
+
+
+def test_get_apparatus_verse_text_multiple_apps():
+    xml_str = """
+    <ab>
+        A <app><lem>first</lem><rdg>one</rdg></app> B
+        <app><rdg>second</rdg><rdg>two</rdg></app> C
+        <app><lem>third</lem></app> D
+    </ab>
+    """
+    parser = ET.XMLParser(remove_blank_text=True)
+    verse = ET.fromstring(xml_str, parser=parser)
+    apps = verse.findall('.//app')
+    expected = [
+        "A ⸂first⸃ B second C third D",
+        "A first B ⸂second⸃ C third D",
+        "A first B second C ⸂third⸃ D",
+    ]
+    assert [get_apparatus_verse_text(app) for app in apps] == expected
+    texts = get_apparatus_verse_texts(verse)
+    assert [texts[app] for app in apps] == expected
+
+
+def test_get_apparatus_verse_text_witness():
+    xml_str = """
+    <ab>
+        A <app><lem>first</lem><rdg wit="X">one</rdg></app> B
+        <app><lem>second</lem><rdg>two</rdg></app> C
+    </ab>
+    """
+    parser = ET.XMLParser(remove_blank_text=True)
+    verse = ET.fromstring(xml_str, parser=parser)
+    app = verse.findall('.//app')[1]
+    assert get_apparatus_verse_text(app, witness="X") == "A one B ⸂second⸃ C"
+
+
+def test_local_name():
+    assert local_name("{http://www.tei-c.org/ns/1.0}app") == "app"
+    assert local_name("app") == "app"
+    root = ET.fromstring('<ab xmlns="http://www.tei-c.org/ns/1.0"><!-- comment --><app/></ab>')
+    assert [element_local_name(child) for child in root] == [None, "app"]
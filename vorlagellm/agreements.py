@@ -2,8 +2,10 @@ from enum import Enum
 from lxml.etree import _ElementTree as ElementTree
 from lxml.etree import _Element as Element
 from collections import Counter
+import numpy as np
 
-from .tei import readings_for_witness, find_elements
+from .tei import readings_for_witness, find_elements, reading_witnesses, witness_sets_matrix
+from .snapshot import TeiSnapshot
 
 class WitnessComparison(Enum):
     MISSING = 0
@@ -18,13 +20,9 @@ class WitnessComparison(Enum):
         return f"{self.name.title()}s"
 
 
-def get_app_witness_agreements(app:Element, siglum1:str, siglum2:str) -> WitnessComparison:
-    readings1 = readings_for_witness(app, siglum1)
-    if len(readings1) == 0:
-        return WitnessComparison.MISSING    
-
-    readings2 = readings_for_witness(app, siglum2)
-    if len(readings2) == 0:
+def compare_readings(readings1:set, readings2:set) -> WitnessComparison:
+    """ Compares the sets of readings (or the indexes of the readings) of two witnesses in an <app>. """
+    if len(readings1) == 0 or len(readings2) == 0:
         return WitnessComparison.MISSING    
 
     intersection = readings1 & readings2
@@ -37,12 +35,27 @@ def get_app_witness_agreements(app:Element, siglum1:str, siglum2:str) -> Witness
     return WitnessComparison.AMBIGUOUS_AGREEMENT
 
 
+def get_app_witness_agreements(app:Element, siglum1:str, siglum2:str) -> WitnessComparison:
+    return compare_readings(readings_for_witness(app, siglum1), readings_for_witness(app, siglum2))
+
+
+def witness_set_readings(witness_sets:list[frozenset[str]], siglum:str) -> set[int]:
+    """ Returns the indexes of the readings with a siglum (with or without a '#' prefix) from their sets of witnesses. """
+    return set(index for index, witnesses in enumerate(witness_sets) if siglum in witnesses or f"#{siglum}" in witnesses)
+
 
-def count_witness_agreements(apparatus:ElementTree|Element, siglum1:str, siglum2:str) -> Counter[WitnessComparison]:
+def app_witness_sets(apparatus:ElementTree|Element|TeiSnapshot) -> list[list[frozenset[str]]]:
+    """ Returns the sets of witnesses of the <rdg> elements of each <app> in an apparatus or a snapshot of an apparatus. """
+    if isinstance(apparatus, TeiSnapshot):
+        return apparatus.app_witness_sets()
+    return [[reading_witnesses(reading) for reading in find_elements(app, ".//rdg")] for app in find_elements(apparatus, ".//app")]
+
+
+def count_witness_agreements(apparatus:ElementTree|Element|TeiSnapshot, siglum1:str, siglum2:str) -> Counter[WitnessComparison]:
     """Aggregates the types of witness agreements across multiple apparatus entries in an XML document.
 
     Args:
-        apparatus (ElementTree or Element): The root XML element or element tree representing the entire document.
+        apparatus (ElementTree, Element or TeiSnapshot): The root XML element or element tree representing the entire document (or a snapshot of it).
         siglum1 (str): The siglum of the first witness.
         siglum2 (str): The siglum of the second witness.
 
@@ -50,6 +63,68 @@ def count_witness_agreements(apparatus:ElementTree|Element, siglum1:str, siglum2
         Counter: A counter with the counts of each type of witness agreement.
     """
     counter = Counter()
-    for app in find_elements(apparatus, ".//app"):
-        counter.update( [get_app_witness_agreements(app, siglum1, siglum2)] )
-    return counter
\ No newline at end of file
+    for witness_sets in app_witness_sets(apparatus):
+        counter.update( [compare_readings(witness_set_readings(witness_sets, siglum1), witness_set_readings(witness_sets, siglum2))] )
+    return counter
+
+
+def get_all_sigla(apparatus:ElementTree|Element|TeiSnapshot) -> list[str]:
+    """
+    Gets the sigla of all witnesses in an apparatus.
+
+    The sigla in the <listWit> element come first (in order) followed by any other sigla found in the 'wit' attributes of the readings.
+    Any '#' prefix is removed.
+    """
+    if isinstance(apparatus, TeiSnapshot):
+        witness_list = apparatus.witness_list
+        witness_sets = apparatus.reading_witnesses
+    else:
+        witness_list = [witness.attrib["n"] for witness in find_elements(apparatus, ".//witness") if witness.attrib.get("n")]
+        witness_sets = [reading_witnesses(reading) for reading in find_elements(apparatus, ".//rdg")]
+
+    sigla = dict.fromkeys(witness_list)
+    for witnesses in witness_sets:
+        for witness in sorted(witnesses):
+            sigla[witness.lstrip("#")] = None
+    return list(sigla)
+
+
+def all_witness_agreements(apparatus:ElementTree|Element|TeiSnapshot, sigla:list[str]|None=None) -> tuple[list[str], dict[WitnessComparison, np.ndarray]]:
+    """Counts the types of witness agreements for every pair of witnesses in an XML document.
+
+    The witness membership of every reading is extracted once into a boolean matrix 
+    and the agreements for all pairs of witnesses are computed together for each <app>.
+
+    Args:
+        apparatus (ElementTree, Element or TeiSnapshot): The root XML element or element tree representing the entire document (or a snapshot of it).
+        sigla (list[str], optional): The sigla of the witnesses to compare. Defaults to all the witnesses in the apparatus.
+
+    Returns:
+        list[str]: The sigla of the witnesses in the order of the rows and columns of the matrices.
+        dict: A square matrix of counts for each type of witness agreement.
+    """
+    sigla = sigla or get_all_sigla(apparatus)
+    witness_count = len(sigla)
+    results = {category: np.zeros((witness_count, witness_count), dtype=int) for category in WitnessComparison}
+
+    witness_sets_per_app = app_witness_sets(apparatus)
+    if not witness_sets_per_app:
+        return sigla, results
+
+    membership = witness_sets_matrix([witnesses for witness_sets in witness_sets_per_app for witnesses in witness_sets], sigla).astype(int)
+    boundaries = np.cumsum([len(witness_sets) for witness_sets in witness_sets_per_app])[:-1]
+
+    for app_membership in np.split(membership, boundaries):
+        counts = app_membership.sum(axis=0)
+        present = counts > 0
+        single = counts == 1
+        both_present = present[:, None] & present[None, :]
+        both_single = single[:, None] & single[None, :]
+        shared = (app_membership.T @ app_membership) > 0
+
+        results[WitnessComparison.MISSING] += ~both_present
+        results[WitnessComparison.UNAMBIGUOUS_DISAGREEMENT] += both_present & ~shared
+        results[WitnessComparison.AMBIGUOUS_AGREEMENT] += both_present & shared & ~both_single
+        results[WitnessComparison.UNAMBIGUOUS_AGREEMENT] += both_present & shared & both_single
+
+    return sigla, results
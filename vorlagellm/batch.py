@@ -0,0 +1,230 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable
+
+from langchain.schema.output_parser import StrOutputParser
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
+from langchain_core.runnables.base import coerce_to_runnable
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+OPENAI_ROLES = dict(system="system", human="user", ai="assistant")
+MESSAGE_CLASSES = dict(system=SystemMessage, user=HumanMessage, assistant=AIMessage)
+COMPLETED_STATUS = "completed"
+FAILED_STATUSES = {"failed", "expired", "cancelled", "cancelling"}
+
+
+def messages_to_openai(messages:list[BaseMessage]) -> list[dict]:
+    """ Converts rendered LangChain chat messages into the format of the OpenAI chat completions API. """
+    return [dict(role=OPENAI_ROLES[message.type], content=message.content) for message in messages]
+
+
+def openai_to_messages(messages:list[dict]) -> list[BaseMessage]:
+    """ Converts messages in the format of the OpenAI chat completions API into LangChain chat messages. """
+    return [MESSAGE_CLASSES[message['role']](content=message['content']) for message in messages]
+
+
+def batch_request(custom_id:str, messages:list[BaseMessage], model:str, temperature:float|None=None, json_mode:bool=False) -> dict:
+    """ Creates a single request for a batch file. If `json_mode` is True, then the response is requested as a JSON object. """
+    body = dict(model=model, messages=messages_to_openai(messages))
+    if temperature is not None:
+        body['temperature'] = temperature
+    if json_mode:
+        body['response_format'] = {"type": "json_object"}
+    return dict(custom_id=custom_id, method="POST", url=BATCH_ENDPOINT, body=body)
+
+
+def write_batch_requests(requests:list[dict], path:Path) -> Path:
+    """ Writes requests to a JSONL batch file. """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return path
+
+
+def batch_response(custom_id:str, content:str|None, error:str|None=None) -> dict:
+    """ Creates a single response in the format of an OpenAI batch output file. """
+    if error is not None:
+        return dict(custom_id=custom_id, response=None, error=dict(message=error))
+    body = dict(choices=[dict(index=0, message=dict(role="assistant", content=content))])
+    return dict(custom_id=custom_id, response=dict(status_code=200, body=body), error=None)
+
+
+def read_batch_results(path:Path) -> dict[str,str]:
+    """
+    Reads the content of the response for each request in a batch output file.
+
+    Requests which failed are left out.
+    """
+    results = dict()
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                continue
+            results[item['custom_id']] = response['body']['choices'][0]['message']['content'] or ""
+    return results
+
+
+class LocalBatchBackend:
+    """
+    Processes a batch file with a LangChain LLM instead of submitting it to a provider.
+
+    This is a stand-in for the provider batch API for models without one and for testing.
+    The batch is completed when it is submitted and the output is written next to the input file.
+    """
+    def __init__(self, llm):
+        self.llm = coerce_to_runnable(llm)
+
+    def submit(self, path:Path) -> str:
+        path = Path(path)
+        output_path = path.with_name(f"{path.stem}-output.jsonl")
+        parser = StrOutputParser()
+        with open(path) as input_file, open(output_path, "w") as output_file:
+            for line in input_file:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    content = parser.invoke(self.llm.invoke(openai_to_messages(request['body']['messages'])))
+                    response = batch_response(request['custom_id'], content)
+                except Exception as err:
+                    response = batch_response(request['custom_id'], None, error=str(err))
+                output_file.write(json.dumps(response, ensure_ascii=False) + "\n")
+        return str(output_path)
+
+    def status(self, batch_id:str) -> str:
+        return COMPLETED_STATUS
+
+    def download(self, batch_id:str, path:Path) -> Path:
+        path = Path(path)
+        if Path(batch_id).resolve() != path.resolve():
+            shutil.copyfile(batch_id, path)
+        return path
+
+
+class OpenAIBatchBackend:
+    """ Submits batch files to the OpenAI Batch API. """
+    def __init__(self, api_key:str="", completion_window:str="24h"):
+        from openai import OpenAI
+
+        self.client = OpenAI(api_key=api_key or None)
+        self.completion_window = completion_window
+
+    def submit(self, path:Path) -> str:
+        with open(path, "rb") as f:
+            batch_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id:str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id:str, path:Path) -> Path:
+        batch = self.client.batches.retrieve(batch_id)
+        assert batch.output_file_id, f"Batch '{batch_id}' has no output file (status '{batch.status}')"
+        path = Path(path)
+        path.write_bytes(self.client.files.content(batch.output_file_id).read())
+        return path
+
+
+class BatchState:
+    """
+    The state of a run with the batch API, saved as JSON so that each phase can be resumed.
+
+    The state records the batch submitted for each phase (so that it is not submitted twice) and
+    the results of the phases which have completed.
+    """
+    def __init__(self, path:Path, data:dict|None=None):
+        self.path = Path(path)
+        self.data = data or dict(batches=dict(), apps=dict())
+
+    @classmethod
+    def load(cls, path:Path) -> "BatchState":
+        path = Path(path)
+        if path.exists():
+            return cls(path, json.loads(path.read_text()))
+        return cls(path)
+
+    def save(self) -> None:
+        """ Writes the state to a temporary file and then replaces the state file so that it is never left half-written. """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_name(f"{self.path.name}.tmp")
+        temporary_path.write_text(json.dumps(self.data, indent=2, ensure_ascii=False))
+        os.replace(temporary_path, self.path)
+
+    @property
+    def batches(self) -> dict:
+        return self.data['batches']
+
+    @property
+    def apps(self) -> dict:
+        return self.data['apps']
+
+    def phase_file(self, phase:str, suffix:str="") -> Path:
+        """ The path for a file for a phase next to the state file. """
+        stem = self.path.name.split(".")[0]
+        return self.path.with_name(f"{stem}-{phase}{suffix}.jsonl")
+
+
+def run_batch_phase(
+    state:BatchState, 
+    backend, 
+    phase:str, 
+    requests:Callable[[], list[dict]], 
+    wait:bool=False, 
+    poll_interval:float=60.0, 
+    sleep:Callable[[float], None]=time.sleep,
+) -> dict[str,str]|None:
+    """
+    Runs one phase of a batch run, resuming from the state if the batch was already submitted.
+
+    Args:
+        state (BatchState): The state of the batch run which is saved after each step.
+        backend: The backend to submit the batch to (e.g. `OpenAIBatchBackend` or `LocalBatchBackend`).
+        phase (str): The name of the phase.
+        requests (Callable): A function which returns the requests for the batch. It is only called if the batch has not yet been submitted.
+        wait (bool): Whether or not to wait until the batch has completed. Defaults to False.
+        poll_interval (float): The number of seconds between checking the status of the batch when waiting.
+
+    Returns:
+        dict[str,str]|None: The content of the response for each request if the batch has completed, otherwise None.
+    """
+    batch = state.batches.get(phase)
+    if batch is None:
+        phase_requests = requests()
+        if not phase_requests:
+            batch = dict(id=None, status=COMPLETED_STATUS, output=None)
+        else:
+            path = write_batch_requests(phase_requests, state.phase_file(phase))
+            batch = dict(id=backend.submit(path), input=str(path), status="submitted")
+        state.batches[phase] = batch
+        state.save()
+
+    if batch['status'] != COMPLETED_STATUS:
+        status = backend.status(batch['id'])
+        while wait and status != COMPLETED_STATUS and status not in FAILED_STATUSES:
+            sleep(poll_interval)
+            status = backend.status(batch['id'])
+
+        assert status not in FAILED_STATUSES, f"The batch '{batch['id']}' for the {phase} phase ended with the status '{status}'"
+        batch['status'] = status
+        if status == COMPLETED_STATUS:
+            batch['output'] = str(backend.download(batch['id'], state.phase_file(phase, "-output")))
+        state.save()
+        if status != COMPLETED_STATUS:
+            return None
+
+    return read_batch_results(batch['output']) if batch['output'] else dict()
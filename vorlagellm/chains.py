@@ -1,5 +1,12 @@
 from langchain.schema.output_parser import StrOutputParser
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.runnables import RunnableLambda
+from collections import Counter
+from dataclasses import dataclass, field
+import json
 import re
+import threading
 
 
 from .prompts import build_prompt, build_source_prompt, build_corresponding_text_prompt
@@ -18,10 +25,151 @@ def parse_result(output:str) -> tuple[str,str]:
     return readings, justification
 
 
+def needs_escalation(results:list[int], readings_count:int) -> bool:
+    """
+    Returns True if the selected readings from a model are not informative enough to trust, i.e. 
+    if no readings were selected (NONE), if all the readings were selected 
+    or if the response cited reading numbers which do not exist (which suggests the output was not parsed properly).
+    """
+    if not results:
+        return True
+    if any(index < 0 or index >= readings_count for index in results):
+        return True
+    return readings_count > 1 and len(set(results)) >= readings_count
+
+
 def strip_hyphens(text:str) -> str:
     return re.sub(r'---+.*', '', text).strip()
 
 
+class StructuredOutputError(ValueError):
+    """ Raised when a structured response from an LLM is not valid. """
+
+
+@dataclass
+class ParseStats:
+    """ Tracks how often structured responses from the LLM fail to parse. """
+    responses:int = 0
+    failures:int = 0
+    fallbacks:int = 0
+    lock:threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def count(self, responses:int=0, failures:int=0, fallbacks:int=0) -> None:
+        """ Adds to the counts (safely when the chains are invoked from several threads). """
+        with self.lock:
+            self.responses += responses
+            self.failures += failures
+            self.fallbacks += fallbacks
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.responses if self.responses else 0.0
+
+
+def extract_json(output:str) -> dict:
+    """ Extracts the first JSON object in the output of an LLM (ignoring any text or code fences around it). """
+    match = re.search(r"\{.*\}", output, flags=re.DOTALL)
+    if not match:
+        raise StructuredOutputError("The response did not contain a JSON object.")
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError as err:
+        raise StructuredOutputError(f"The response was not valid JSON: {err}")
+    if not isinstance(data, dict):
+        raise StructuredOutputError("The response was not a JSON object.")
+    return data
+
+
+def count_readings(readings:str) -> int:
+    """ Counts the readings in a list of readings made with `readings_list_to_str`. """
+    return len(re.findall(r"^\d+\. ", readings, flags=re.MULTILINE))
+
+
+def parse_structured_result(output:str, inputs:dict) -> tuple[list[int],str]:
+    """
+    Parses and validates a JSON response from the source prompt.
+
+    The reading numbers must be integers between 1 and the number of readings in the inputs.
+    The readings are returned from 0 onwards (like `parse_result`).
+    """
+    data = extract_json(output)
+    readings = data.get("readings")
+    if not isinstance(readings, list):
+        raise StructuredOutputError("The key 'readings' must be a list of numbers.")
+
+    readings_count = count_readings(inputs.get("readings", ""))
+    indexes = []
+    for reading in readings:
+        if isinstance(reading, str) and reading.strip().isdigit():
+            reading = int(reading)
+        if isinstance(reading, bool) or not isinstance(reading, int):
+            raise StructuredOutputError(f"The reading '{reading}' is not a number.")
+        if readings_count and not 1 <= reading <= readings_count:
+            raise StructuredOutputError(f"The reading {reading} is not between 1 and {readings_count}.")
+        indexes.append(reading - 1)
+
+    justification = data.get("justification", "")
+    if not isinstance(justification, str):
+        raise StructuredOutputError("The key 'justification' must be a string.")
+
+    return indexes, justification.strip()
+
+
+def parse_structured_text(output:str, inputs:dict) -> str:
+    """ Parses and validates a JSON response from the corresponding text prompt. """
+    data = extract_json(output)
+    text = data.get("text")
+    if not isinstance(text, str):
+        raise StructuredOutputError("The key 'text' must be a string.")
+    return text.strip()
+
+
+def json_mode(llm):
+    """ Requests JSON responses from models which support it (currently OpenAI chat models). Other models are returned unchanged. """
+    if type(getattr(llm, "llm", llm)).__name__ in ["ChatOpenAI", "AzureChatOpenAI"]:
+        return llm.bind(response_format={"type": "json_object"})
+    return llm
+
+
+def build_structured_chain(prompt, llm, parser, fallback_parser, max_reasks:int=2, parse_stats:ParseStats|None=None, verbose:bool=False):
+    """
+    Builds a chain which parses the response from an LLM with a strict parser.
+
+    If the response cannot be parsed, then the LLM is shown its response and the error and is asked again 
+    for that input only, up to `max_reasks` times. If it still fails, then `fallback_parser` is used on the last response.
+    If `verbose` is True, then the prompt and each response (including those to re-asks) are printed.
+    """
+    parse_stats = parse_stats if parse_stats is not None else ParseStats()
+    llm = json_mode(llm)
+    generate = prompt | llm | StrOutputParser()
+    reask = RunnableLambda(lambda messages: ChatPromptValue(messages=messages)) | llm | StrOutputParser()
+    if verbose:
+        generate = prompt | print_prompt | llm | StrOutputParser() | print_response
+        reask = RunnableLambda(lambda messages: ChatPromptValue(messages=messages)) | print_prompt | llm | StrOutputParser() | print_response
+
+    def invoke(inputs:dict):
+        output = generate.invoke(inputs)
+        messages = None
+        for attempt in range(max_reasks + 1):
+            parse_stats.count(responses=1)
+            try:
+                return parser(output, inputs)
+            except StructuredOutputError as err:
+                parse_stats.count(failures=1)
+                if attempt == max_reasks:
+                    break
+                messages = messages or prompt.invoke(inputs).to_messages()
+                messages = messages + [
+                    AIMessage(content=output),
+                    HumanMessage(content=f"That response was not valid: {err} Please respond again only with the JSON object in the format requested."),
+                ]
+                output = reask.invoke(messages)
+
+        parse_stats.count(fallbacks=1)
+        return fallback_parser(output)
+
+    return RunnableLambda(invoke)
+
 
 def build_chain(llm, doc_language: str, apparatus_language: str, initiate_response:bool=False):
     prompt = build_prompt(doc_language=doc_language, apparatus_language=apparatus_language, initiate_response=initiate_response)
@@ -29,8 +177,24 @@ def build_chain(llm, doc_language: str, apparatus_language: str, initiate_respon
     return prompt | llm | StrOutputParser() | parse_result
 
 
-def build_source_chain(llm, doc_language: str, apparatus_language: str, notes:str, initiate_response:bool=False):
-    prompt = build_source_prompt(doc_language=doc_language, apparatus_language=apparatus_language, notes=notes, initiate_response=initiate_response)
+def build_source_chain(
+    llm, 
+    doc_language: str, 
+    apparatus_language: str, 
+    notes:str, 
+    initiate_response:bool=False, 
+    structured:bool=False, 
+    max_reasks:int=2, 
+    parse_stats:ParseStats|None=None,
+    verbose:bool=False,
+):
+    prompt = build_source_prompt(doc_language=doc_language, apparatus_language=apparatus_language, notes=notes, initiate_response=initiate_response, structured=structured)
+
+    if structured:
+        return build_structured_chain(prompt, llm, parse_structured_result, parse_result, max_reasks=max_reasks, parse_stats=parse_stats, verbose=verbose)
+
+    if verbose:
+        return prompt | print_prompt | llm | StrOutputParser() | print_response | parse_result
 
     return prompt | llm | StrOutputParser() | parse_result
 
@@ -40,11 +204,75 @@ def print_prompt(prompt):
     return prompt
 
 
-def build_corresponding_text_chain(llm, doc_language: str, apparatus_language: str, verbose:bool=False, initiate_response:bool=False):
-    prompt = build_corresponding_text_prompt(doc_language=doc_language, apparatus_language=apparatus_language, initiate_response=initiate_response)
+def print_response(response:str) -> str:
+    print(response)
+    return response
+
+
+def build_corresponding_text_chain(
+    llm, 
+    doc_language: str, 
+    apparatus_language: str, 
+    verbose:bool=False, 
+    initiate_response:bool=False, 
+    structured:bool=False, 
+    max_reasks:int=2, 
+    parse_stats:ParseStats|None=None,
+):
+    prompt = build_corresponding_text_prompt(doc_language=doc_language, apparatus_language=apparatus_language, initiate_response=initiate_response, structured=structured)
+    if structured:
+        return build_structured_chain(prompt, llm, parse_structured_text, strip_hyphens, max_reasks=max_reasks, parse_stats=parse_stats, verbose=verbose)
+
     if verbose:
-        prompt = prompt | print_prompt
+        return prompt | print_prompt | llm | StrOutputParser() | print_response | strip_hyphens
 
     # llm_with_fallback = llm.bind(stop=["----"]).with_fallbacks([llm])
 
-    return prompt | llm | StrOutputParser() | strip_hyphens
\ No newline at end of file
+    return prompt | llm | StrOutputParser() | strip_hyphens
+
+
+def vote_on_results(results:list[list[int]], threshold:float=0.5) -> list[int]:
+    """ Returns the readings selected in at least `threshold` of the results. """
+    counts = Counter(index for result in results for index in set(result))
+    return sorted(index for index, count in counts.items() if count >= threshold * len(results))
+
+
+def vote_on_outputs(outputs:list[tuple[list[int],str]], threshold:float=0.5) -> tuple[list[int],str]:
+    """
+    Votes on the readings selected in the outputs of a source chain.
+
+    Returns the readings selected by the vote and the justification of the first output 
+    which agrees with the vote (or the first output if none agree).
+    """
+    readings = vote_on_results([result for result, _ in outputs], threshold=threshold)
+    justification = next((justification for result, justification in outputs if sorted(set(result)) == readings), outputs[0][1])
+    return readings, justification
+
+
+def invoke_self_consistency(chain, inputs:dict, samples:int=1, adaptive:bool=False, threshold:float=0.5) -> tuple[list[int],str]:
+    """
+    Invokes a chain which returns the selected readings and a justification multiple times on the same inputs and votes on the readings.
+
+    Args:
+        chain: A chain built with `build_source_chain` or `build_chain`.
+        inputs (dict): The inputs to the chain. These are reused for each sample.
+        samples (int): The maximum number of samples. Defaults to 1 (i.e. no self-consistency).
+        adaptive (bool): If True, then two samples are taken first and the rest are only taken if they disagree.
+        threshold (float): The proportion of the samples which need to select a reading.
+
+    Returns:
+        list[int]: The readings selected by the vote.
+        str: The justification of the first sample which agrees with the vote (or the first sample if none agree).
+    """
+    if samples <= 1:
+        return chain.invoke(inputs)
+
+    if adaptive:
+        outputs = chain.batch([inputs] * 2)
+        if set(outputs[0][0]) == set(outputs[1][0]):
+            return outputs[0]
+        outputs += chain.batch([inputs] * (samples - 2)) if samples > 2 else []
+    else:
+        outputs = chain.batch([inputs] * samples)
+
+    return vote_on_outputs(outputs, threshold=threshold)
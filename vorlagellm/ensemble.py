@@ -1,90 +1,307 @@
+import csv
+import json
+import math
+from pathlib import Path
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import Iterator
+import copy
 from lxml import etree as ET
 from lxml.etree import _ElementTree as ElementTree
+from lxml.etree import _Element as Element
 from rich.progress import track
 
 from .tei import (
-    find_elements, 
-    extract_text, 
-    reading_has_witness, 
-    add_witness_readings, 
-    remove_witnesss_readings, 
-    find_element, 
+    read_tei,
+    open_tei_file,
+    find_element,
+    find_elements,
+    extract_text,
+    reading_has_witness,
+    add_witness_readings,
+    remove_witnesss_readings,
     add_responsibility_statement,
+    find_parent,
 )
 
-def do_ensemble(xml_files:list[ElementTree], witness:str) -> ElementTree:
+
+def is_alignment_unit(element:Element) -> bool:
+    """ Whether an element is aligned between apparatus files: an <ab> element or an <app> element which is not within an <ab> or another <app>. """
+    return ET.QName(element).localname == "ab" or next(element.iterancestors("{*}ab", "{*}app"), None) is None
+
+
+def iter_verse_elements(apparatus:ElementTree|Path, resp_statements:list[Element]) -> Iterator[Element]:
+    """
+    Yields the <ab> elements of an apparatus in document order 
+    together with any <app> elements which are not within an <ab> element (so that they are aligned at the level of the document).
+
+    If the apparatus is a path, then it is parsed incrementally and each element is cleared once the next one is requested
+    so that only one verse of the file is held in memory at a time.
+
+    Copies of the <respStmt> elements in the apparatus are appended to `resp_statements` as they are found.
+    """
+    if isinstance(apparatus, ElementTree):
+        resp_statements.extend(copy.deepcopy(resp_statement) for resp_statement in apparatus.getroot().iter("{*}respStmt"))
+        yield from (element for element in apparatus.getroot().iter("{*}ab", "{*}app") if is_alignment_unit(element))
+        return
+
+    with open_tei_file(apparatus) as f:
+        parser = ET.iterparse(f, events=("end",), tag=("{*}ab", "{*}app", "{*}respStmt"), remove_blank_text=True)
+        for _, element in parser:
+            if ET.QName(element).localname == "respStmt":
+                resp_statements.append(copy.deepcopy(element))
+            elif is_alignment_unit(element):
+                yield element
+            else:
+                # Keep the <app> elements within an <ab> until the whole <ab> has been yielded
+                continue
+
+            # Free the memory for elements which have been processed
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def unit_apps(unit:Element) -> list[Element]:
+    """ The <app> elements in an element from `iter_verse_elements` (including the element itself if it is an <app>). """
+    apps = find_elements(unit, ".//app")
+    return [unit] + apps if ET.QName(unit).localname == "app" else apps
+
+
+def find_wit_detail(app:Element, witness:str) -> Element|None:
+    """ Returns the first <witDetail> element in the <app> for the witness. """
+    return find_element(app, ".//witDetail[@wit=$wit]", wit=witness)
+
+
+reading_string = ET.XPath("string()")
+
+
+def readings_match(reference:list[Element], reference_strings:list[str], readings:list[Element]) -> bool:
+    """
+    Whether the readings of an <app> in one file have the same text as the readings in the reference file.
+
+    The string values of the readings are compared first (`reference_strings` are computed once for the reference file)
+    and the normalized text is only extracted for readings whose string values differ (e.g. because of indentation).
+    """
+    for reference_reading, reference_string, reading in zip(reference, reference_strings, readings):
+        if reading_string(reading) != reference_string and extract_text(reading) != extract_text(reference_reading):
+            return False
+    return True
+
+
+@dataclass
+class AppVotes:
+    """ The (weighted) votes of each apparatus file for the readings of a single <app>. """
+    apps:tuple[Element]
+    readings:list[list[Element]]
+    votes:list[float]
+    voting_weight:float
+
+    def decisions(self, threshold:float=0.5) -> list[bool]:
+        """ Returns whether or not the witness should be included for each reading. """
+        return [self.voting_weight > 0 and votes >= threshold * self.voting_weight for votes in self.votes]
+
+    def is_contested(self, threshold:float=0.5, remaining_weight:float=0.0) -> bool:
+        """
+        Returns True if the files disagree on any reading and the decision could still change 
+        if apparatus files with a total weight of `remaining_weight` were added.
+        """
+        total_weight = self.voting_weight + remaining_weight
+        for votes in self.votes:
+            if votes in (0, self.voting_weight):
+                continue
+            settled = votes >= threshold * total_weight or votes + remaining_weight < threshold * total_weight
+            if not settled:
+                return True
+        return False
+
+
+def iter_app_votes(
+    xml_files:list[ElementTree|Path], 
+    witness:str, 
+    weights:list[float]|None=None, 
+    resp_statements:list[Element]|None=None,
+) -> Iterator[AppVotes]:
+    """
+    Counts the votes of each apparatus for the witness in the readings of every <app>.
+
+    The first apparatus must be a parsed tree. The others can be paths, in which case they are parsed 
+    incrementally in lockstep, one <ab> at a time. Any <app> elements outside of an <ab> are aligned in document order.
+
+    A file abstains from voting on an <app> if it has neither a reading with the witness nor a <witDetail> for it
+    (e.g. when that part of the apparatus was not included in the run).
+    """
+    weights = weights or [1.0] * len(xml_files)
+    assert len(weights) == len(xml_files), f"Expected {len(xml_files)} weights but found {len(weights)}"
+    resp_statements = resp_statements if resp_statements is not None else []
+
+    verse_streams = [list(iter_verse_elements(xml_files[0], []))] + [
+        iter_verse_elements(xml_file, resp_statements) for xml_file in xml_files[1:]
+    ]
+    verses_count = len(verse_streams[0])
+
+    for verse_in_each_file in track(zip_longest(*verse_streams), total=verses_count, description="Ensembling <ab> elements"):
+        assert None not in verse_in_each_file, f"Each apparatus must have the same number of <ab> elements, expected {verses_count}"
+        apps_list = [unit_apps(verse) for verse in verse_in_each_file]
+
+        # Make sure that each apparatus has the same number of <app> elements
+        apps_count = len(apps_list[0])
+        for apps in apps_list:
+            assert apps_count == len(apps), f"Each apparatus must have the same number of <app> elements, expected {apps_count} and found {len(apps)}"
+
+        for app_in_each_file in zip(*apps_list):
+            readings_list = [find_elements(app, ".//rdg") for app in app_in_each_file]
+
+            # Make sure that each apparatus has the same readings
+            readings_count = len(readings_list[0])
+            reference_strings = [reading_string(reading) for reading in readings_list[0]]
+            for readings in readings_list[1:]:
+                assert readings_count == len(readings), f"Each apparatus must have the same number of <rdg> elements in each <app>, expected {readings_count} and found {len(readings)}"
+                assert readings_match(readings_list[0], reference_strings, readings), f"Each apparatus must have the same text for the readings in each <app>"
+
+            # Count the votes for each reading
+            votes = [0.0] * readings_count
+            voting_weight = 0.0
+            for app, readings, weight in zip(app_in_each_file, readings_list, weights):
+                has_witness = [reading_has_witness(reading, witness) for reading in readings]
+                if not any(has_witness) and find_wit_detail(app, witness) is None:
+                    continue
+
+                voting_weight += weight
+                for index in range(readings_count):
+                    if has_witness[index]:
+                        votes[index] += weight
+
+            yield AppVotes(apps=app_in_each_file, readings=readings_list, votes=votes, voting_weight=voting_weight)
+
+
+def do_ensemble(
+    xml_files:list[ElementTree|Path], 
+    witness:str, 
+    weights:list[float]|None=None, 
+    threshold:float=0.5,
+) -> ElementTree:
+    """
+    Combines the predictions for a witness in multiple apparatus files with a (weighted) vote.
+
+    The witness is included in a reading if the weight of the files which include it is at least `threshold` 
+    times the weight of the files which voted on that <app>. By default, each file has the same weight and a tie includes the witness.
+
+    The first apparatus is modified and returned. Any apparatus given as a path is parsed
+    (the first fully and the others incrementally in lockstep, one <ab> at a time).
+    """
     assert len(xml_files) >= 2, f"Needs multiple apparatus objects to perform ensemble"
-    apparatus_apps_list = [find_elements(apparatus, ".//app") for apparatus in xml_files]
-    
-    # Add responsibility statements from other files
     collation_xml_file = xml_files[0]
-    title_stmt = find_element(collation_xml_file, ".//titleStmt")
-    for xml_file in xml_files[1:]:
-        for resp_stmt in find_elements(xml_file, ".//respStmt"):
-            title_stmt.append(resp_stmt)
+    if not isinstance(collation_xml_file, ElementTree):
+        collation_xml_file = read_tei(collation_xml_file)
 
     # Add VorlageLLM Ensemble information into the TEI header and include all the relevant information about each apparatus
-    _, responsibility_statement_id = add_responsibility_statement(
-        xml_files[0], 
-        "VorlageLLM-Ensemble", 
+    responsibility_statement, responsibility_statement_id = add_responsibility_statement(
+        collation_xml_file,
+        "VorlageLLM-Ensemble",
         f"Ensembled from {len(xml_files)} files using VorlageLLM.",
     )
 
-    # Make sure that each apparatus has the same number of readings
-    apps_count = None
-    for app_list in apparatus_apps_list:
-        if apps_count is None:
-            apps_count = len(app_list)
-        else:
-            assert apps_count == len(app_list), f"Each apparatus must have the same number of <app> elements, expected {apps_count} and found {len(app_list)}"
-
-    for app_in_each_file in track(zip(*apparatus_apps_list), total=apps_count, description="Ensembling <app> elements"):
-    # for app_in_each_file in zip(*apparatus_apps_list):
-        assert len(app_in_each_file) == len(xml_files)
-        readings_list = [find_elements(app, ".//rdg") for app in app_in_each_file]
-
-        # Make sure that each apparatus has the same number of readings
-        readings_count = None
-        for readings in readings_list:
-            if readings_count is None:
-                readings_count = len(readings)
-            else:
-                assert readings_count == len(readings), f"Each apparatus must have the same number of <rdg> elements in each <app>, expected {readings_count} and found {len(readings)}"
+    resp_statements = []
+    for app_votes in iter_app_votes([collation_xml_file, *xml_files[1:]], witness, weights=weights, resp_statements=resp_statements):
+        if not app_votes.voting_weight:
+            continue
 
-        for readings in zip(*readings_list):
-            assert len(readings) == len(xml_files)
-            readings_with_witness = 0
-
-            # Make sure that each reading is the same
-            readings_text = None
-            for reading in readings:
-                if readings_text is None:
-                    readings_text = extract_text(reading)
-                else:
-                    assert readings_text == extract_text(reading)
-
-                readings_with_witness += int(reading_has_witness(reading, witness))
-            
-            majority_has_witness = (2 * readings_with_witness >= len(xml_files))
-
-            # modify first apparatus
-            reading = readings[0]
-            if majority_has_witness == reading_has_witness(reading, witness):
+        # modify first apparatus
+        for reading, include_witness in zip(app_votes.readings[0], app_votes.decisions(threshold)):
+            if include_witness == reading_has_witness(reading, witness):
                 continue
-            elif majority_has_witness:
+            elif include_witness:
                 add_witness_readings(reading, witness)
             else:
                 remove_witnesss_readings(reading, witness)
-    
-        # Find witDetail element in each apparatus
-        wit_details = [find_element(app, f".//witDetail[@wit='" + witness + "']") for app in app_in_each_file]
-        
+
+        # Find witDetail element in each apparatus (copying those which will be cleared from memory)
+        wit_details = [find_wit_detail(app_votes.apps[0], witness)]
+        wit_details += [copy.deepcopy(find_wit_detail(app, witness)) for app in app_votes.apps[1:]]
+
         # Create new witDetail in first apparatus
-        ensenble_app = app_in_each_file[0]
-        ensemble_wit_detail = ET.SubElement(ensenble_app, "witDetail", wit=witness, resp=responsibility_statement_id)
+        ensemble_app = app_votes.apps[0]
+        ensemble_wit_detail = ET.SubElement(ensemble_app, "witDetail", wit=witness, resp=responsibility_statement_id)
         for wit_detail in wit_details:
             if wit_detail is not None:
                 ensemble_wit_detail.append(wit_detail)
 
-    return xml_files[0]
+    # Add responsibility statements from other files
+    for resp_statement in resp_statements:
+        responsibility_statement.addprevious(resp_statement)
+
+    return collation_xml_file
+
+
+def contested_verses(
+    xml_files:list[ElementTree|Path], 
+    witness:str, 
+    weights:list[float]|None=None, 
+    threshold:float=0.5, 
+    remaining_weight:float=0.0,
+) -> list[str]:
+    """
+    Returns the 'n' attributes of the <ab> elements which have an <app> where the apparatus files disagree
+    and where the result of the vote could still change if files with a total weight of `remaining_weight` were added.
+
+    Contested <app> elements which are not within an <ab> are not included because they cannot be selected for another run.
+    """
+    base = xml_files[0]
+    if not isinstance(base, ElementTree):
+        base = read_tei(base)
+
+    verses = dict()
+    for app_votes in iter_app_votes([base, *xml_files[1:]], witness, weights=weights):
+        if app_votes.is_contested(threshold, remaining_weight=remaining_weight):
+            verse_element = find_parent(app_votes.apps[0], "ab")
+            if verse_element is not None:
+                verses[verse_element.attrib.get("n", "")] = None
+    return list(verses)
+
+
+def load_weights(table:Path, apparatuses:list[Path], siglum:str, metric:str="f1", gold_siglum:str="") -> list[float]:
+    """
+    Reads the weight of each apparatus file for a witness from a table written by `vorlagellm evaluate --table`.
+
+    The table has a row for each apparatus and prediction siglum so only the rows for `siglum`
+    (and for `gold_siglum` if given) are used. There must be exactly one of these rows for each apparatus.
+
+    Args:
+        table (Path): A CSV or JSON file with the columns 'apparatus', 'prediction_siglum', 'gold_siglum' and the metric.
+        apparatuses (list[Path]): The apparatus files to find weights for.
+        siglum (str): The siglum of the witness being ensembled.
+        metric (str): The column to use as the weight. Defaults to 'f1'.
+        gold_siglum (str): The siglum of the gold witness that the predictions were evaluated against. Defaults to any.
+
+    Returns:
+        list[float]: The weight for each apparatus file.
+    """
+    table = Path(table)
+    if table.suffix.lower() == ".json":
+        rows = json.loads(table.read_text())
+    else:
+        with open(table, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    scores = dict()
+    for row in rows:
+        if row.get('prediction_siglum') != siglum or (gold_siglum and row.get('gold_siglum') != gold_siglum):
+            continue
+        scores.setdefault(Path(row['apparatus']).resolve(), []).append(row)
 
+    weights = []
+    for apparatus in apparatuses:
+        resolved = Path(apparatus).resolve()
+        candidates = scores.get(resolved, [])
+        assert candidates, f"Could not find a score for '{apparatus}' with prediction siglum '{siglum}' in '{table}'"
+        assert len(candidates) == 1, (
+            f"There are {len(candidates)} rows for '{apparatus}' with prediction siglum '{siglum}' in '{table}'. "
+            "Give the gold siglum to choose between them."
+        )
+        value = candidates[0].get(metric)
+        assert value not in [None, ""], f"The '{metric}' for '{apparatus}' in '{table}' is empty"
+        weight = float(value)
+        assert math.isfinite(weight), f"The '{metric}' for '{apparatus}' in '{table}' is not a number: '{value}'"
+        weights.append(weight)
+    return weights
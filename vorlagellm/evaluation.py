@@ -0,0 +1,175 @@
+import csv
+import json
+import re
+from pathlib import Path
+from dataclasses import dataclass
+import numpy as np
+from lxml.etree import _Element as Element
+
+from .tei import find_parent
+
+
+@dataclass
+class ConfusionMatrix:
+    true_positives:int = 0
+    false_positives:int = 0
+    false_negatives:int = 0
+    true_negatives:int = 0
+
+    @classmethod
+    def from_masks(cls, gold:np.ndarray, prediction:np.ndarray) -> "ConfusionMatrix":
+        """ Counts the categories from boolean arrays of gold and predicted witness membership for each reading. """
+        gold = np.asarray(gold, dtype=bool)
+        prediction = np.asarray(prediction, dtype=bool)
+        return cls(
+            true_positives=int(np.count_nonzero(gold & prediction)),
+            false_positives=int(np.count_nonzero(~gold & prediction)),
+            false_negatives=int(np.count_nonzero(gold & ~prediction)),
+            true_negatives=int(np.count_nonzero(~gold & ~prediction)),
+        )
+
+    @property
+    def recall(self) -> float:
+        return safe_divide(self.true_positives, self.true_positives + self.false_negatives)
+
+    @property
+    def precision(self) -> float:
+        return safe_divide(self.true_positives, self.true_positives + self.false_positives)
+
+    @property
+    def f1(self) -> float:
+        return safe_divide(2 * self.precision * self.recall, self.precision + self.recall)
+
+    @property
+    def false_positive_rate(self) -> float:
+        return safe_divide(self.false_positives, self.false_positives + self.true_negatives)
+
+    @property
+    def false_negative_rate(self) -> float:
+        return safe_divide(self.false_negatives, self.false_negatives + self.true_positives)
+
+    def as_dict(self) -> dict[str, int|float]:
+        return dict(
+            true_positives=self.true_positives,
+            false_positives=self.false_positives,
+            false_negatives=self.false_negatives,
+            true_negatives=self.true_negatives,
+            recall=self.recall,
+            precision=self.precision,
+            f1=self.f1,
+            false_positive_rate=self.false_positive_rate,
+            false_negative_rate=self.false_negative_rate,
+        )
+
+
+def confusion_matrices_from_membership(gold:np.ndarray, predictions:np.ndarray) -> list[ConfusionMatrix]:
+    """
+    Counts the confusion matrix categories for many predictions at once.
+
+    Args:
+        gold (np.ndarray): A boolean array with the gold membership of each reading.
+        predictions (np.ndarray): A boolean matrix with a row for each reading and a column for each prediction.
+
+    Returns:
+        list[ConfusionMatrix]: The confusion matrix for each column of the predictions.
+    """
+    gold = np.asarray(gold, dtype=bool).reshape(-1, 1)
+    predictions = np.asarray(predictions, dtype=bool)
+    true_positives = np.count_nonzero(gold & predictions, axis=0)
+    false_positives = np.count_nonzero(~gold & predictions, axis=0)
+    false_negatives = np.count_nonzero(gold & ~predictions, axis=0)
+    true_negatives = np.count_nonzero(~gold & ~predictions, axis=0)
+    return [
+        ConfusionMatrix(
+            true_positives=int(true_positives[index]),
+            false_positives=int(false_positives[index]),
+            false_negatives=int(false_negatives[index]),
+            true_negatives=int(true_negatives[index]),
+        )
+        for index in range(predictions.shape[1])
+    ]
+
+
+def safe_divide(numerator:float, denominator:float) -> float:
+    """ Divides two numbers and returns NaN instead of raising an error if the denominator is zero. """
+    if not denominator or np.isnan(denominator):
+        return float("nan")
+    return numerator / denominator
+
+
+def get_book(verse:str) -> str:
+    """
+    Gets the book from a verse identifier.
+
+    IGNTP/ITSEE identifiers like 'B07K1V1' give 'B07'.
+    Otherwise the text before the first full stop is used (e.g. '1Cor.1.1' gives '1Cor').
+    """
+    match = re.match(r"^(B\d+)K", verse)
+    if match:
+        return match.group(1)
+    return verse.split(".")[0]
+
+
+def reading_verses(readings:list[Element]) -> np.ndarray:
+    """ Returns an array with the 'n' attribute of the <ab> element containing each reading (or an empty string). """
+    verses = []
+    for reading in readings:
+        verse_element = find_parent(reading, "ab")
+        verses.append(verse_element.attrib.get("n", "") if verse_element is not None else "")
+    return np.array(verses, dtype=str)
+
+
+def grouped_confusion_matrices(gold:np.ndarray, prediction:np.ndarray, labels:np.ndarray) -> dict[str, ConfusionMatrix]:
+    """
+    Counts the confusion matrix categories for each distinct label (e.g. the verse or book of each reading).
+
+    The counts for all groups are computed together with `np.bincount`.
+    """
+    gold = np.asarray(gold, dtype=bool)
+    prediction = np.asarray(prediction, dtype=bool)
+    groups, inverse = np.unique(np.asarray(labels), return_inverse=True)
+
+    def count(mask:np.ndarray) -> np.ndarray:
+        return np.bincount(inverse, weights=mask, minlength=len(groups)).astype(int)
+
+    true_positives = count(gold & prediction)
+    false_positives = count(~gold & prediction)
+    false_negatives = count(gold & ~prediction)
+    true_negatives = count(~gold & ~prediction)
+
+    return {
+        str(group): ConfusionMatrix(
+            true_positives=int(true_positives[index]),
+            false_positives=int(false_positives[index]),
+            false_negatives=int(false_negatives[index]),
+            true_negatives=int(true_negatives[index]),
+        )
+        for index, group in enumerate(groups)
+    }
+
+
+def write_confusion_matrices(confusion_matrices:dict[str, ConfusionMatrix], path:Path, label:str="verse") -> None:
+    """ Writes a CSV file with a row of metrics for each group of readings. """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=[label, *ConfusionMatrix().as_dict().keys()])
+        writer.writeheader()
+        for group, confusion_matrix in confusion_matrices.items():
+            writer.writerow({label: group, **confusion_matrix.as_dict()})
+
+
+def write_evaluation_table(rows:list[dict], path:Path) -> None:
+    """ Writes rows of evaluation results to a JSON file if the suffix is '.json' and otherwise to a CSV file. """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix.lower() == ".json":
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2)
+        return
+
+    with open(path, "w", newline="") as f:
+        fieldnames = list(rows[0].keys()) if rows else []
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Any
+from urllib.parse import urlsplit, parse_qs
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import Field, PrivateAttr
+
+from .scheduler import estimate_tokens
+
+
+FAKE_SCHEME = "fake://"
+SOURCE_READINGS_REGEX = re.compile(r"readings that go between the brackets that could be the source of '.*?':\n(.*?)\n\n", flags=re.DOTALL)
+DOC_TEXT_REGEX = re.compile(r"text to analyze:\n(.*?)\n\n", flags=re.DOTALL)
+READING_NUMBER_REGEX = re.compile(r"^(\d+)\. ", flags=re.MULTILINE)
+ERROR_STATUS_CODES = dict(rate_limit=429, server=500, overloaded=529)
+
+
+class FakeAPIError(Exception):
+    """ An error from the fake LLM with an HTTP status code like the errors from the providers. """
+    def __init__(self, message:str, status_code:int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def is_fake(model_id:str) -> bool:
+    """ Returns True if the model ID is a URL for a fake backend. """
+    return bool(model_id) and model_id.startswith(FAKE_SCHEME)
+
+
+def parse_fake_url(url:str) -> tuple[str, dict[str,str]]:
+    """ Splits a 'fake://' URL into the name of the model and a dictionary of its options. """
+    assert is_fake(url), f"'{url}' is not a fake model URL (it should start with '{FAKE_SCHEME}')"
+    parts = urlsplit(url)
+    options = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    return parts.netloc or "fake", options
+
+
+def stable_seed(*values) -> int:
+    """ A seed for a random number generator from a hash of the values which is the same in every process. """
+    text = "\x1f".join(str(value) for value in values)
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def fake_response(prompt:str, seed:int=0) -> str:
+    """
+    Makes a deterministic response to a prompt from VorlageLLM in the format that the prompt asks for.
+
+    For the source prompt, one or two of the listed readings are selected.
+    For the corresponding text prompt, a few consecutive words of the text to analyze are returned.
+    Any response is given as JSON if the prompt asks for it.
+    """
+    rng = random.Random(stable_seed(seed, prompt))
+    wants_json = "Respond only with a JSON object" in prompt
+
+    readings_match = SOURCE_READINGS_REGEX.search(prompt)
+    if readings_match:
+        readings_count = len(READING_NUMBER_REGEX.findall(readings_match.group(1))) or 1
+        readings = sorted(rng.sample(range(1, readings_count + 1), k=min(readings_count, rng.choice([1, 1, 1, 2]))))
+        justification = "The fake model chose these readings deterministically from the prompt."
+        if wants_json:
+            return json.dumps(dict(readings=readings, justification=justification), ensure_ascii=False)
+        return ", ".join(str(reading) for reading in readings) + "\n-----\n" + justification
+
+    text_match = DOC_TEXT_REGEX.search(prompt)
+    if text_match:
+        words = text_match.group(1).split() or ["OMISSION"]
+        start = rng.randrange(len(words))
+        text = " ".join(words[start:start + rng.randint(1, 3)])
+        if wants_json:
+            return json.dumps(dict(text=text), ensure_ascii=False)
+        return text + "\n-----"
+
+    return "1"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A chat model which returns deterministic responses (see `fake_response`) after a simulated latency.
+
+    A proportion of the calls (`error_rate`) fail with one of the `errors` (e.g. 'rate_limit', 'server' or 'timeout'),
+    which are retried by the `RequestScheduler` like errors from a provider.
+    The errors are chosen from a random number generator seeded with `seed` so that a sequential run is reproducible.
+    """
+    model_name:str = "fake"
+    latency:float = 0.0
+    jitter:float = 0.0
+    error_rate:float = 0.0
+    errors:list[str] = Field(default_factory=lambda: ["rate_limit"])
+    seed:int = 0
+
+    _calls:int = PrivateAttr(default=0)
+    _lock:Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def simulate_call(self) -> None:
+        """ Waits for the simulated latency and raises an error for the proportion of calls given by `error_rate`. """
+        with self._lock:
+            self._calls += 1
+            rng = random.Random(stable_seed(self.seed, self._calls))
+
+        delay = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+
+        if self.error_rate and rng.random() < self.error_rate:
+            error = rng.choice(self.errors)
+            if error == "timeout":
+                raise TimeoutError("The fake model timed out.")
+            raise FakeAPIError(f"The fake model raised a '{error}' error.", status_code=ERROR_STATUS_CODES.get(error, 400))
+
+    def _generate(self, messages:list[BaseMessage], stop:list[str]|None=None, run_manager=None, **kwargs) -> ChatResult:
+        self.simulate_call()
+        prompt = "\n".join(str(message.content) for message in messages)
+        content = fake_response(prompt, seed=self.seed)
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(content)
+        message = AIMessage(
+            content=content,
+            usage_metadata=dict(input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens),
+            response_metadata=dict(model_name=self.model_name),
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings from hashing the words of a text into a vector of a fixed size.
+
+    Texts which share words have similar embeddings so that the similarity search returns plausible results.
+    """
+    def __init__(self, size:int=256, latency:float=0.0):
+        self.size = size
+        self.latency = latency
+
+    def embed(self, text:str) -> list[float]:
+        vector = [0.0] * self.size
+        for word in text.lower().split():
+            digest = hashlib.sha256(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "big") % self.size
+            vector[index] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts:list[str]) -> list[list[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text:str) -> list[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.embed(text)
+
+
+def load_fake_llm(url:str, temperature:float|None=None) -> FakeChatModel:
+    """ Creates a fake chat model from a URL like 'fake://model?latency=0.5&error_rate=0.05'. """
+    name, options = parse_fake_url(url)
+    return FakeChatModel(
+        model_name=url,
+        latency=float(options.get("latency", 0.0)),
+        jitter=float(options.get("jitter", 0.0)),
+        error_rate=float(options.get("error_rate", 0.0)),
+        errors=[error.strip() for error in options.get("errors", "rate_limit").split(",") if error.strip()],
+        seed=int(options.get("seed", 0)),
+    )
+
+
+def load_fake_embeddings(url:str) -> FakeEmbeddings:
+    """ Creates fake embeddings from a URL like 'fake://embeddings?size=256&latency=0.01'. """
+    name, options = parse_fake_url(url)
+    return FakeEmbeddings(size=int(options.get("size", 256)), latency=float(options.get("latency", 0.0)))
@@ -1,15 +1,20 @@
 import typer
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing_extensions import Annotated
+from typing import Callable
 from pathlib import Path
 from rich.progress import track
 from rich.console import Console
-from langchain_openai import OpenAIEmbeddings
-import llmloader
-
-from .chains import build_corresponding_text_chain, build_source_chain
-from .prompts import readings_list_to_str
-from .rag import get_apparatus_db, get_teidoc_db, get_db, get_similar_verses, get_similar_verses_by_phrase
-from .agreements import count_witness_agreements, WitnessComparison
+from rich.table import Table
+from .agreements import count_witness_agreements, all_witness_agreements, WitnessComparison
+from .evaluation import (
+    get_book, 
+    grouped_confusion_matrices, 
+    write_confusion_matrices, 
+    confusion_matrices_from_membership, 
+    write_evaluation_table,
+)
 from vorlagellm.tei import (
     read_tei,
     get_siglum,
@@ -30,11 +35,16 @@ from vorlagellm.tei import (
     extract_text,
     reading_has_witness,
     get_apparatus_verse_text,
+    get_apparatus_verse_texts,
     write_elements,
     find_parent,
-    app_has_witness,
+    get_witnessed_app_indexes,
 )
-from .ensemble import do_ensemble
+from .prefilter import readings_indistinguishable
+from .ensemble import do_ensemble, contested_verses, load_weights
+from .snapshot import load_snapshot
+from .metrics import RunMetrics, TRACE_FORMATS
+from .progress import RunProgress
 
 console = Console()
 
@@ -44,6 +54,304 @@ DEFAULT_MODEL_ID = "gpt-4.1"
 DEFAULT_EMBEDDING_MODEL_ID = "text-embedding-3-large"
 
 
+def load_llm(model_id:str, api_key:str="", temperature:float|None=None):
+    """ Loads a chat model with llmloader or a deterministic fake model for IDs like 'fake://model?latency=0.5' (see `vorlagellm.fake`). """
+    from .fake import is_fake
+    if is_fake(model_id):
+        from .fake import load_fake_llm
+        return load_fake_llm(model_id, temperature=temperature)
+
+    import llmloader
+    return llmloader.load(model=model_id, api_key=api_key, temperature=temperature)
+
+
+def load_embeddings(model_id:str=DEFAULT_EMBEDDING_MODEL_ID):
+    """ Loads an OpenAI embeddings model or deterministic fake embeddings for IDs like 'fake://embeddings?size=256'. """
+    from .fake import is_fake
+    if is_fake(model_id):
+        from .fake import load_fake_embeddings
+        return load_fake_embeddings(model_id)
+
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model_id)
+
+
+@app.callback()
+def profiling(
+    ctx:typer.Context,
+    profile:Annotated[Path, typer.Option(help="Profile the command and write the profile to this path: a speedscope file from the pyinstrument sampling profiler if it ends in '.json' (needs pyinstrument) or otherwise a pstats file from cProfile.")]=None,
+    profile_memory:Annotated[Path, typer.Option(help="Trace the memory allocations of the command with tracemalloc and write a report of the peak memory and the largest allocations to this path.")]=None,
+):
+    """ Uses an LLM to determine which were plausible readings in the Vorlage of a translation of a text. """
+    from .profiling import start_profiler, start_memory_profiler
+
+    # The callbacks are called in reverse order so the memory is reported before the profile is written
+    if profile:
+        ctx.call_on_close(start_profiler(profile))
+    if profile_memory:
+        ctx.call_on_close(start_memory_profiler(profile_memory))
+
+
+def report_metrics(metrics:RunMetrics, trace:Path|None=None, trace_format:str="jsonl", summary:bool=True) -> None:
+    """ Prints the summary of the stages and the token usage of a run (if `summary` is True) and writes the trace if a path is given. """
+    if summary:
+        metrics.print_summary(console)
+    if trace:
+        metrics.write_trace(trace, format=trace_format)
+        console.print(f"Wrote the trace of the run to '{trace}'")
+
+
+def select_source_readings(
+    source_chains:list,
+    models:list[str],
+    inputs:dict,
+    readings_count:int,
+    samples:int=1,
+    adaptive:bool=False,
+    corresponding_text_chains:list|None=None,
+    corresponding_text_inputs:dict|None=None,
+    source_inputs:Callable[[str], dict]|None=None,
+) -> tuple[list[int], str, int, str]:
+    """
+    Selects the possible source readings with the first model in the cascade, escalating to the next model when the answer is not informative.
+
+    If `corresponding_text_chains` are given, then an escalated model also finds the corresponding text again
+    (from `corresponding_text_inputs`) and `source_inputs` builds the inputs to its source chain from that text.
+
+    Returns:
+        list[int]: The indexes of the selected readings.
+        str: The justification.
+        int: The number of escalations.
+        str: The corresponding text used by the model which gave the answer.
+    """
+    from .chains import invoke_self_consistency, needs_escalation
+
+    escalations = 0
+    for model_index, source_chain in enumerate(source_chains):
+        if model_index and corresponding_text_chains:
+            inputs = source_inputs(corresponding_text_chains[model_index].invoke(corresponding_text_inputs))
+
+        results, justification = invoke_self_consistency(source_chain, inputs, samples=samples, adaptive=adaptive)
+        if model_index == len(source_chains) - 1 or not needs_escalation(results, readings_count):
+            break
+
+        console.print(f"Escalating from '{models[model_index]}' to '{models[model_index+1]}'", style="yellow")
+        escalations += 1
+
+    return results, justification, escalations, inputs['doc_corresponding_text']
+
+
+def apply_source_readings(
+    app,
+    readings:list,
+    results:list[int],
+    justification:str,
+    siglum:str,
+    doc_corresponding_text:str,
+    doc_language_code:str,
+    resp_id:str,
+) -> None:
+    """ Adds the witness to the selected readings of an <app> and records the justification in a <witDetail>. """
+    for index, reading in enumerate(readings):
+        reading_text = extract_text(reading)
+        if index in results:
+            console.print(f"[bold green]✓ {reading_text}")
+            add_witness_readings(reading, siglum)
+        else:
+            console.print(f"[grey62]𐄂 {reading_text}")
+
+    add_wit_detail(app, siglum, phrase=doc_corresponding_text, phrase_lang=doc_language_code, note=justification, resp_id=resp_id)
+                    
+    console.print(justification, style="blue")
+
+
+def assign_indistinguishable_readings(app, readings:list, reading_texts:list[str], siglum:str, resp_id:str) -> None:
+    """ Adds the witness to all the readings of an <app> when the pre-filter finds that they are indistinguishable. """
+    console.print(f"[bold green]✓ Readings are indistinguishable: {', '.join(reading_texts)}")
+    add_witness_readings(readings, siglum)
+    add_wit_detail(app, siglum, note="The readings are indistinguishable after normalization so all were assigned without an LLM.", resp_id=resp_id)
+
+
+def run_batch_api(
+    doc,
+    apparatus,
+    output:Path,
+    apps:list,
+    pending_apps:dict[str,list],
+    backend,
+    state_path:Path,
+    model:str,
+    siglum:str,
+    resp_id:str,
+    doc_language:str,
+    doc_language_code:str,
+    apparatus_language:str,
+    notes:str="",
+    temperature:float=None,
+    initiate_response:bool=False,
+    samples:int=1,
+    doc_db=None,
+    apparatus_db=None,
+    ignore:list[str]=None,
+    wait:bool=False,
+    poll_interval:float=60.0,
+    pretty_print:bool=True,
+    structured:bool=False,
+    prefilter:bool=False,
+    prefilter_similarity:float=1.0,
+):
+    """
+    Runs the pipeline with a batch API in two phases: first the corresponding text prompts and then the source prompts which depend on them.
+
+    The state of each phase is saved in `state_path` so that the same command can be run again to resume
+    once the batch for a phase has completed.
+
+    If `structured` is True, then JSON responses are requested and responses which are not valid fall back to the free-text parser
+    (a batch cannot re-ask the LLM). If `prefilter` is True, then <app> elements with indistinguishable readings are assigned
+    before the batches are built.
+    """
+    from .chains import (
+        parse_result, strip_hyphens, vote_on_outputs, parse_structured_result, parse_structured_text, ParseStats, StructuredOutputError,
+    )
+    from .prompts import readings_list_to_str, bracketed_reading_list, build_corresponding_text_prompt, build_source_prompt
+    from .plan import get_similar_verse_examples
+    from .batch import BatchState, batch_request, run_batch_phase
+
+    state = BatchState.load(state_path)
+    app_keys = {app: str(index) for index, app in enumerate(apps)}
+    pending = []
+    prefiltered_count = 0
+    for verse, verse_apps in pending_apps.items():
+        for app in verse_apps:
+            if prefilter:
+                readings = find_readings(app, ignore_types=ignore)
+                reading_texts = [extract_text(reading) for reading in readings]
+                if readings_indistinguishable(reading_texts, min_similarity=prefilter_similarity):
+                    assign_indistinguishable_readings(app, readings, reading_texts, siglum, resp_id)
+                    prefiltered_count += 1
+                    continue
+            pending.append((app_keys[app], verse, app))
+    if prefilter:
+        console.print(f"The pre-filter resolved {prefiltered_count} <app> elements, avoiding {prefiltered_count * (1 + samples)} LLM calls.")
+
+    verse_texts = {verse: get_verse_text(doc, verse) for _, verse, _ in pending}
+    parse_stats = ParseStats()
+
+    def parse_output(output:str, inputs:dict, parser, fallback_parser):
+        if not structured:
+            return fallback_parser(output)
+        parse_stats.count(responses=1)
+        try:
+            return parser(output, inputs)
+        except StructuredOutputError:
+            parse_stats.count(failures=1, fallbacks=1)
+            return fallback_parser(output)
+
+    def corresponding_text_requests():
+        prompt = build_corresponding_text_prompt(doc_language=doc_language, apparatus_language=apparatus_language, initiate_response=initiate_response, structured=structured)
+        requests = []
+        for key, verse, app in pending:
+            reading_texts = [extract_text(reading) for reading in find_readings(app, ignore_types=ignore)]
+            permutations = "\n".join([permutation.text for permutation in get_reading_permutations(apparatus, verse, witness=siglum, bracket_app=app, max_permutations=10, ignore_types=ignore)])
+            messages = prompt.invoke(dict(
+                doc_verse_text=verse_texts[verse],
+                permutations=permutations,
+                reading_list=bracketed_reading_list(reading_texts),
+            )).to_messages()
+            requests.append(batch_request(f"corresponding-{key}", messages, model=model, temperature=temperature, json_mode=structured))
+        return requests
+
+    console.print(f"Corresponding text phase: {len(pending)} <app> elements")
+    results = run_batch_phase(state, backend, "corresponding", corresponding_text_requests, wait=wait, poll_interval=poll_interval)
+    if results is None:
+        console.print(f"The batch for the corresponding text phase has not completed. Run the same command again to resume from '{state_path}'.")
+        return apparatus
+
+    for key, _, _ in pending:
+        if f"corresponding-{key}" in results and key not in state.apps:
+            state.apps[key] = dict(corresponding_text=parse_output(results[f"corresponding-{key}"], {}, parse_structured_text, strip_hyphens))
+    state.save()
+
+    def source_requests():
+        prompt = build_source_prompt(doc_language=doc_language, apparatus_language=apparatus_language, notes=notes, initiate_response=initiate_response, structured=structured)
+        requests = []
+        apparatus_verse_texts = dict()
+        for key, verse, app in pending:
+            if key not in state.apps:
+                continue
+            readings = find_readings(app, ignore_types=ignore)
+            readings_string = readings_list_to_str([extract_text(reading) for reading in readings])
+            if verse not in apparatus_verse_texts:
+                apparatus_verse_texts[verse] = get_apparatus_verse_texts(find_parent(app, "ab"))
+            apparatus_verse_text = apparatus_verse_texts[verse].get(app) or get_apparatus_verse_text(app)
+            doc_corresponding_text = state.apps[key]['corresponding_text']
+            inputs = dict(
+                doc_verse_text=verse_texts[verse],
+                doc_corresponding_text=doc_corresponding_text,
+                apparatus_verse_text=apparatus_verse_text,
+                readings=readings_string,
+                similar_verse_examples=get_similar_verse_examples(
+                    doc,
+                    apparatus,
+                    verse,
+                    siglum=siglum,
+                    readings=readings,
+                    doc_verse_text=verse_texts[verse],
+                    doc_corresponding_text=doc_corresponding_text,
+                    apparatus_verse_text=apparatus_verse_text,
+                    readings_string=readings_string,
+                    doc_language=doc_language,
+                    apparatus_language=apparatus_language,
+                    doc_db=doc_db,
+                    apparatus_db=apparatus_db,
+                    ignore=ignore,
+                ),
+            )
+            messages = prompt.invoke(inputs).to_messages()
+            for sample in range(samples):
+                requests.append(batch_request(f"source-{key}-{sample}", messages, model=model, temperature=temperature, json_mode=structured))
+        return requests
+
+    console.print(f"Source phase: {len(state.apps)} <app> elements")
+    results = run_batch_phase(state, backend, "source", source_requests, wait=wait, poll_interval=poll_interval)
+    if results is None:
+        console.print(f"The batch for the source phase has not completed. Run the same command again to resume from '{state_path}'.")
+        return apparatus
+
+    applied_count = 0
+    for key, _, app in pending:
+        inputs = dict(readings=readings_list_to_str([extract_text(reading) for reading in find_readings(app, ignore_types=ignore)]))
+        outputs = [
+            parse_output(results[f"source-{key}-{sample}"], inputs, parse_structured_result, parse_result) 
+            for sample in range(samples) if f"source-{key}-{sample}" in results
+        ]
+        if not outputs:
+            continue
+
+        selected, justification = vote_on_outputs(outputs)
+        for index, reading in enumerate(find_readings(app, ignore_types=ignore)):
+            if index in selected:
+                add_witness_readings(reading, siglum)
+
+        add_wit_detail(app, siglum, phrase=state.apps[key]['corresponding_text'], phrase_lang=doc_language_code, note=justification, resp_id=resp_id)
+        applied_count += 1
+
+    console.print(f"Applied the batch results to {applied_count} of {len(pending)} <app> elements.")
+    if applied_count < len(pending):
+        console.print(f"{len(pending) - applied_count} <app> elements failed in the batch. Run again without --batch-api or with a new --batch-state to complete them.")
+
+    if structured:
+        console.print(
+            f"{parse_stats.failures} of {parse_stats.responses} structured responses could not be parsed "
+            f"(failure rate {parse_stats.failure_rate:.1%}), {parse_stats.fallbacks} fell back to the free-text parser."
+        )
+
+    print("Writing TEI XML output to", output)
+    write_tei(apparatus, output, pretty_print=pretty_print)
+
+    return apparatus
+
+
 @app.command()
 def run(
     doc: Path, 
@@ -58,13 +366,57 @@ def run(
     include:list[str]=None,
     ignore:list[str]=None,
     initiate_response:bool=False,
+    temperature:float=None,
+    samples:Annotated[int, typer.Option(help="The number of times to sample the selection of the source readings for each <app> and then vote (self-consistency).")]=1,
+    adaptive_samples:Annotated[bool, typer.Option(help="Only take more than two samples when the first two disagree.")]=False,
+    prefilter:Annotated[bool, typer.Option(help="Assign the witness to all readings without calling the LLM when the readings are indistinguishable after normalization.")]=False,
+    prefilter_similarity:Annotated[float, typer.Option(help="The minimum Levenshtein similarity between normalized readings for the pre-filter to treat them as indistinguishable. The default of 1.0 only allows exact matches after normalization. Lower values (e.g. 0.9) also allow near matches.")]=1.0,
+    cascade:Annotated[str, typer.Option(help="A comma-separated list of models (e.g. 'small,large') to use instead of --model. Each <app> goes to the first model and is only escalated to the next if the answer is NONE, all readings or cannot be parsed.")]="",
+    structured:Annotated[bool, typer.Option(help="Ask the LLM to respond with JSON which is validated (using JSON mode for OpenAI models).")]=False,
+    max_reasks:Annotated[int, typer.Option(help="The number of times to re-ask the LLM when a structured response is not valid before falling back to the free-text parser.")]=2,
+    requests_per_minute:Annotated[float, typer.Option(help="The maximum number of requests per minute to send to each model (0 for no limit).")]=0,
+    tokens_per_minute:Annotated[float, typer.Option(help="The maximum number of prompt tokens per minute to send to each model, estimated from the rendered prompts (0 for no limit).")]=0,
+    max_retries:Annotated[int, typer.Option(help="The number of times to retry a request after a rate-limit or transient error, with jittered exponential backoff.")]=6,
+    batch_api:Annotated[bool, typer.Option(help="Submit the prompts as batch files in two phases (corresponding text and then sources) instead of calling the LLM for each <app>.")]=False,
+    batch_backend:Annotated[str, typer.Option(help="Where to submit the batch files: 'openai' for the OpenAI Batch API or 'local' to process them with the LLM on this machine.")]="openai",
+    batch_state:Annotated[Path, typer.Option(help="The JSON file to save the state of the batch run so that it can be resumed. Defaults to the output path with the suffix '.batch.json'.")]=None,
+    batch_wait:Annotated[bool, typer.Option(help="Wait for each batch to complete instead of exiting so that the command can be run again later.")]=False,
+    batch_poll_interval:Annotated[float, typer.Option(help="The number of seconds between checking the status of a batch when using --batch-wait.")]=60.0,
+    plan:Annotated[Path, typer.Option(help="A work plan made with `vorlagellm plan` with the prompt inputs for each <app> so that they do not need to be computed again.")]=None,
+    workers:Annotated[int, typer.Option(help="The number of <app> elements to process in parallel when using --plan.")]=1,
+    compact:Annotated[bool, typer.Option(help="Write the output without indentation, which is faster for large apparatus files. Outputs ending in '.gz' or '.zst' are compressed.")]=False,
+    embedding_model:Annotated[str, typer.Option(help="The embeddings model for the databases of similar verses (or 'fake://embeddings' for offline testing).")]=DEFAULT_EMBEDDING_MODEL_ID,
+    trace:Annotated[Path, typer.Option(help="A file to write the timing of each stage for each <app> and the token usage of each LLM response.")]=None,
+    trace_format:Annotated[str, typer.Option(help="The format of the --trace file: 'jsonl' (one record per line) or 'chrome' (trace events for chrome://tracing or Perfetto).")]="jsonl",
+    progress:Annotated[bool, typer.Option(help="Show the progress of the pending <app> elements with the rate of <app> elements and tokens per minute, the prompt cache hit rate and the estimated time remaining.")]=True,
+    show_metrics:Annotated[bool, typer.Option("--metrics/--no-metrics", help="Print a table of the time of each stage with the token usage and counts at the end of the run.")]=True,
 ):
     """ Runs the main VorlageLLM pipeline on a document to predict which source readings from an apparatus could have produced its text. """
-    llm = llmloader.load(model=model, api_key=api_key)
+    from .chains import build_corresponding_text_chain, build_source_chain, ParseStats
+    from .prompts import readings_list_to_str, bracketed_reading_list
+    from .plan import get_similar_verse_examples, read_plan, similar_verse_examples_text
+    from .batch import LocalBatchBackend, OpenAIBatchBackend
+    from .rag import get_apparatus_db, get_teidoc_db
+    from .scheduler import RequestScheduler, ScheduledLLM
+
+    assert trace_format in TRACE_FORMATS, f"The trace format must be one of {TRACE_FORMATS}, not '{trace_format}'"
+    metrics = RunMetrics()
+    models = [model_id.strip() for model_id in cascade.split(",") if model_id.strip()] if cascade else [model]
+    schedulers = [
+        RequestScheduler(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute, max_retries=max_retries) 
+        for _ in models
+    ]
+    llms = [
+        ScheduledLLM(load_llm(model_id, api_key=api_key, temperature=temperature), scheduler, metrics=metrics, model=model_id) 
+        for model_id, scheduler in zip(models, schedulers)
+    ]
+    llm = llms[0]
+    model = "+".join(models)
     doc_path = doc
-    doc = read_tei(doc_path)
     apparatus_path = apparatus
-    apparatus = read_tei(apparatus_path)
+    with metrics.stage("read_tei"):
+        doc = read_tei(doc_path)
+        apparatus = read_tei(apparatus_path)
 
     # Add as witness to apparatus
     siglum = siglum or get_siglum(doc)
@@ -92,123 +444,417 @@ def run(
 
     # Create database for apparatus
     if doc_db:
-        embeddings_model = OpenAIEmbeddings(model=DEFAULT_EMBEDDING_MODEL_ID)
-        doc_db = get_teidoc_db(doc, model=embeddings_model, path=doc_db)
+        with metrics.stage("databases"):
+            embeddings_model = load_embeddings(embedding_model)
+            doc_db = get_teidoc_db(doc, model=embeddings_model, path=doc_db)
     
     if apparatus_db:
-        embeddings_model = OpenAIEmbeddings(model=DEFAULT_EMBEDDING_MODEL_ID)
-        apparatus_db = get_apparatus_db(apparatus, model=embeddings_model, path=apparatus_db, ignore_types=ignore)
+        with metrics.stage("databases"):
+            embeddings_model = load_embeddings(embedding_model)
+            apparatus_db = get_apparatus_db(apparatus, model=embeddings_model, path=apparatus_db, ignore_types=ignore)
 
     # Create chain to use
-    corresponding_text_chain = build_corresponding_text_chain(llm, doc_language=doc_language, apparatus_language=apparatus_language, initiate_response=initiate_response)
-    source_chain = build_source_chain(llm, doc_language=doc_language, apparatus_language=apparatus_language, notes=notes, initiate_response=initiate_response)
+    parse_stats = ParseStats()
+    corresponding_text_chains = [
+        build_corresponding_text_chain(
+            cascade_llm, 
+            doc_language=doc_language, 
+            apparatus_language=apparatus_language, 
+            initiate_response=initiate_response, 
+            structured=structured, 
+            max_reasks=max_reasks, 
+            parse_stats=parse_stats,
+        )
+        for cascade_llm in llms
+    ]
+    corresponding_text_chain = corresponding_text_chains[0]
+    source_chains = [
+        build_source_chain(
+            cascade_llm, 
+            doc_language=doc_language, 
+            apparatus_language=apparatus_language, 
+            notes=notes, 
+            initiate_response=initiate_response, 
+            structured=structured, 
+            max_reasks=max_reasks, 
+            parse_stats=parse_stats,
+        )
+        for cascade_llm in llms
+    ]
 
     verses = get_verses(apparatus)
     if include:
         verses = [v for v in verses if v in include]
 
-    for verse in verses:
-        doc_verse_text = get_verse_text(doc, verse)
-        console.rule(f"Verse '{verse}'", style="bold red")
-        console.print(f"Text: {doc_verse_text}")
-        apparatus_verse_element = get_verse_element(apparatus, verse)
-
-        for app in find_elements(apparatus_verse_element, ".//app"):
-            if app_has_witness(app, siglum):
+    # Find the <app> elements which still need the witness so that completed verses are skipped
+    with metrics.stage("pending"):
+        apps = find_elements(apparatus, ".//app")
+        app_indexes = {app: index for index, app in enumerate(apps)}
+        witnessed_app_indexes = get_witnessed_app_indexes(apparatus, siglum)
+        pending_apps = dict()
+        pending_app_indexes = dict()
+        for index, app in enumerate(apps):
+            if index in witnessed_app_indexes:
                 continue
-
-            readings = find_readings(app, ignore_types=ignore)
-            if len(readings) < 2:
+            verse_element = find_parent(app, "ab")
+            if verse_element is None or len(find_readings(app, ignore_types=ignore)) < 2:
                 continue
+            pending_apps.setdefault(verse_element.attrib.get("n"), []).append(app)
+            pending_app_indexes[index] = verse_element.attrib.get("n")
 
-            apparatus_verse_text = get_apparatus_verse_text(app)
+    verses = [v for v in verses if v in pending_apps]
+    pending_count = sum(len(pending_apps[verse]) for verse in verses)
+    console.print(f"{pending_count} <app> elements remaining in {len(verses)} verses ({len(witnessed_app_indexes)} of {len(apps)} already have witness '{siglum}')")
 
-            console.print(f"Apparatus text: [blue]{apparatus_verse_text}[/blue]")
-                
-            reading_texts = [extract_text(reading) for reading in readings]
-            reading_list = ", ".join([("⸂" + reading + "⸃") if reading else "⸂OMISSION⸃" for reading in reading_texts])
-            readings_string = readings_list_to_str([extract_text(reading) for reading in readings])
-            permutations = "\n".join([permutation.text for permutation in get_reading_permutations(apparatus, verse, witness=siglum, bracket_app=app, max_permutations=10, ignore_types=ignore)])
-            doc_corresponding_text = corresponding_text_chain.invoke(dict(
-                doc_verse_text=doc_verse_text,
-                permutations=permutations,
-                reading_list=reading_list
-            ))
-            
-            console.print(f"Corresponding text: [blue]{doc_corresponding_text}[/blue]")
-
-            # find similar verses
-            similar_verses = set()
-            if doc_db:
-                doc_verse_text = doc_verse_text or ""
-                similar_verses.update(get_similar_verses_by_phrase(doc_db, doc_verse_text))
-                if doc_corresponding_text:
-                    similar_verses.update(get_similar_verses_by_phrase(doc_db, doc_corresponding_text))
-            if apparatus_db:
-                for reading in readings:
-                    similar_verses.update(get_similar_verses_by_phrase(apparatus_db, extract_text(reading)))
-            similar_verses.discard(verse)
-            
-            similar_verse_examples = ""
-            if similar_verses:
-                similar_verse_examples = (
-                    f"Here are {len(similar_verses)} similar texts to the one that you need to analyze. "
-                    f"You will see the {doc_language} language text and then all potential {apparatus_language} source texts. "
-                    f"Even though might not clear which {apparatus_language} was the actual source, consider the translation technique going from {apparatus_language} to {doc_language}.\n"
-                    "See the way that the translator has translated particular words and gramatical constructions that are similar to the texts you need to analyze. \n\n"
+    if batch_api:
+        assert len(models) == 1, "The batch API cannot be used with a model cascade"
+        assert not adaptive_samples, "The batch API cannot be used with adaptive samples because the samples are all requested in one batch"
+        if structured and max_reasks:
+            console.print("Responses which are not valid cannot be re-asked with the batch API so --max-reasks is not used. They fall back to the free-text parser.")
+        assert batch_backend in ["openai", "local"], f"The batch backend must be 'openai' or 'local', not '{batch_backend}'"
+        backend = LocalBatchBackend(llm) if batch_backend == "local" else OpenAIBatchBackend(api_key=api_key)
+        with metrics.stage("batch_api"):
+            run_batch_api(
+                doc,
+                apparatus,
+                output,
+                apps=apps,
+                pending_apps={verse: pending_apps[verse] for verse in verses},
+                backend=backend,
+                state_path=batch_state or output.with_suffix(".batch.json"),
+                model=getattr(llm.llm, "model_name", models[0]),
+                siglum=siglum,
+                resp_id=resp_id,
+                doc_language=doc_language,
+                doc_language_code=doc_language_code,
+                apparatus_language=apparatus_language,
+                notes=notes,
+                temperature=temperature,
+                initiate_response=initiate_response,
+                samples=samples,
+                doc_db=doc_db,
+                apparatus_db=apparatus_db,
+                ignore=ignore,
+                wait=batch_wait,
+                poll_interval=batch_poll_interval,
+                pretty_print=not compact,
+                structured=structured,
+                prefilter=prefilter,
+                prefilter_similarity=prefilter_similarity,
+            )
+        report_metrics(metrics, trace=trace, trace_format=trace_format, summary=show_metrics)
+        return apparatus
+
+    prefiltered_count = 0
+    escalated_count = 0
+    with RunProgress(pending_count, metrics=metrics, console=console, disable=not progress) as run_progress:
+        if plan:
+            plan_metadata, plan_rows = read_plan(plan)
+            assert plan_metadata['apps'] == len(apps), f"The plan '{plan}' has {plan_metadata['apps']} <app> elements but the apparatus has {len(apps)}"
+            assert sorted(plan_metadata['ignore'] or []) == sorted(ignore or []), f"The plan '{plan}' was made with different reading types ignored: {plan_metadata['ignore']}"
+            assert plan_metadata['siglum'] == siglum, f"The plan '{plan}' was made for the siglum '{plan_metadata['siglum']}' and not '{siglum}'"
+            assert Path(plan_metadata['doc']).resolve() == Path(doc_path).resolve(), f"The plan '{plan}' was made for the document '{plan_metadata['doc']}' and not '{doc_path}'"
+            assert Path(plan_metadata['apparatus']).resolve() == Path(apparatus_path).resolve(), f"The plan '{plan}' was made for the apparatus '{plan_metadata['apparatus']}' and not '{apparatus_path}'"
+            assert (plan_metadata['doc_language'], plan_metadata['apparatus_language']) == (doc_language, apparatus_language), (
+                f"The plan '{plan}' was made for the languages '{plan_metadata['doc_language']}' and '{plan_metadata['apparatus_language']}' "
+                f"and not '{doc_language}' and '{apparatus_language}'"
+            )
+            pending_verses = set(verses)
+            plan_rows = [row for row in plan_rows if row['index'] in pending_app_indexes and pending_app_indexes[row['index']] in pending_verses]
+            run_progress.set_total(len(plan_rows))
+
+            def process_plan_row(row:dict):
+                corresponding_text_inputs = dict(
+                    doc_verse_text=row['doc_verse_text'],
+                    permutations=row['permutations'],
+                    reading_list=row['reading_list'],
                 )
-                for similar_verse in similar_verses:
-                    example_doc_text = get_verse_text(doc, similar_verse)
-                    similar_verse_permutations = get_reading_permutations(apparatus, similar_verse, witness=siglum, max_permutations=5, ignore_types=ignore)
-                    similar_readings = readings_list_to_str([similar_verse_permutation.text for similar_verse_permutation in similar_verse_permutations])
-                    similar_verse_examples += (
-                        f"{doc_language} example {similar_verse}:\n{example_doc_text}\n"
-                        f"Possible {apparatus_language} source(s):\n{similar_readings}\n\n"
+
+                def source_inputs(doc_corresponding_text:str) -> dict:
+                    with metrics.stage("examples", app=row['index'], verse=row['verse']):
+                        similar_verse_examples = similar_verse_examples_text(
+                            row['similar_verse_context'],
+                            doc_verse_text=row['doc_verse_text'],
+                            doc_corresponding_text=doc_corresponding_text,
+                            apparatus_verse_text=row['apparatus_verse_text'],
+                            readings_string=row['readings'],
+                            doc_language=doc_language,
+                            apparatus_language=apparatus_language,
+                        )
+                    return dict(
+                        doc_verse_text=row['doc_verse_text'],
+                        doc_corresponding_text=doc_corresponding_text,
+                        apparatus_verse_text=row['apparatus_verse_text'],
+                        readings=row['readings'],
+                        similar_verse_examples=similar_verse_examples,
                     )
-                similar_verse_examples += (
-                    f"Here is the {doc_language} text to analyze:\n{doc_corresponding_text}\n[Full text in context: {doc_verse_text}]\n\n"
-                    f"Here is the source {apparatus_language} text to analyze with the textual variant in brackets like this: ⸂ ⸃:\n{apparatus_verse_text}\n\n"
-                    f"Here are the potential {apparatus_language} readings that go between the brackets that could be the source of '{doc_corresponding_text}':\n{readings_string}"
-                )     
-
-            results, justification = source_chain.invoke(dict(
-                doc_verse_text=doc_verse_text,
-                doc_corresponding_text=doc_corresponding_text,
-                apparatus_verse_text=apparatus_verse_text,
-                readings=readings_string,
-                similar_verse_examples=similar_verse_examples,
-            ))
 
-            for index, reading in enumerate(readings):
-                reading_text = extract_text(reading)
-                if index in results:
-                    console.print(f"[bold green]✓ {reading_text}")
-                    add_witness_readings(reading, siglum)
-                else:
-                    console.print(f"[grey62]𐄂 {reading_text}")
+                with metrics.stage("corresponding_text", app=row['index'], verse=row['verse']):
+                    doc_corresponding_text = corresponding_text_chain.invoke(corresponding_text_inputs)
+                inputs = source_inputs(doc_corresponding_text)
+                with metrics.stage("source", app=row['index'], verse=row['verse']):
+                    results, justification, escalations, doc_corresponding_text = select_source_readings(
+                        source_chains,
+                        models,
+                        inputs,
+                        readings_count=len(row['reading_texts']),
+                        samples=samples,
+                        adaptive=adaptive_samples,
+                        corresponding_text_chains=corresponding_text_chains,
+                        corresponding_text_inputs=corresponding_text_inputs,
+                        source_inputs=source_inputs,
+                    )
+                return doc_corresponding_text, results, justification, escalations
+
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                futures = dict()
+                for row in plan_rows:
+                    app = apps[row['index']]
+                    readings = find_readings(app, ignore_types=ignore)
+                    assert len(readings) == len(row['reading_texts']), f"The readings for <app> {row['index']} in verse '{row['verse']}' do not match the plan '{plan}'"
+                    if prefilter and readings_indistinguishable(row['reading_texts'], min_similarity=prefilter_similarity):
+                        assign_indistinguishable_readings(app, readings, row['reading_texts'], siglum, resp_id)
+                        prefiltered_count += 1
+                        run_progress.skip(row['index'])
+                        continue
+                    futures[executor.submit(process_plan_row, row)] = row
+
+                for future in as_completed(futures):
+                    row = futures[future]
+                    app = apps[row['index']]
+                    doc_corresponding_text, results, justification, escalations = future.result()
+                    escalated_count += escalations
 
-            add_wit_detail(app, siglum, phrase=doc_corresponding_text, phrase_lang=doc_language_code, note=justification, resp_id=resp_id)
-                            
-            console.print(justification, style="blue")
+                    console.rule(f"Verse '{row['verse']}'", style="bold red")
+                    console.print(f"Apparatus text: [blue]{row['apparatus_verse_text']}[/blue]")
+                    console.print(f"Corresponding text: [blue]{doc_corresponding_text}[/blue]")
+                    with metrics.stage("apply", app=row['index'], verse=row['verse']):
+                        apply_source_readings(
+                            app, 
+                            find_readings(app, ignore_types=ignore), 
+                            results, 
+                            justification, 
+                            siglum=siglum, 
+                            doc_corresponding_text=doc_corresponding_text, 
+                            doc_language_code=doc_language_code, 
+                            resp_id=resp_id,
+                        )
+                    with metrics.stage("write_tei", app=row['index'], verse=row['verse']):
+                        write_tei(apparatus, output, pretty_print=not compact)
+                    run_progress.complete(row['index'])
 
-            # Write TEI XML output
-            print("Writing TEI XML output to", output)
-            write_tei(apparatus, output)
+            if prefiltered_count:
+                with metrics.stage("write_tei"):
+                    write_tei(apparatus, output, pretty_print=not compact)
+
+        else:
+            for verse in verses:
+                with metrics.stage("xml", verse=verse):
+                    doc_verse_text = get_verse_text(doc, verse)
+                    apparatus_verse_texts = get_apparatus_verse_texts(find_parent(pending_apps[verse][0], "ab"))
+                console.rule(f"Verse '{verse}'", style="bold red")
+                console.print(f"Text: {doc_verse_text}")
+
+                for app in pending_apps[verse]:
+                    app_index = app_indexes[app]
+                    with metrics.stage("xml", app=app_index, verse=verse):
+                        readings = find_readings(app, ignore_types=ignore)
+                        reading_texts = [extract_text(reading) for reading in readings]
+
+                        apparatus_verse_text = apparatus_verse_texts.get(app) or get_apparatus_verse_text(app)
+
+                    console.print(f"Apparatus text: [blue]{apparatus_verse_text}[/blue]")
+
+                    if prefilter:
+                        with metrics.stage("prefilter", app=app_index, verse=verse):
+                            indistinguishable = readings_indistinguishable(reading_texts, min_similarity=prefilter_similarity)
+                        if indistinguishable:
+                            assign_indistinguishable_readings(app, readings, reading_texts, siglum, resp_id)
+                            prefiltered_count += 1
+                            with metrics.stage("write_tei", app=app_index, verse=verse):
+                                write_tei(apparatus, output, pretty_print=not compact)
+                            run_progress.skip(app_index)
+                            continue
+                
+                    with metrics.stage("permutations", app=app_index, verse=verse):
+                        reading_list = bracketed_reading_list(reading_texts)
+                        readings_string = readings_list_to_str([extract_text(reading) for reading in readings])
+                        permutations = "\n".join([permutation.text for permutation in get_reading_permutations(apparatus, verse, witness=siglum, bracket_app=app, max_permutations=10, ignore_types=ignore)])
+                    corresponding_text_inputs = dict(
+                        doc_verse_text=doc_verse_text,
+                        permutations=permutations,
+                        reading_list=reading_list
+                    )
+                    with metrics.stage("corresponding_text", app=app_index, verse=verse):
+                        doc_corresponding_text = corresponding_text_chain.invoke(corresponding_text_inputs)
+            
+                    console.print(f"Corresponding text: [blue]{doc_corresponding_text}[/blue]")
+
+                    def source_inputs(doc_corresponding_text:str) -> dict:
+                        similar_verse_examples = get_similar_verse_examples(
+                            doc,
+                            apparatus,
+                            verse,
+                            siglum=siglum,
+                            readings=readings,
+                            doc_verse_text=doc_verse_text,
+                            doc_corresponding_text=doc_corresponding_text,
+                            apparatus_verse_text=apparatus_verse_text,
+                            readings_string=readings_string,
+                            doc_language=doc_language,
+                            apparatus_language=apparatus_language,
+                            doc_db=doc_db,
+                            apparatus_db=apparatus_db,
+                            ignore=ignore,
+                            metrics=metrics,
+                            app_index=app_index,
+                        )
+                        return dict(
+                            doc_verse_text=doc_verse_text,
+                            doc_corresponding_text=doc_corresponding_text,
+                            apparatus_verse_text=apparatus_verse_text,
+                            readings=readings_string,
+                            similar_verse_examples=similar_verse_examples,
+                        )
+
+                    inputs = source_inputs(doc_corresponding_text)
+                    with metrics.stage("source", app=app_index, verse=verse):
+                        results, justification, escalations, escalated_corresponding_text = select_source_readings(
+                            source_chains,
+                            models,
+                            inputs,
+                            readings_count=len(readings),
+                            samples=samples,
+                            adaptive=adaptive_samples,
+                            corresponding_text_chains=corresponding_text_chains,
+                            corresponding_text_inputs=corresponding_text_inputs,
+                            source_inputs=source_inputs,
+                        )
+                    escalated_count += escalations
+                    if escalated_corresponding_text != doc_corresponding_text:
+                        doc_corresponding_text = escalated_corresponding_text
+                        console.print(f"Corresponding text from '{models[escalations]}': [blue]{doc_corresponding_text}[/blue]")
+                    with metrics.stage("apply", app=app_index, verse=verse):
+                        apply_source_readings(
+                            app, 
+                            readings, 
+                            results, 
+                            justification, 
+                            siglum=siglum, 
+                            doc_corresponding_text=doc_corresponding_text, 
+                            doc_language_code=doc_language_code, 
+                            resp_id=resp_id,
+                        )
+
+                    # Write TEI XML output
+                    print("Writing TEI XML output to", output)
+                    with metrics.stage("write_tei", app=app_index, verse=verse):
+                        write_tei(apparatus, output, pretty_print=not compact)
+                    run_progress.complete(app_index)
+
+    if len(models) > 1:
+        console.print(f"{escalated_count} escalations in the model cascade.")
+
+    retries_count = sum(scheduler.stats.retries for scheduler in schedulers)
+    throttled_seconds = sum(scheduler.stats.throttled_seconds for scheduler in schedulers)
+    if retries_count or throttled_seconds:
+        console.print(f"{retries_count} requests were retried and requests waited {throttled_seconds:.1f} seconds for rate limits.")
+
+    if structured:
+        console.print(
+            f"{parse_stats.failures} of {parse_stats.responses} structured responses could not be parsed "
+            f"(failure rate {parse_stats.failure_rate:.1%}), {parse_stats.fallbacks} fell back to the free-text parser."
+        )
+
+    if prefilter:
+        console.print(f"The pre-filter resolved {prefiltered_count} <app> elements, avoiding {prefiltered_count * (1 + samples)} LLM calls.")
+
+    report_metrics(metrics, trace=trace, trace_format=trace_format, summary=show_metrics)
 
     return apparatus
 
 
+@app.command()
+def plan(
+    doc: Path, 
+    apparatus: Path,
+    output:Path,
+    apparatus_db:Path=None,
+    doc_db:Path=None,
+    siglum:str="",
+    include:list[str]=None,
+    ignore:list[str]=None,
+    embedding_model:Annotated[str, typer.Option(help="The embeddings model for the databases of similar verses (or 'fake://embeddings' for offline testing).")]=DEFAULT_EMBEDDING_MODEL_ID,
+):
+    """
+    Writes a work plan (JSONL) with the inputs to the prompts for each <app> which do not depend on the LLM.
+
+    The plan can be used with `vorlagellm run --plan` so that the inputs are not computed again for each model.
+    """
+    from .plan import iter_plan_rows, write_plan
+    from .rag import get_apparatus_db, get_teidoc_db
+
+    doc_path = doc
+    doc = read_tei(doc_path)
+    apparatus_path = apparatus
+    apparatus = read_tei(apparatus_path)
+
+    siglum = siglum or get_siglum(doc)
+    assert siglum, f"Could not determine siglum in '{doc_path}'. Please add a siglum to the TEI XML or add a siglum in the command line with --siglum"
+
+    doc_language = get_language(doc)
+    assert doc_language, f"Could not determine language of document {doc_path}"
+
+    apparatus_language = get_language(apparatus)
+    assert apparatus_language, f"Could not determine language of apparatus {apparatus_path}"
+
+    if doc_db:
+        embeddings_model = load_embeddings(embedding_model)
+        doc_db = get_teidoc_db(doc, model=embeddings_model, path=doc_db)
+    
+    if apparatus_db:
+        embeddings_model = load_embeddings(embedding_model)
+        apparatus_db = get_apparatus_db(apparatus, model=embeddings_model, path=apparatus_db, ignore_types=ignore)
+
+    apps = find_elements(apparatus, ".//app")
+    metadata = dict(
+        doc=str(Path(doc_path).resolve()),
+        apparatus=str(Path(apparatus_path).resolve()),
+        siglum=siglum,
+        doc_language=doc_language,
+        apparatus_language=apparatus_language,
+        ignore=ignore or [],
+        apps=len(apps),
+    )
+    rows = iter_plan_rows(
+        doc, 
+        apparatus, 
+        apps, 
+        siglum=siglum, 
+        doc_language=doc_language, 
+        apparatus_language=apparatus_language, 
+        include=include, 
+        ignore=ignore, 
+        doc_db=doc_db, 
+        apparatus_db=apparatus_db,
+    )
+    count = write_plan(metadata, track(rows, total=len(apps), description="Planning <app> elements"), output)
+    console.print(f"Wrote a plan for {count} <app> elements to '{output}'")
+
+
 @app.command()
 def doc_db(
     doc: Path, 
     db:Path,
+    embedding_model:Annotated[str, typer.Option(help="The embeddings model for the databases of similar verses (or 'fake://embeddings' for offline testing).")]=DEFAULT_EMBEDDING_MODEL_ID,
 ):
     """
     Creates a database for the document.
     """
-    embeddings_model = OpenAIEmbeddings(model=DEFAULT_EMBEDDING_MODEL_ID)
-    doc_path = doc
-    doc = read_tei(doc_path)    
+    from .rag import get_teidoc_db
+
+    embeddings_model = load_embeddings(embedding_model)
+    doc = load_snapshot(doc)
     db = get_teidoc_db(doc, model=embeddings_model, path=db)
     return db
 
@@ -217,11 +863,14 @@ def doc_db(
 def apparatus_db(
     apparatus: Path, 
     db:Path,
+    embedding_model:Annotated[str, typer.Option(help="The embeddings model for the databases of similar verses (or 'fake://embeddings' for offline testing).")]=DEFAULT_EMBEDDING_MODEL_ID,
 ):
     """
     Creates a database for the apparatus.
     """
-    embeddings_model = OpenAIEmbeddings(model=DEFAULT_EMBEDDING_MODEL_ID)
+    from .rag import get_apparatus_db
+
+    embeddings_model = load_embeddings(embedding_model)
     apparatus = read_tei(apparatus)    
     db = get_apparatus_db(apparatus, model=embeddings_model, path=db)
     return db
@@ -232,8 +881,11 @@ def similar(
     db:Path,
     verse:str,
     window:int=3,
+    embedding_model:Annotated[str, typer.Option(help="The embeddings model for the databases of similar verses (or 'fake://embeddings' for offline testing).")]=DEFAULT_EMBEDDING_MODEL_ID,
 ):
-    embeddings_model = OpenAIEmbeddings(model=DEFAULT_EMBEDDING_MODEL_ID)
+    from .rag import get_db, get_similar_verses
+
+    embeddings_model = load_embeddings(embedding_model)
     db = get_db(None, embeddings_model, db)
     similar_verses = get_similar_verses(db, verse, window=window)
     
@@ -246,41 +898,102 @@ def similar(
 def evaluate(
     apparatus:Path,
     gold_siglum:str,
-    prediction_siglum:str,
+    prediction_siglum:list[str],
+    additional_apparatus:list[Path]=None,
+    table:Path=None,
     false_positives:Path=None,
     false_negatives:Path=None,
+    by_verse:Path=None,
+    by_book:Path=None,
+    cache:Annotated[bool, typer.Option(help="Store a snapshot of each apparatus in the cache directory so that later calls only parse it again when the file changes. Set VORLAGELLM_CACHE_DIR to change where the snapshots are stored and use `vorlagellm clear-cache` to delete them.")]=False,
 ):
-    apparatus = read_tei(apparatus)
-    readings = find_elements(apparatus, ".//rdg")
-    tp = sum(reading_has_witness(reading, gold_siglum) and reading_has_witness(reading, prediction_siglum) for reading in readings)
-    fp = sum(reading_has_witness(reading, prediction_siglum) and not reading_has_witness(reading, gold_siglum) for reading in readings)
-    fn = sum(reading_has_witness(reading, gold_siglum) and not reading_has_witness(reading, prediction_siglum) for reading in readings)
-    tn = sum(not reading_has_witness(reading, gold_siglum) and not reading_has_witness(reading, prediction_siglum) for reading in readings)
-    recall = tp / (tp + fn)
-    precision = tp / (tp + fp)
-    f1 = 2 * (precision * recall) / (precision + recall)
-    fpr = fp / (fp + tn)
-    fnr = fn / (fn + tp)
-    console.print(f"Recall: {recall:.1%}")
-    console.print(f"Precision: {precision:.1%}")
-    console.print(f"False Negative Rate: {fnr:.1%}")
-    console.print(f"False Positive Rate: {fpr:.1%}")
-    console.print(f"False Positives: {fp}")
-    console.print(f"False Negatives: {fn}")
-    console.print(f"True Positives: {tp}")
-    console.print(f"True Negatives: {tn}")
-
-    console.print(f"F1: {f1:.1%}")
+    """ 
+    Evaluates the readings predicted for witnesses against the readings of a gold standard witness in the same apparatus. 
+    
+    Multiple prediction sigla and apparatus files (with --additional-apparatus) can be evaluated together.
+    Each apparatus is only parsed once and the results can be saved as a CSV or JSON table with --table.
+    """
+    apparatus_paths = [apparatus, *(additional_apparatus or [])]
+    single = len(apparatus_paths) == 1 and len(prediction_siglum) == 1
+    assert single or not (false_positives or false_negatives or by_verse or by_book), \
+        "--false-positives, --false-negatives, --by-verse and --by-book can only be used with a single apparatus and prediction siglum"
+
+    rows = []
+    for apparatus_path in apparatus_paths:
+        snapshot = load_snapshot(apparatus_path, cache=cache)
+
+        # Extract the membership of all witnesses for all readings once
+        membership = snapshot.witness_matrix([gold_siglum, *prediction_siglum])
+        gold = membership[:, 0]
+        confusion_matrices = confusion_matrices_from_membership(gold, membership[:, 1:])
+        for siglum, confusion_matrix in zip(prediction_siglum, confusion_matrices):
+            rows.append(dict(
+                apparatus=str(apparatus_path), 
+                gold_siglum=gold_siglum, 
+                prediction_siglum=siglum, 
+                **confusion_matrix.as_dict(),
+            ))
+
+    if table:
+        console.print(f"Writing evaluation table to {table}")
+        write_evaluation_table(rows, table)
+
+    if not single:
+        results_table = Table("Apparatus", "Prediction", "Recall", "Precision", "F1", "FP", "FN", "TP", "TN")
+        for row in rows:
+            results_table.add_row(
+                row['apparatus'],
+                row['prediction_siglum'],
+                f"{row['recall']:.1%}",
+                f"{row['precision']:.1%}",
+                f"{row['f1']:.1%}",
+                str(row['false_positives']),
+                str(row['false_negatives']),
+                str(row['true_positives']),
+                str(row['true_negatives']),
+            )
+        console.print(results_table)
+        return
+
+    prediction = membership[:, 1]
+    confusion_matrix = confusion_matrices[0]
+    console.print(f"Recall: {confusion_matrix.recall:.1%}")
+    console.print(f"Precision: {confusion_matrix.precision:.1%}")
+    console.print(f"False Negative Rate: {confusion_matrix.false_negative_rate:.1%}")
+    console.print(f"False Positive Rate: {confusion_matrix.false_positive_rate:.1%}")
+    console.print(f"False Positives: {confusion_matrix.false_positives}")
+    console.print(f"False Negatives: {confusion_matrix.false_negatives}")
+    console.print(f"True Positives: {confusion_matrix.true_positives}")
+    console.print(f"True Negatives: {confusion_matrix.true_negatives}")
+
+    console.print(f"F1: {confusion_matrix.f1:.1%}")
+
+    if by_verse or by_book:
+        verses = np.array(snapshot.reading_verses, dtype=str)
+
+    if by_verse:
+        console.print(f"Writing metrics for each verse to {by_verse}")
+        write_confusion_matrices(grouped_confusion_matrices(gold, prediction, verses), by_verse, label="verse")
+
+    if by_book:
+        books = np.array([get_book(verse) for verse in verses], dtype=str)
+        console.print(f"Writing metrics for each book to {by_book}")
+        write_confusion_matrices(grouped_confusion_matrices(gold, prediction, books), by_book, label="book")
+
+    if false_positives or false_negatives:
+        # The elements are only needed to write the false positives or negatives so the apparatus is only parsed here
+        readings = find_elements(read_tei(apparatus_path), ".//rdg")
+        assert len(readings) == len(snapshot.reading_witnesses), f"The snapshot of '{apparatus_path}' is out of date"
 
     if false_positives:
-        fp_readings = [reading for reading in readings if reading_has_witness(reading, prediction_siglum) and not reading_has_witness(reading, gold_siglum)]
-        abs = set(find_parent(reading, "ab") for reading in fp_readings)
+        fp_readings = [readings[index] for index in np.flatnonzero(prediction & ~gold)]
+        abs = dict.fromkeys(find_parent(reading, "ab") for reading in fp_readings)
         console.print(f"Writing {len(fp_readings)} false positives to {false_positives}")
         write_elements(abs, false_positives, "listApp", type="false-positives")
 
     if false_negatives:
-        fn_readings = [reading for reading in readings if reading_has_witness(reading, gold_siglum) and not reading_has_witness(reading, prediction_siglum)]
-        abs = set(find_parent(reading, "ab") for reading in fn_readings)
+        fn_readings = [readings[index] for index in np.flatnonzero(gold & ~prediction)]
+        abs = dict.fromkeys(find_parent(reading, "ab") for reading in fn_readings)
         console.print(f"Writing {len(fn_readings)} false negatives to {false_negatives}")
         write_elements(abs, false_negatives, "listApp", type="false-negatives")
 
@@ -288,11 +1001,33 @@ def evaluate(
 @app.command()
 def agreements(
     apparatus:Path,
-    siglum1:str,
-    siglum2:str,
+    siglum1:Annotated[str, typer.Argument()]="",
+    siglum2:Annotated[str, typer.Argument()]="",
     horizontal:bool=False,
+    all_pairs:Annotated[bool, typer.Option("--all", help="Compare every pair of witnesses in the apparatus and print a table for each category.")]=False,
+    output:Annotated[Path, typer.Option(help="A directory to save the tables for each category as CSV files when using --all.")]=None,
+    cache:Annotated[bool, typer.Option(help="Store a snapshot of the apparatus in the cache directory so that later calls only parse it again when the file changes (see `evaluate --cache`).")]=False,
 ):
-    apparatus = read_tei(apparatus)
+    """ Counts how often two witnesses agree in the apparatus or, with --all, how often every pair of witnesses agree. """
+    apparatus = load_snapshot(apparatus, cache=cache)
+    if all_pairs:
+        sigla, results = all_witness_agreements(apparatus)
+        for category in WitnessComparison:
+            print(category.plural)
+            print("", *sigla, sep="\t")
+            for siglum, row in zip(sigla, results[category]):
+                print(siglum, *row, sep="\t")
+            print()
+
+            if output:
+                output.mkdir(parents=True, exist_ok=True)
+                with open(output/f"{category.name.lower()}.csv", "w") as f:
+                    print("", *sigla, sep=",", file=f)
+                    for siglum, row in zip(sigla, results[category]):
+                        print(siglum, *row, sep=",", file=f)
+        return
+
+    assert siglum1 and siglum2, "Please give two sigla to compare or use --all"
     counter = count_witness_agreements(apparatus, siglum1, siglum2)
 
     # results = [
@@ -312,8 +1047,88 @@ def agreements(
 
 
 @app.command()
-def ensemble(siglum:str, output:Path, apparatuses:list[Path]):
-    apparatuses = [read_tei(apparatus) for apparatus in apparatuses]
-    result = do_ensemble(apparatuses, siglum)
+def clear_cache():
+    """ Deletes the snapshots of TEI files cached by `evaluate --cache` and `agreements --cache`. """
+    from .snapshot import clear_snapshot_cache, default_cache_directory
+
+    count = clear_snapshot_cache()
+    console.print(f"Deleted {count} cached snapshots from '{default_cache_directory()}'")
+
+
+@app.command()
+def ensemble(
+    siglum:str, 
+    output:Path, 
+    apparatuses:list[Path],
+    weight:Annotated[list[float], typer.Option(help="The weight of each apparatus in the vote (in the same order as the apparatuses).")]=None,
+    weights_table:Annotated[Path, typer.Option(help="A table from `vorlagellm evaluate --table` with the score of each apparatus to use as its weight.")]=None,
+    weight_metric:Annotated[str, typer.Option(help="The column in the weights table to use as the weight.")]="f1",
+    weights_gold_siglum:Annotated[str, typer.Option(help="Only use the rows of the weights table evaluated against this gold siglum.")]="",
+    threshold:Annotated[float, typer.Option(help="The proportion of the weight of the votes needed to include the witness in a reading.")]=0.5,
+):
+    """ Combines the predictions for a witness in multiple apparatus files with a (weighted) vote. """
+    weights = weight or None
+    if weights_table:
+        weights = load_weights(weights_table, apparatuses, siglum, metric=weight_metric, gold_siglum=weights_gold_siglum)
+    
+    result = do_ensemble(apparatuses, siglum, weights=weights, threshold=threshold)
+    print(f"Writing ensemble to {output}")
+    write_tei(result, output)
+
+
+@app.command()
+def adaptive_ensemble(
+    doc:Path,
+    apparatus:Path,
+    output:Path,
+    model:Annotated[list[str], typer.Option(help="The models to use for each run, in order. Repeat the option to add more runs.")],
+    min_runs:Annotated[int, typer.Option(help="The number of runs over the whole apparatus before only running on the contested verses.")]=3,
+    threshold:float=0.5,
+    api_key:str="",
+    siglum:str="",
+    notes:Path=None,
+    ignore:list[str]=None,
+    apparatus_db:Path=None,
+    doc_db:Path=None,
+):
+    """
+    Runs VorlageLLM with multiple models and combines the results with a vote, only running the later models on contested verses.
+
+    The first `min_runs` models are run over the whole apparatus. Each later model is only run on the verses where 
+    the existing runs disagree and where the vote could still change with the remaining runs. 
+    It stops early once no verses are contested.
+    """
+    assert len(model) >= 2, "Please give at least two models with --model"
+    assert min_runs >= 2, "The minimum number of runs must be at least two"
+    siglum = siglum or get_siglum(read_tei(doc))
+    runs_directory = output.parent/f"{output.stem}-runs"
+
+    run_outputs = []
+    for index, model_id in enumerate(model):
+        include = None
+        if index >= min_runs:
+            include = contested_verses(run_outputs, siglum, threshold=threshold, remaining_weight=len(model) - index)
+            if not include:
+                console.print("No contested verses remain.")
+                break
+            console.print(f"Running '{model_id}' on {len(include)} contested verses")
+
+        run_output = runs_directory/f"run{index}.xml"
+        run(
+            doc, 
+            apparatus, 
+            run_output, 
+            api_key=api_key, 
+            model=model_id, 
+            apparatus_db=apparatus_db, 
+            doc_db=doc_db, 
+            siglum=siglum, 
+            notes=notes, 
+            include=include, 
+            ignore=ignore,
+        )
+        run_outputs.append(run_output)
+
+    result = do_ensemble(run_outputs, siglum, threshold=threshold)
     print(f"Writing ensemble to {output}")
-    write_tei(result, output)
\ No newline at end of file
+    write_tei(result, output)
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from rich.table import Table
+
+
+TRACE_FORMATS = ["jsonl", "chrome"]
+
+
+@dataclass
+class StageEvent:
+    stage:str
+    start:float
+    duration:float
+    thread:int
+    args:dict = field(default_factory=dict)
+
+
+@dataclass
+class TokenEvent:
+    model:str
+    time:float
+    input_tokens:int
+    output_tokens:int
+    cached_tokens:int = 0
+
+
+def usage_tokens(response:Any) -> tuple[int,int]|None:
+    """
+    Returns the number of prompt and completion tokens from the metadata of an LLM response
+    (the `usage_metadata` of a LangChain message or the OpenAI 'token_usage') or None if the response does not have them.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+    return None
+
+
+def cached_tokens(response:Any) -> int:
+    """ Returns the number of prompt tokens which were read from the provider's prompt cache according to the metadata of an LLM response. """
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return (usage.get("input_token_details") or {}).get("cache_read") or 0
+
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+    return 0
+
+
+def percentile(values:list[float], fraction:float) -> float:
+    """ The value at a fraction of the way through the sorted values (using the nearest rank). """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class RunMetrics:
+    """
+    Records the wall time of each stage of the pipeline (with arguments such as the <app> it was for),
+    the token usage from the LLM responses and counts of other events such as retrievals.
+
+    It can be used from several threads.
+    """
+    def __init__(self, clock:Callable[[], float]=time.perf_counter):
+        self.clock = clock
+        self.start = clock()
+        self.stages:list[StageEvent] = []
+        self.tokens:list[TokenEvent] = []
+        self.counts = Counter()
+        self.calls = Counter()
+        self.input_tokens = Counter()
+        self.output_tokens = Counter()
+        self.cached_tokens = Counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name:str, **args):
+        """ Times the code in a `with` block as a stage with the arguments given (e.g. `app=12`). """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            event = StageEvent(name, start - self.start, self.clock() - start, threading.get_ident(), args)
+            with self.lock:
+                self.stages.append(event)
+
+    def record_usage(self, model:str, response:Any) -> None:
+        """ Records the tokens used by an LLM response if its metadata has them. """
+        usage = usage_tokens(response)
+        with self.lock:
+            self.calls[model] += 1
+            if usage:
+                event = TokenEvent(model, self.clock() - self.start, *usage, cached_tokens=cached_tokens(response))
+                self.tokens.append(event)
+                self.input_tokens[model] += event.input_tokens
+                self.output_tokens[model] += event.output_tokens
+                self.cached_tokens[model] += event.cached_tokens
+
+    def count(self, name:str, amount:int=1) -> None:
+        with self.lock:
+            self.counts[name] += amount
+
+    @property
+    def elapsed(self) -> float:
+        return self.clock() - self.start
+
+    def stage_durations(self) -> dict[str, list[float]]:
+        """ The durations of each stage in the order that the stages were first recorded. """
+        durations = dict()
+        with self.lock:
+            for event in self.stages:
+                durations.setdefault(event.stage, []).append(event.duration)
+        return durations
+
+    def token_totals(self) -> dict[str, tuple[int,int]]:
+        """ The total prompt and completion tokens for each model. """
+        with self.lock:
+            return {model: (self.input_tokens[model], self.output_tokens[model]) for model in self.input_tokens}
+
+    def cache_hit_rate(self) -> float|None:
+        """ The proportion of the prompt tokens which were read from the provider's prompt cache (or None if there were no prompt tokens). """
+        with self.lock:
+            input_tokens = sum(self.input_tokens.values())
+            cached = sum(self.cached_tokens.values())
+        return cached / input_tokens if input_tokens else None
+
+    def summary_table(self) -> Table:
+        """ A table with the count and the total, mean, 95th percentile and maximum times of each stage. """
+        elapsed = self.elapsed
+        table = Table(title=f"Stages of the run ({elapsed:.2f} s)")
+        table.add_column("Stage", no_wrap=True)
+        for column in ["Count", "Total (s)", "% of run", "Mean (ms)", "p95 (ms)", "Max (ms)"]:
+            table.add_column(column, justify="right")
+        for stage, durations in self.stage_durations().items():
+            total = sum(durations)
+            table.add_row(
+                stage,
+                str(len(durations)),
+                f"{total:.3f}",
+                f"{total / elapsed:.1%}" if elapsed else "",
+                f"{1000 * total / len(durations):.1f}",
+                f"{1000 * percentile(durations, 0.95):.1f}",
+                f"{1000 * max(durations):.1f}",
+            )
+        return table
+
+    def summary_lines(self) -> list[str]:
+        """ Lines which summarize the token usage and the counts. """
+        token_totals = self.token_totals()
+        with self.lock:
+            calls = list(self.calls.items())
+            counts = sorted(self.counts.items())
+        lines = []
+        for model, call_count in calls:
+            line = f"'{model}' was called {call_count} times"
+            if model in token_totals:
+                input_tokens, output_tokens = token_totals[model]
+                line += f" and used {input_tokens} prompt tokens and {output_tokens} completion tokens"
+            lines.append(line + ".")
+        cache_hit_rate = self.cache_hit_rate()
+        if cache_hit_rate:
+            lines.append(f"{cache_hit_rate:.1%} of the prompt tokens were read from the prompt cache.")
+        if counts:
+            lines.append("Counts: " + ", ".join(f"{name}: {value}" for name, value in counts))
+        return lines
+
+    def print_summary(self, console) -> None:
+        console.print(self.summary_table())
+        for line in self.summary_lines():
+            console.print(line)
+
+    def trace_records(self) -> list[dict]:
+        """ The stages, token usage and counts as dictionaries (the lines of the JSONL trace). """
+        with self.lock:
+            records = [
+                dict(type="stage", stage=event.stage, start=event.start, duration=event.duration, thread=event.thread, **event.args)
+                for event in self.stages
+            ]
+            records += [
+                dict(type="tokens", model=event.model, time=event.time, input_tokens=event.input_tokens, output_tokens=event.output_tokens, cached_tokens=event.cached_tokens)
+                for event in self.tokens
+            ]
+            records += [dict(type="calls", model=model, value=value) for model, value in self.calls.items()]
+            records += [dict(type="count", name=name, value=value) for name, value in self.counts.items()]
+        return records
+
+    def chrome_trace(self) -> dict:
+        """ The stages as complete events and the token usage as counters in the Chrome trace-event format (for chrome://tracing or Perfetto). """
+        pid = os.getpid()
+        events = []
+        cumulative = Counter()
+        with self.lock:
+            for event in self.stages:
+                events.append(dict(
+                    name=event.stage, cat="stage", ph="X", pid=pid, tid=event.thread,
+                    ts=event.start * 1e6, dur=event.duration * 1e6, args=event.args,
+                ))
+            for event in sorted(self.tokens, key=lambda event: event.time):
+                cumulative[f"{event.model} prompt"] += event.input_tokens
+                cumulative[f"{event.model} completion"] += event.output_tokens
+                events.append(dict(name="tokens", ph="C", pid=pid, ts=event.time * 1e6, args=dict(cumulative)))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def write_trace(self, path:Path|str, format:str="jsonl") -> None:
+        """ Writes the trace as JSONL (one record per line) or as a Chrome trace-event JSON file. """
+        assert format in TRACE_FORMATS, f"The trace format must be one of {TRACE_FORMATS}, not '{format}'"
+        path = Path(path)
+        with open(path, "w") as f:
+            if format == "chrome":
+                json.dump(self.chrome_trace(), f)
+            else:
+                for record in self.trace_records():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def stage(metrics:RunMetrics|None, name:str, **args):
+    """ Times a stage with the metrics or does nothing if there are no metrics. """
+    return metrics.stage(name, **args) if metrics else nullcontext()
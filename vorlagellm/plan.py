@@ -0,0 +1,224 @@
+import json
+from pathlib import Path
+from typing import Iterator
+from lxml.etree import _ElementTree as ElementTree
+from lxml.etree import _Element as Element
+
+from .prompts import readings_list_to_str, bracketed_reading_list
+from .rag import get_similar_verses_by_phrase
+from .metrics import RunMetrics, stage
+from .tei import (
+    extract_text,
+    find_readings,
+    find_parent,
+    get_verse_text,
+    get_reading_permutations,
+    get_apparatus_verse_text,
+    get_apparatus_verse_texts,
+)
+
+
+def find_similar_verses(
+    verse:str,
+    readings:list[Element],
+    doc_verse_text:str="",
+    doc_corresponding_text:str="",
+    doc_db=None,
+    apparatus_db=None,
+    metrics:RunMetrics|None=None,
+) -> list[str]:
+    """ 
+    Finds the verses in the vector databases which are similar to the text of a variation unit (excluding the verse itself). 
+    
+    The number of searches and similar verses found are counted in the `metrics` if given.
+    """
+    phrases = []
+    if doc_db:
+        phrases.append((doc_db, doc_verse_text or ""))
+        if doc_corresponding_text:
+            phrases.append((doc_db, doc_corresponding_text))
+    if apparatus_db:
+        phrases += [(apparatus_db, extract_text(reading)) for reading in readings]
+
+    similar_verses = set()
+    for db, phrase in phrases:
+        similar_verses.update(get_similar_verses_by_phrase(db, phrase))
+    similar_verses.discard(verse)
+
+    if metrics and phrases:
+        metrics.count("similarity searches", len(phrases))
+        metrics.count("similar verses retrieved", len(similar_verses))
+    return sorted(similar_verses)
+
+
+def similar_verse_context(
+    doc:ElementTree,
+    apparatus:ElementTree,
+    similar_verses:list[str],
+    siglum:str,
+    doc_language:str,
+    apparatus_language:str,
+    ignore:list[str]|None=None,
+) -> str:
+    """ Builds the examples of the translation technique from similar verses (without the text to analyze). """
+    if not similar_verses:
+        return ""
+
+    context = (
+        f"Here are {len(similar_verses)} similar texts to the one that you need to analyze. "
+        f"You will see the {doc_language} language text and then all potential {apparatus_language} source texts. "
+        f"Even though might not clear which {apparatus_language} was the actual source, consider the translation technique going from {apparatus_language} to {doc_language}.\n"
+        "See the way that the translator has translated particular words and gramatical constructions that are similar to the texts you need to analyze. \n\n"
+    )
+    for similar_verse in similar_verses:
+        example_doc_text = get_verse_text(doc, similar_verse)
+        similar_verse_permutations = get_reading_permutations(apparatus, similar_verse, witness=siglum, max_permutations=5, ignore_types=ignore)
+        similar_readings = readings_list_to_str([similar_verse_permutation.text for similar_verse_permutation in similar_verse_permutations])
+        context += (
+            f"{doc_language} example {similar_verse}:\n{example_doc_text}\n"
+            f"Possible {apparatus_language} source(s):\n{similar_readings}\n\n"
+        )
+    return context
+
+
+def similar_verse_examples_text(
+    context:str,
+    doc_verse_text:str,
+    doc_corresponding_text:str,
+    apparatus_verse_text:str,
+    readings_string:str,
+    doc_language:str,
+    apparatus_language:str,
+) -> str:
+    """ Adds the text to analyze to the examples from `similar_verse_context` (or returns an empty string if there are no examples). """
+    if not context:
+        return ""
+
+    return context + (
+        f"Here is the {doc_language} text to analyze:\n{doc_corresponding_text}\n[Full text in context: {doc_verse_text}]\n\n"
+        f"Here is the source {apparatus_language} text to analyze with the textual variant in brackets like this: ⸂ ⸃:\n{apparatus_verse_text}\n\n"
+        f"Here are the potential {apparatus_language} readings that go between the brackets that could be the source of '{doc_corresponding_text}':\n{readings_string}"
+    )
+
+
+def get_similar_verse_examples(
+    doc:ElementTree,
+    apparatus:ElementTree,
+    verse:str,
+    siglum:str,
+    readings:list[Element],
+    doc_verse_text:str,
+    doc_corresponding_text:str,
+    apparatus_verse_text:str,
+    readings_string:str,
+    doc_language:str,
+    apparatus_language:str,
+    doc_db=None,
+    apparatus_db=None,
+    ignore:list[str]|None=None,
+    metrics:RunMetrics|None=None,
+    app_index:int|None=None,
+) -> str:
+    """ 
+    Finds verses similar to the variation unit and builds the examples of the translation technique for the source prompt. 
+    
+    The retrieval and the building of the examples are timed as stages in the `metrics` if given (for the <app> at `app_index`).
+    """
+    with stage(metrics, "retrieval", app=app_index, verse=verse):
+        similar_verses = find_similar_verses(
+            verse,
+            readings,
+            doc_verse_text=doc_verse_text,
+            doc_corresponding_text=doc_corresponding_text,
+            doc_db=doc_db,
+            apparatus_db=apparatus_db,
+            metrics=metrics,
+        )
+    with stage(metrics, "examples", app=app_index, verse=verse):
+        context = similar_verse_context(doc, apparatus, similar_verses, siglum, doc_language, apparatus_language, ignore=ignore)
+    return similar_verse_examples_text(
+        context,
+        doc_verse_text=doc_verse_text,
+        doc_corresponding_text=doc_corresponding_text,
+        apparatus_verse_text=apparatus_verse_text,
+        readings_string=readings_string,
+        doc_language=doc_language,
+        apparatus_language=apparatus_language,
+    )
+
+
+def iter_plan_rows(
+    doc:ElementTree,
+    apparatus:ElementTree,
+    apps:list[Element],
+    siglum:str,
+    doc_language:str,
+    apparatus_language:str,
+    include:list[str]|None=None,
+    ignore:list[str]|None=None,
+    doc_db=None,
+    apparatus_db=None,
+) -> Iterator[dict]:
+    """
+    Computes the inputs of the prompts for each <app> which do not depend on the output of an LLM.
+
+    The similar verses are found from the text of the verse and the readings.
+    The search for the corresponding text in the document needs the output of the LLM so it is not included.
+    """
+    verse_texts = dict()
+    apparatus_verse_texts = dict()
+    for index, app in enumerate(apps):
+        verse_element = find_parent(app, "ab")
+        verse = verse_element.attrib.get("n") if verse_element is not None else None
+        if verse is None or (include and verse not in include):
+            continue
+
+        if verse not in verse_texts:
+            verse_texts[verse] = get_verse_text(doc, verse)
+            apparatus_verse_texts = get_apparatus_verse_texts(verse_element)
+        doc_verse_text = verse_texts[verse]
+
+        readings = find_readings(app, ignore_types=ignore)
+        reading_texts = [extract_text(reading) for reading in readings]
+        permutations = get_reading_permutations(apparatus, verse, witness=siglum, bracket_app=app, max_permutations=10, ignore_types=ignore)
+        similar_verses = find_similar_verses(verse, readings, doc_verse_text=doc_verse_text, doc_db=doc_db, apparatus_db=apparatus_db)
+
+        yield dict(
+            index=index,
+            verse=verse,
+            doc_verse_text=doc_verse_text,
+            apparatus_verse_text=apparatus_verse_texts.get(app) or get_apparatus_verse_text(app),
+            reading_texts=reading_texts,
+            readings=readings_list_to_str(reading_texts),
+            reading_list=bracketed_reading_list(reading_texts),
+            permutations="\n".join([permutation.text for permutation in permutations]),
+            similar_verse_context=similar_verse_context(doc, apparatus, similar_verses, siglum, doc_language, apparatus_language, ignore=ignore),
+        )
+
+
+def write_plan(metadata:dict, rows:Iterator[dict], path:Path) -> int:
+    """
+    Writes a work plan to a JSONL file.
+
+    The first line has the metadata for the plan and each following line has the prompt inputs for an <app>.
+
+    Returns:
+        int: The number of rows written.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(path, "w") as f:
+        f.write(json.dumps(dict(metadata=metadata), ensure_ascii=False) + "\n")
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_plan(path:Path) -> tuple[dict, list[dict]]:
+    """ Reads the metadata and the rows of a work plan written with `write_plan`. """
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    assert lines and "metadata" in lines[0], f"'{path}' is not a VorlageLLM work plan"
+    return lines[0]['metadata'], lines[1:]
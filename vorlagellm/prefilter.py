@@ -0,0 +1,37 @@
+import re
+import unicodedata
+import Levenshtein
+
+
+def normalize_reading_text(text:str) -> str:
+    """ 
+    Normalizes the text of a reading so that orthographic variants can be compared.
+
+    The text is case-folded, diacritics and punctuation are removed and whitespace is collapsed.
+    """
+    text = unicodedata.normalize("NFD", (text or "").casefold())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    text = re.sub(r"[^\w\s]", "", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def readings_indistinguishable(reading_texts:list[str], min_similarity:float=1.0) -> bool:
+    """
+    Returns True if all the readings are the same after normalization or, if `min_similarity` is less than 1, are nearly the same.
+
+    Readings are nearly the same if the normalized Levenshtein similarity (`Levenshtein.ratio`) of every pair 
+    is at least `min_similarity`. An omission is never indistinguishable from a reading with text.
+    By default, only exact matches after normalization are indistinguishable.
+    """
+    normalized = [normalize_reading_text(text) for text in reading_texts]
+    if len(set(normalized)) <= 1:
+        return True
+
+    if min_similarity >= 1.0 or not all(normalized):
+        return False
+
+    for index1, text1 in enumerate(normalized):
+        for text2 in normalized[index1+1:]:
+            if Levenshtein.ratio(text1, text2) < min_similarity:
+                return False
+    return True
@@ -0,0 +1,199 @@
+import cProfile
+import linecache
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Callable
+
+
+PACKAGE_DIRECTORY = str(Path(__file__).parent)
+
+
+def profile_format(path:Path|str) -> str:
+    """ The format of a profile from the suffix of its path: 'speedscope' for '.json' or 'pstats' otherwise. """
+    return "speedscope" if Path(path).suffix.lower() == ".json" else "pstats"
+
+
+def start_profiler(path:Path|str, interval:float=0.001) -> Callable[[], None]:
+    """
+    Starts profiling and returns a function which stops the profiler and writes the profile to `path`.
+
+    Paths ending in '.json' are written in the speedscope format (https://www.speedscope.app) using the pyinstrument sampling profiler
+    which samples the stack every `interval` seconds. This needs the optional `pyinstrument` package.
+    Other paths are written as pstats files from the deterministic cProfile profiler (e.g. for `python -m pstats` or snakeviz).
+    """
+    path = Path(path)
+    if profile_format(path) == "speedscope":
+        try:
+            from pyinstrument import Profiler
+            from pyinstrument.renderers import SpeedscopeRenderer
+        except ImportError:
+            raise ImportError("Writing speedscope profiles needs the 'pyinstrument' package. Install it with 'pip install pyinstrument'.")
+
+        profiler = Profiler(interval=interval)
+        profiler.start()
+
+        def stop():
+            profiler.stop()
+            path.write_text(profiler.output(renderer=SpeedscopeRenderer()))
+
+        return stop
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def stop():
+        profiler.disable()
+        profiler.dump_stats(str(path))
+
+    return stop
+
+
+def package_allocations(snapshot:tracemalloc.Snapshot) -> Counter:
+    """
+    Totals the sizes of the memory allocations in a snapshot by the innermost line of VorlageLLM in their tracebacks.
+
+    This attributes allocations made within other libraries (e.g. LangChain) to the line of VorlageLLM which called them.
+    """
+    allocations = Counter()
+    for statistic in snapshot.statistics("traceback"):
+        frame = next((frame for frame in reversed(statistic.traceback) if frame.filename.startswith(PACKAGE_DIRECTORY)), None)
+        if frame:
+            allocations[(frame.filename, frame.lineno)] += statistic.size
+    return allocations
+
+
+def format_size(size:int) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class PeakSampler:
+    """
+    Takes a snapshot of the traced memory whenever it has grown past the largest size seen so far (by at least `growth`),
+    checking every `interval` seconds in a background thread, so that the allocations near the peak can be reported
+    and not only those still held at the end.
+    """
+    def __init__(self, interval:float=0.05, growth:float=0.05):
+        self.interval = interval
+        self.growth = growth
+        self.size = 0
+        self.elapsed = 0.0
+        self.snapshot = None
+        self.start_time = time.perf_counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.size * (1 + self.growth):
+            self.snapshot = tracemalloc.take_snapshot()
+            self.size = current
+            self.elapsed = time.perf_counter() - self.start_time
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self.start_time = time.perf_counter()
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ Stops the background thread and takes a final sample. """
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+
+def allocation_lines(snapshot:tracemalloc.Snapshot, start:tracemalloc.Snapshot, top:int) -> list[str]:
+    """ The lines which allocated the most memory held in `snapshot` since `start` and the totals for each line of VorlageLLM. """
+    lines = []
+    for statistic in snapshot.compare_to(start, "lineno")[:top]:
+        frame = statistic.traceback[0]
+        lines.append(f"{format_size(statistic.size_diff):>12} {statistic.count_diff:>+9} blocks  {frame.filename}:{frame.lineno}")
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        if source:
+            lines.append(f"{'':>32}{source}")
+
+    lines += ["", f"Top {top} lines of VorlageLLM by this memory which they allocated (directly or in other libraries):"]
+    for (filename, lineno), size in package_allocations(snapshot).most_common(top):
+        lines.append(f"{format_size(size):>12}  {Path(filename).relative_to(PACKAGE_DIRECTORY)}:{lineno}  {linecache.getline(filename, lineno).strip()}")
+    return lines
+
+
+def memory_report(
+    start:tracemalloc.Snapshot, 
+    end:tracemalloc.Snapshot, 
+    peak:int, 
+    top:int=25, 
+    peak_snapshot:tracemalloc.Snapshot|None=None, 
+    peak_size:int=0, 
+    peak_elapsed:float=0.0,
+) -> str:
+    """ 
+    A report of the peak memory and the lines which allocated the most memory, both at the largest sampled point (`peak_snapshot`) 
+    and still held at the end, with the totals for each line of VorlageLLM. 
+    
+    Allocations made while importing modules are not included.
+    """
+    # Leave out the allocations from importing modules (which are imported lazily by the commands), from tracemalloc itself and from the profiler
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__, all_frames=True),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>", all_frames=True),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>", all_frames=True),
+        tracemalloc.Filter(False, "<unknown>"),
+    ]
+    start = start.filter_traces(filters)
+
+    lines = [f"Peak traced memory: {format_size(peak)}"]
+    if peak_snapshot is not None:
+        lines += [
+            "", 
+            f"Top {top} lines by memory allocated during the command and held at the largest sampled point "
+            f"({format_size(peak_size)} traced after {peak_elapsed:.2f} s):",
+        ]
+        lines += allocation_lines(peak_snapshot.filter_traces(filters), start, top)
+
+    lines += ["", f"Top {top} lines by memory allocated during the command and still held at the end:"]
+    lines += allocation_lines(end.filter_traces(filters), start, top)
+
+    return "\n".join(lines) + "\n"
+
+
+def start_memory_profiler(path:Path|str, frames:int=25, top:int=25, interval:float=0.05) -> Callable[[], None]:
+    """
+    Starts tracing memory allocations with tracemalloc and returns a function which writes a report to `path` (see `memory_report`).
+
+    The traced memory is checked every `interval` seconds and a snapshot is taken each time it reaches a new high
+    so that the peak can be attributed to the lines which allocated it.
+    Only allocations by Python are traced so memory allocated by C libraries (e.g. the trees of lxml) is not included.
+    """
+    path = Path(path)
+    tracemalloc.start(frames)
+    start = tracemalloc.take_snapshot()
+    sampler = PeakSampler(interval=interval)
+    sampler.start()
+
+    def stop():
+        sampler.stop()
+        end = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        path.write_text(memory_report(
+            start, 
+            end, 
+            peak, 
+            top=top, 
+            peak_snapshot=sampler.snapshot, 
+            peak_size=sampler.size, 
+            peak_elapsed=sampler.elapsed,
+        ))
+
+    return stop
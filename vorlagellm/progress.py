@@ -0,0 +1,153 @@
+import threading
+import time
+from typing import Callable, Hashable
+
+from rich.console import Console
+from rich.progress import Progress, ProgressColumn, BarColumn, MofNCompleteColumn, TextColumn
+from rich.text import Text
+
+from .metrics import RunMetrics
+
+
+def format_duration(seconds:float|None) -> str:
+    """ Formats a number of seconds as 'H:MM:SS' (or '-:--:--' if it is unknown). """
+    if seconds is None:
+        return "-:--:--"
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def format_count(value:float) -> str:
+    """ Formats a number compactly with a 'k' or 'M' suffix for thousands or millions. """
+    if value >= 1e6:
+        return f"{value / 1e6:.1f}M"
+    if value >= 1e3:
+        return f"{value / 1e3:.1f}k"
+    return f"{value:.0f}"
+
+
+class RunProgress:
+    """
+    Tracks how many of the pending units (<app> elements) of a run have been completed.
+
+    Each unit is identified by a key so that units can complete in any order (e.g. from several workers)
+    and a unit which is reported twice is only counted once.
+    Units which are skipped (e.g. resolved by the pre-filter without calling the LLM) count towards the progress
+    but not towards the rate or the estimated time remaining, since they take no time.
+    The token rate and the cache hit rate come from the token usage recorded in the `metrics`.
+    """
+    def __init__(
+        self,
+        total:int,
+        metrics:RunMetrics|None=None,
+        console:Console|None=None,
+        description:str="<app> elements",
+        disable:bool=False,
+        clock:Callable[[], float]=time.perf_counter,
+    ):
+        self.total = total
+        self.metrics = metrics
+        self.clock = clock
+        self.start = clock()
+        self.completed = set()
+        self.skipped = set()
+        self.lock = threading.Lock()
+        self.progress = Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(bar_width=12),
+            MofNCompleteColumn(),
+            RunProgressColumn(self),
+            console=console,
+            disable=disable,
+        )
+        self.task = self.progress.add_task(description, total=total)
+
+    def __enter__(self):
+        self.start = self.clock()
+        self.progress.start()
+        return self
+
+    def __exit__(self, *args):
+        self.progress.stop()
+
+    def set_total(self, total:int) -> None:
+        """ Changes the number of units (e.g. when they are only known after the progress has started). """
+        self.total = total
+        self.progress.update(self.task, total=total)
+
+    def complete(self, key:Hashable) -> None:
+        """ Marks the unit with this key as completed. """
+        with self.lock:
+            self.completed.add(key)
+            completed_count = len(self.completed)
+        self.progress.update(self.task, completed=completed_count)
+
+    def skip(self, key:Hashable) -> None:
+        """ Marks the unit with this key as completed without it being processed. """
+        with self.lock:
+            if key not in self.completed:
+                self.skipped.add(key)
+                self.completed.add(key)
+            completed_count = len(self.completed)
+        self.progress.update(self.task, completed=completed_count)
+
+    @property
+    def completed_count(self) -> int:
+        with self.lock:
+            return len(self.completed)
+
+    @property
+    def processed_count(self) -> int:
+        """ The number of completed units which were not skipped. """
+        with self.lock:
+            return len(self.completed) - len(self.skipped)
+
+    @property
+    def elapsed(self) -> float:
+        return self.clock() - self.start
+
+    def units_per_minute(self) -> float:
+        elapsed = self.elapsed
+        return 60.0 * self.processed_count / elapsed if elapsed > 0 else 0.0
+
+    def tokens_per_minute(self) -> float:
+        elapsed = self.elapsed
+        if not self.metrics or elapsed <= 0:
+            return 0.0
+        tokens = sum(input_tokens + output_tokens for input_tokens, output_tokens in self.metrics.token_totals().values())
+        return 60.0 * tokens / elapsed
+
+    def cache_hit_rate(self) -> float|None:
+        """ The proportion of the prompt tokens read from the provider's prompt cache (or None if no prompt tokens were recorded). """
+        return self.metrics.cache_hit_rate() if self.metrics else None
+
+    def eta(self) -> float|None:
+        """ The estimated number of seconds until all the units are completed at the average rate of the processed units so far. """
+        with self.lock:
+            completed_count = len(self.completed)
+            processed_count = completed_count - len(self.skipped)
+        if completed_count >= self.total:
+            return 0.0
+        if not processed_count:
+            return None
+        return self.elapsed * (self.total - completed_count) / processed_count
+
+    def status(self) -> str:
+        """ A summary of the rates and the estimated time remaining. """
+        cache_hit_rate = self.cache_hit_rate()
+        return (
+            f"ETA {format_duration(self.eta())} • "
+            f"{self.units_per_minute():.1f} apps/min • "
+            f"{format_count(self.tokens_per_minute())} tokens/min • "
+            f"cache {'-' if cache_hit_rate is None else f'{cache_hit_rate:.0%}'}"
+        )
+
+
+class RunProgressColumn(ProgressColumn):
+    """ A column with the status of a `RunProgress` which is rendered each time the progress display refreshes. """
+    def __init__(self, run_progress:RunProgress):
+        super().__init__()
+        self.run_progress = run_progress
+
+    def render(self, task) -> Text:
+        return Text(self.run_progress.status(), style="progress.data.speed")
@@ -10,6 +10,10 @@ def readings_list_to_str(readings:list[str])->str:
     return result
 
 
+def bracketed_reading_list(readings:list[str])->str:
+    return ", ".join([("⸂" + reading + "⸃") if reading else "⸂OMISSION⸃" for reading in readings])
+
+
 
 def build_prompt(initiate_response:bool=False, **kwargs):    
     messages = [
@@ -56,9 +60,38 @@ def build_prompt(initiate_response:bool=False, **kwargs):
     return ChatPromptTemplate.from_messages(messages=messages).partial(**kwargs)
 
 
-def build_source_prompt(initiate_response:bool=False, **kwargs):    
+SOURCE_JSON_FORMAT = (
+    "Respond only with a JSON object with the key 'readings' for the list of the numbers of the readings (use an empty list for NONE) "
+    "and the key 'justification' for the justification. For example: {{\"readings\": [1, 3], \"justification\": \"...\"}}"
+)
+
+CORRESPONDING_TEXT_JSON_FORMAT = (
+    "Respond only with a JSON object with the key 'text' for the {doc_language} text on a single line. "
+    "For example: {{\"text\": \"...\"}}. Do not give any other information in your response.\n\n"
+)
+
+
+def build_source_prompt(initiate_response:bool=False, structured:bool=False, **kwargs):    
+    """ 
+    Builds the prompt to choose the readings which could have been the source of the translation. 
+    
+    If `structured` is True, then the response is requested as JSON (see `SOURCE_JSON_FORMAT`) and `initiate_response` is ignored.
+    """
     if 'notes' not in kwargs:
         kwargs['notes'] = ""
+
+    if structured:
+        reading_format = (
+            "Give the numbers of the {apparatus_language} readings in a list. "
+            "If none could have been the source of the {doc_language} text, then give an empty list.\n\n"
+        )
+        justification_format = "Also give a justification for why those readings are possible sources for the tranlation into {doc_language} considering the translation technique.\n\n"
+    else:
+        reading_format = (
+            "Just give the number of each {apparatus_language} reading, separated by a comma. "
+            "If none could have been the source of the {doc_language} text, then you should answer 'NONE'\n\n"
+        )
+        justification_format = "After you give the numbers for the readings, print 5 hyphens '-----' and then give a justification for why those readings are possible sources for the tranlation into {doc_language} considering the translation technique.\n\n"
         
     messages = [
         ("system", SYSTEM_MESSAGE),
@@ -66,10 +99,9 @@ def build_source_prompt(initiate_response:bool=False, **kwargs):
             "You are to read the following text in {doc_language} "
             "and then choose which readings in {apparatus_language} which plausibly could have been the source of the translation into {doc_language}. "
             "You may choose more than one {apparatus_language} reading if more than one may have been the source. "
-            "Just give the number of each {apparatus_language} reading, separated by a comma. "
-            "If none could have been the source of the {doc_language} text, then you should answer 'NONE'\n\n"
+            + reading_format +
             "You will also be penalized if you do not select the reading that was the source. Try not to select more readings than necessary. If you are uncertain, then err on the side of selecting more possible readings so you do not exclude the actual source.\n"
-            "After you give the numbers for the readings, print 5 hyphens '-----' and then give a justification for why those readings are possible sources for the tranlation into {doc_language} considering the translation technique.\n\n"
+            + justification_format +
             "Use the examples of translation technique to inform your decision. For example, if you see examples of the {doc_language} text translating strictly word-for-word, then you can infer that the source {apparatus_language} should be very close and omitted words or phrases in the translation were probably missing in the source. "
             "If in the translation technique you see examples of {doc_language} text translating the concepts of the source {apparatus_language} in the examples, then any {apparatus_language} text could be the source of the {doc_language} so long as the same concepts are conveyed. "
             "If the translation technique looks like it preserves word order in certain circumstances and you see the same circumstances in the current text, then you prefer a source {apparatus_language} reading that matches the word order. "
@@ -85,16 +117,30 @@ def build_source_prompt(initiate_response:bool=False, **kwargs):
             "{similar_verse_examples}"
 
             "Now list the numbers of the {apparatus_language} readings which could plausibly have been the source of the {doc_language} text given the translation technique."
+            + (" " + SOURCE_JSON_FORMAT if structured else "")
         ),
     ]
-    if initiate_response:
+    if initiate_response and not structured:
         messages.append(
             ("ai", "The {apparatus_language} readings which plausibly could be translated into the {doc_language} '{doc_corresponding_text}' are:")
         )
     return ChatPromptTemplate.from_messages(messages=messages).partial(**kwargs)
 
 
-def build_corresponding_text_prompt(initiate_response:bool=False, **kwargs):    
+def build_corresponding_text_prompt(initiate_response:bool=False, structured:bool=False, **kwargs):    
+    """ 
+    Builds the prompt to find the text in the document which corresponds to the variation unit. 
+    
+    If `structured` is True, then the response is requested as JSON (see `CORRESPONDING_TEXT_JSON_FORMAT`) and `initiate_response` is ignored.
+    """
+    if structured:
+        response_format = CORRESPONDING_TEXT_JSON_FORMAT
+    else:
+        response_format = (
+            "Print the {doc_language} text on a single line without line breaks. When finished the {doc_language} text, print a new line and then 5 hyphens '-----' and stop. "
+            "Do not give any other information in your response.\n\n"
+        )
+
     messages = [
         ("system", SYSTEM_MESSAGE),
         ("user", 
@@ -105,8 +151,7 @@ def build_corresponding_text_prompt(initiate_response:bool=False, **kwargs):
             "You are to print the {doc_language} text which best corresponds to the {apparatus_language} text in brackets ⸂ ⸃ with whatever reading was likely to be the original source. "
             "Only print the {doc_language} text which correspond to the {apparatus_language} text in brackets ⸂ ⸃. "
             "If the {doc_language} text agrees an omission in {apparatus_language}, then just then print 'OMISSION'. "
-            "Print the {doc_language} text on a single line without line breaks. When finished the {doc_language} text, print a new line and then 5 hyphens '-----' and stop. "
-            "Do not give any other information in your response.\n\n"
+            + response_format +
 
             "For example, if the source Greek readings were ⸂πᾶσι⸃ and ⸂δαῖτα⸃ in the following contexts:\n"
             "ἡρώων, αὐτοὺς δὲ ἑλώρια τεῦχε κύνεσσιν οἰωνοῖσί τε ⸂πᾶσι⸃, Διὸς δ᾽ ἐτελείετο βουλή,\n"
@@ -128,7 +173,7 @@ def build_corresponding_text_prompt(initiate_response:bool=False, **kwargs):
             "Here are the potential readings in context. The location of the variation unit is indicated with brackets: ⸂ ⸃:\n{permutations}\n\n"
         ),
     ]
-    if initiate_response:
+    if initiate_response and not structured:
         messages.append(
             ("ai", "The {doc_language} word(s) from '{doc_verse_text}' which best correspond to the text in the brackets (i.e. {reading_list}) are:")
         )
@@ -0,0 +1,107 @@
+import re
+from functools import lru_cache
+from typing import Iterator
+from lxml import etree as ET
+from lxml.etree import _ElementTree as ElementTree
+from lxml.etree import _Element as Element
+
+
+PREFIX = "tei"
+NAME_TEST_REGEX = re.compile(r"(?<=/)(?=[A-Za-z_])")
+PATH_REGEX = re.compile(
+    r"^\.//(?P<name>[A-Za-z_][\w.-]*)"
+    r"(?:\[@(?P<attribute>[A-Za-z_][\w.:-]*)=(?:\$(?P<variable>\w+)|'(?P<literal>[^']*)')\])?$"
+)
+ATTRIBUTE_NAMESPACES = dict(xml="http://www.w3.org/XML/1998/namespace")
+
+
+class Query:
+    """
+    A path compiled once for documents with a particular default namespace (or no namespace).
+
+    Paths to descendants with an optional attribute test (e.g. './/rdg', './/ab[@n=$verse]' or ".//title[@type='document']")
+    are matched by iterating over the elements with that tag in lxml and comparing the attribute with the value of the variable.
+    This is faster than XPath in libxml2 for these paths and the values never need to be quoted.
+    Any other path is compiled to an `etree.XPath` with the element names in the namespace.
+    """
+    def __init__(self, path:str, namespace:str|None=None):
+        self.path = path
+        self.namespace = namespace
+        self.xpath = None
+        self.attribute = None
+        self.variable = None
+        self.value = None
+
+        match = PATH_REGEX.match(path)
+        if match is None or not self.set_attribute(match['attribute']):
+            namespaces = {PREFIX: namespace} if namespace else None
+            self.xpath = ET.XPath(NAME_TEST_REGEX.sub(f"{PREFIX}:", path) if namespace else path, namespaces=namespaces)
+            return
+
+        self.tag = f"{{{namespace}}}{match['name']}" if namespace else match['name']
+        self.variable = match['variable']
+        self.value = match['literal']
+
+    def set_attribute(self, attribute:str|None) -> bool:
+        """ Sets the attribute to test with the namespace resolved. Returns False if the prefix of the attribute is not known. """
+        if attribute and ":" in attribute:
+            prefix, name = attribute.split(":", 1)
+            if prefix not in ATTRIBUTE_NAMESPACES:
+                return False
+            attribute = f"{{{ATTRIBUTE_NAMESPACES[prefix]}}}{name}"
+        self.attribute = attribute
+        return True
+
+    def iter(self, element:Element, **variables) -> Iterator[Element]:
+        if self.xpath is not None:
+            yield from self.xpath(element, **variables)
+            return
+
+        value = variables[self.variable] if self.variable else self.value
+        for match in element.iter(self.tag):
+            if match is element:
+                continue
+            if self.attribute is None or match.get(self.attribute) == value:
+                yield match
+
+    def all(self, element:Element, **variables) -> list[Element]:
+        return list(self.iter(element, **variables))
+
+    def first(self, element:Element, **variables) -> Element|None:
+        return next(self.iter(element, **variables), None)
+
+
+@lru_cache(maxsize=None)
+def compile_query(path:str, namespace:str|None=None) -> Query:
+    """ Compiles a path for documents with a default namespace (or no namespace). Each query is only compiled once for each namespace. """
+    return Query(path, namespace)
+
+
+def query_root(doc:ElementTree|Element) -> Element:
+    return doc.getroot() if isinstance(doc, ElementTree) else doc
+
+
+def document_namespace(element:Element) -> str|None:
+    """ Returns the default namespace in scope for an element (or None). """
+    return element.nsmap.get(None)
+
+
+def query(doc:ElementTree|Element, path:str, **variables) -> list[Element]:
+    """ Finds all the elements which match a path in the default namespace of the document. """
+    element = query_root(doc)
+    return compile_query(path, document_namespace(element)).all(element, **variables)
+
+
+def query_first(doc:ElementTree|Element, path:str, **variables) -> Element|None:
+    """
+    Finds the first element which matches a path in the default namespace of the document.
+
+    If there is no match in the namespace, then elements without a namespace are searched
+    (e.g. elements which were added to the tree without a namespace).
+    """
+    element = query_root(doc)
+    namespace = document_namespace(element)
+    result = compile_query(path, namespace).first(element, **variables)
+    if result is None and namespace:
+        result = compile_query(path, None).first(element, **variables)
+    return result
@@ -7,6 +7,7 @@ from vorlagellm.tei import (
     get_reading_permutations,
     get_verse_text,
 )
+from vorlagellm.snapshot import TeiSnapshot
 from rich.progress import track, Progress
 
 
@@ -65,9 +66,11 @@ def build_apparatus_embeddingdocs(apparatus, ignore_types:list[str]|None=None) -
 
 
 def build_teidoc_embeddingdocs(teidoc) -> list[EmbeddingDocument]:
+    """ Builds a document to embed for the text of each verse of a TEI document (or a `TeiSnapshot` of it). """
     documents = []
-    for verse in get_verses(teidoc):
-        text = get_verse_text(teidoc, verse)
+    is_snapshot = isinstance(teidoc, TeiSnapshot)
+    for verse in (teidoc.verses if is_snapshot else get_verses(teidoc)):
+        text = teidoc.verse_text(verse) if is_snapshot else get_verse_text(teidoc, verse)
         metadata = dict(
             verse=verse,
         )
@@ -0,0 +1,181 @@
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.base import coerce_to_runnable
+
+
+RETRYABLE_STATUS_CODES = {408, 429}
+RETRYABLE_ERROR_NAMES = ("RateLimit", "Timeout", "APIConnection", "ServiceUnavailable", "InternalServer", "Overloaded")
+
+
+def estimate_tokens(text:str) -> int:
+    """ Estimates the number of tokens in a text (roughly four characters per token). """
+    return max(1, math.ceil(len(text) / 4))
+
+
+def prompt_text(prompt:Any) -> str:
+    """ Renders the input to an LLM as a string so that its tokens can be estimated. """
+    if isinstance(prompt, PromptValue):
+        return prompt.to_string()
+    if isinstance(prompt, list):
+        return "\n".join(str(getattr(message, "content", message)) for message in prompt)
+    return str(prompt)
+
+
+def error_status_code(error:Exception) -> int|None:
+    """ Finds the HTTP status code of an error from an LLM provider (if there is one). """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(error:Exception) -> bool:
+    """ Returns True if the error is from a rate limit or a transient problem with the provider so that the request can be retried. """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    status_code = error_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+    error_name = type(error).__name__
+    return any(name in error_name for name in RETRYABLE_ERROR_NAMES)
+
+
+def retry_after(error:Exception) -> float|None:
+    """ Reads the number of seconds to wait from the 'retry-after' header of an error response (if there is one). """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt:int, initial_backoff:float=1.0, max_backoff:float=60.0) -> float:
+    """ The delay before retrying a request, using exponential backoff with full jitter. """
+    return random.uniform(0, min(max_backoff, initial_backoff * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Limits the rate of something (e.g. requests or tokens) to an amount per minute.
+
+    Callers reserve an amount from the bucket and are told how long to wait until that amount is available.
+    The bucket can hold up to a minute's worth so that short bursts are allowed.
+    """
+    def __init__(self, per_minute:float, clock:Callable[[], float]=time.monotonic):
+        assert per_minute > 0, f"The rate must be positive, not {per_minute}"
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.clock = clock
+        self.available = per_minute
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount:float) -> float:
+        """ Reserves an amount from the bucket and returns the number of seconds to wait before using it. """
+        amount = min(amount, self.capacity)
+        with self.lock:
+            now = self.clock()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            self.available -= amount
+            return max(0.0, -self.available / self.rate)
+
+
+@dataclass
+class SchedulerStats:
+    requests:int = 0
+    retries:int = 0
+    tokens:int = 0
+    throttled_seconds:float = 0.0
+
+
+class RequestScheduler:
+    """
+    Schedules requests to an LLM provider within requests-per-minute and tokens-per-minute budgets
+    and retries requests which fail from rate limits or transient errors.
+
+    A budget of zero means that it is unlimited.
+    """
+    def __init__(
+        self,
+        requests_per_minute:float=0,
+        tokens_per_minute:float=0,
+        max_retries:int=6,
+        initial_backoff:float=1.0,
+        max_backoff:float=60.0,
+        clock:Callable[[], float]=time.monotonic,
+        sleep:Callable[[float], None]=time.sleep,
+    ):
+        self.requests_bucket = TokenBucket(requests_per_minute, clock=clock) if requests_per_minute else None
+        self.tokens_bucket = TokenBucket(tokens_per_minute, clock=clock) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.stats = SchedulerStats()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens:int=1) -> float:
+        """ Waits until there is room in the budgets for a request with this many tokens. Returns the number of seconds waited. """
+        delay = 0.0
+        if self.requests_bucket:
+            delay = max(delay, self.requests_bucket.reserve(1))
+        if self.tokens_bucket:
+            delay = max(delay, self.tokens_bucket.reserve(tokens))
+        with self.lock:
+            self.stats.requests += 1
+            self.stats.tokens += tokens
+            self.stats.throttled_seconds += delay
+        if delay:
+            self.sleep(delay)
+        return delay
+
+    def call(self, function:Callable[[], Any], tokens:int=1) -> Any:
+        """ Calls a function which makes a request once the budgets allow it, retrying with backoff if it fails with a retryable error. """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            try:
+                return function()
+            except Exception as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    raise
+                delay = retry_after(error)
+                if delay is None:
+                    delay = backoff_delay(attempt, initial_backoff=self.initial_backoff, max_backoff=self.max_backoff)
+                with self.lock:
+                    self.stats.retries += 1
+                    self.stats.throttled_seconds += delay
+                self.sleep(delay)
+
+
+class ScheduledLLM(Runnable):
+    """ 
+    Wraps an LLM so that every request (including each one in a batch) goes through a `RequestScheduler`. 
+    
+    If `metrics` are given (see `metrics.RunMetrics`), then the token usage of each response is recorded under the name `model`.
+    """
+    def __init__(self, llm, scheduler:RequestScheduler, metrics=None, model:str=""):
+        self.llm = llm
+        self.runnable = coerce_to_runnable(llm)
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.model = model
+
+    def invoke(self, input, config=None, **kwargs):
+        tokens = estimate_tokens(prompt_text(input))
+        response = self.scheduler.call(lambda: self.runnable.invoke(input, config, **kwargs), tokens=tokens)
+        if self.metrics:
+            self.metrics.record_usage(self.model, response)
+        return response
+
+    def bind(self, **kwargs):
+        return ScheduledLLM(self.llm.bind(**kwargs), self.scheduler, metrics=self.metrics, model=self.model)
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import pickle
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+import numpy as np
+from lxml.etree import _ElementTree as ElementTree
+
+from .tei import (
+    read_tei,
+    find_elements,
+    extract_text,
+    reading_witnesses,
+    witness_sets_matrix,
+    element_local_name,
+)
+from .evaluation import reading_verses
+
+
+SNAPSHOT_VERSION = 1
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+
+@dataclass
+class TeiSnapshot:
+    """
+    A compact representation of a TEI file with the information needed by the analytic commands (e.g. `evaluate` and `agreements`).
+
+    The readings are the <rdg> elements in document order (i.e. in the same order as `find_elements(doc, ".//rdg")`)
+    so that they can be matched with the elements if the file is parsed later.
+    The indexes of the readings of each <app> are stored in flat arrays (rather than a list for each <app>) so that they load quickly.
+
+    Only read-only commands use snapshots. `run` and `ensemble` modify and write the parsed tree, 
+    and the apparatus database needs the permutations of the readings in each verse, so these still parse the file with `read_tei`.
+    """
+    verses:list[str] = field(default_factory=list)
+    verse_texts:dict[str,str] = field(default_factory=dict)
+    witness_list:list[str] = field(default_factory=list)
+    reading_texts:list[str] = field(default_factory=list)
+    reading_witnesses:list[frozenset[str]] = field(default_factory=list)
+    reading_verses:list[str] = field(default_factory=list)
+    app_reading_indexes:array = field(default_factory=lambda: array("l"))
+    app_offsets:array = field(default_factory=lambda: array("l", [0]))
+    ids:dict[str,str] = field(default_factory=dict)
+
+    def verse_text(self, verse:str) -> str|None:
+        """ Returns the text of a verse like `get_verse_text` (or None if the verse is not found). """
+        return self.verse_texts.get(verse)
+
+    def app_readings(self) -> list[list[int]]:
+        """ Returns the indexes of the <rdg> elements of each <app>. """
+        indexes = self.app_reading_indexes.tolist()
+        offsets = self.app_offsets.tolist()
+        return [indexes[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def app_reading_texts(self) -> list[list[str]]:
+        """ Returns the texts of the <rdg> elements of each <app>. """
+        return [[self.reading_texts[index] for index in readings] for readings in self.app_readings()]
+
+    def app_witness_sets(self) -> list[list[frozenset[str]]]:
+        """ Returns the sets of witnesses of the <rdg> elements of each <app>. """
+        return [[self.reading_witnesses[index] for index in readings] for readings in self.app_readings()]
+
+    def witness_matrix(self, sigla:list[str]) -> np.ndarray:
+        """ Builds a boolean matrix of the witnesses of each reading like `tei.witness_matrix`. """
+        return witness_sets_matrix(self.reading_witnesses, sigla)
+
+
+def build_snapshot(doc:ElementTree) -> TeiSnapshot:
+    """ Extracts a `TeiSnapshot` from a parsed TEI document. """
+    snapshot = TeiSnapshot()
+    for verse_element in find_elements(doc, ".//ab"):
+        verse = verse_element.attrib.get("n")
+        if verse is None:
+            continue
+        snapshot.verses.append(verse)
+        if verse not in snapshot.verse_texts:
+            snapshot.verse_texts[verse] = extract_text(verse_element).strip()
+
+    snapshot.witness_list = [witness.attrib["n"] for witness in find_elements(doc, ".//witness") if witness.attrib.get("n")]
+
+    readings = find_elements(doc, ".//rdg")
+    reading_indexes = {reading: index for index, reading in enumerate(readings)}
+    snapshot.reading_texts = [extract_text(reading) for reading in readings]
+    snapshot.reading_witnesses = [reading_witnesses(reading) for reading in readings]
+    verse_names = dict()
+    snapshot.reading_verses = [verse_names.setdefault(str(verse), str(verse)) for verse in reading_verses(readings)]
+    for app in find_elements(doc, ".//app"):
+        snapshot.app_reading_indexes.extend(reading_indexes[reading] for reading in find_elements(app, ".//rdg"))
+        snapshot.app_offsets.append(len(snapshot.app_reading_indexes))
+
+    root = doc.getroot() if isinstance(doc, ElementTree) else doc
+    snapshot.ids = {
+        element.attrib[XML_ID]: extract_text(element, include_tail=False)
+        for element in root.iter()
+        if element_local_name(element) and XML_ID in element.attrib
+    }
+    return snapshot
+
+
+def default_cache_directory() -> Path:
+    """ The directory for cached snapshots from the `VORLAGELLM_CACHE_DIR` environment variable or the user's cache directory. """
+    if os.environ.get("VORLAGELLM_CACHE_DIR"):
+        return Path(os.environ["VORLAGELLM_CACHE_DIR"])
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home()/".cache")/"vorlagellm"/"snapshots"
+
+
+def file_hash(path:Path) -> str:
+    """ The SHA-256 hash of the contents of a file. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_cache_path(path:Path, cache_directory:Path|None=None) -> Path:
+    """ The path of the cached snapshot for a TEI file, named from a hash of its absolute path. """
+    key = hashlib.sha256(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:32]
+    return Path(cache_directory or default_cache_directory())/f"{key}.pickle"
+
+
+def owned_by_user(path:Path) -> bool:
+    """ Whether a file belongs to the current user (always True on platforms without user IDs). """
+    return not hasattr(os, "getuid") or path.stat().st_uid == os.getuid()
+
+
+def load_snapshot(path:Path, cache:bool=False, cache_directory:Path|None=None) -> TeiSnapshot:
+    """
+    Loads the snapshot of a TEI file. If `cache` is True, then the file is only parsed if there is no valid snapshot in the cache.
+
+    A cached snapshot is used if the modification time and the size of the file are unchanged.
+    Otherwise it is still used if the hash of the contents is unchanged (e.g. if the file was touched or copied).
+    Snapshots are pickled so the cache directory is created so that only the user can access it 
+    and cached snapshots which belong to other users are ignored.
+    """
+    path = Path(path)
+    if not cache:
+        return build_snapshot(read_tei(path))
+
+    stat = path.stat()
+    cache_path = snapshot_cache_path(path, cache_directory)
+    cached = None
+    if cache_path.exists() and owned_by_user(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+        except Exception:
+            cached = None
+
+    if cached and cached.get("version") == SNAPSHOT_VERSION:
+        if cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            return cached['snapshot']
+        content_hash = file_hash(path)
+        if cached['hash'] == content_hash:
+            save_snapshot(cache_path, cached['snapshot'], stat, content_hash)
+            return cached['snapshot']
+    else:
+        content_hash = file_hash(path)
+
+    snapshot = build_snapshot(read_tei(path))
+    save_snapshot(cache_path, snapshot, stat, content_hash)
+    return snapshot
+
+
+def save_snapshot(cache_path:Path, snapshot:TeiSnapshot, stat:os.stat_result, content_hash:str) -> None:
+    """ Writes a snapshot to the cache with the details of the file it was extracted from. """
+    cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    temporary_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    data = dict(
+        version=SNAPSHOT_VERSION,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        hash=content_hash,
+        snapshot=snapshot,
+    )
+    try:
+        with open(temporary_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+
+
+def clear_snapshot_cache(cache_directory:Path|None=None) -> int:
+    """ Deletes the cached snapshots and returns how many were deleted. """
+    cache_directory = Path(cache_directory or default_cache_directory())
+    if not cache_directory.exists():
+        return 0
+    paths = list(cache_directory.glob("*.pickle"))
+    for path in paths:
+        path.unlink(missing_ok=True)
+    return len(paths)
@@ -7,9 +7,35 @@ from lxml.etree import ElementTree as new_element_tree
 import re
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 import copy
+import gzip
+import os
+import threading
+import numpy as np
 
 from .languages import convert_language_code
+from .queries import query, query_first
+
+
+WHITESPACE_REGEX = re.compile(r"\s+")
+SKIPPED_TEXT_TAGS = frozenset(["pc", "witDetail", "note"])
+REF_TARGET_XPATH = ET.XPath("//*[@xml:id=$target_id]")
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+COMPRESSION_MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+DEFAULT_COMPRESSION_LEVELS = dict(gzip=6, zstd=3)
+
+
+@lru_cache(maxsize=1024)
+def local_name(tag:str) -> str:
+    """ Removes the namespace from a tag (e.g. '{http://www.tei-c.org/ns/1.0}app' gives 'app'). """
+    return tag.rsplit("}", 1)[-1]
+
+
+def element_local_name(element:Element) -> str|None:
+    """ Returns the tag of an element without the namespace or None if it is not an element (e.g. a comment). """
+    tag = element.tag
+    return local_name(tag) if isinstance(tag, str) else None
 
 
 @dataclass
@@ -19,25 +45,60 @@ class Permutation:
     apps:list[Element]=None
 
 
+def compression_for_path(path:Path|str) -> str|None:
+    """ Returns the compression for an output path from its suffix ('gzip' for '.gz', 'zstd' for '.zst' or None). """
+    return COMPRESSION_SUFFIXES.get(Path(path).suffix.lower())
+
+
+def detect_compression(path:Path|str) -> str|None:
+    """ Returns the compression of an existing file from its first bytes ('gzip', 'zstd' or None). """
+    with open(path, "rb") as f:
+        start = f.read(4)
+    return next((compression for magic, compression in COMPRESSION_MAGIC.items() if start.startswith(magic)), None)
+
+
+def open_tei_file(path:Path|str, mode:str="rb", compression:str|None=None, compresslevel:int|None=None):
+    """
+    Opens a TEI XML file in binary mode, compressing or decompressing it with gzip or zstd if necessary.
+
+    When reading, the compression is detected from the contents of the file. 
+    When writing, the compression is given by `compression` or from the suffix of the path.
+    zstd needs the optional `zstandard` package.
+    """
+    assert mode in ["rb", "wb"], f"Cannot open TEI files with mode '{mode}'"
+    if compression is None:
+        compression = detect_compression(path) if mode == "rb" else compression_for_path(path)
+    assert compression in [None, "gzip", "zstd"], f"Unknown compression '{compression}'"
+
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=compresslevel or DEFAULT_COMPRESSION_LEVELS['gzip'])
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading or writing zstd-compressed TEI files needs the 'zstandard' package. Install it with 'pip install zstandard'.")
+        if mode == "wb":
+            compressor = zstandard.ZstdCompressor(level=compresslevel or DEFAULT_COMPRESSION_LEVELS['zstd'])
+            return zstandard.open(path, mode, cctx=compressor)
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
 def read_tei(path:Path) -> ElementTree:
+    """ Reads a TEI XML file, which can be compressed with gzip or zstd. """
     parser = ET.XMLParser(remove_blank_text=True)
-    with open(path, 'r') as f:
+    with open_tei_file(path) as f:
         return ET.parse(f, parser)
 
 
-def find_element(doc:ElementTree|Element, xpath:str) -> Element|None:
-    if isinstance(doc, ElementTree):
-        doc = doc.getroot()
-    element = doc.find(xpath, namespaces=doc.nsmap)
-    if element is None:
-        element = doc.find(xpath)
-    return element
+def find_element(doc:ElementTree|Element, xpath:str, **variables) -> Element|None:
+    """ Finds the first element matching the path (see `queries.query_first`). Values for `$variables` in the path are given as keyword arguments. """
+    return query_first(doc, xpath, **variables)
 
 
-def find_elements(doc:ElementTree|Element, xpath:str) -> Element|None:
-    if isinstance(doc, ElementTree):
-        doc = doc.getroot()
-    return doc.findall(xpath, namespaces=doc.nsmap)
+def find_elements(doc:ElementTree|Element, xpath:str, **variables) -> list[Element]:
+    """ Finds all the elements matching the path (see `queries.query`). Values for `$variables` in the path are given as keyword arguments. """
+    return query(doc, xpath, **variables)
 
 
 def get_siglum(doc:ElementTree|Element) -> str:
@@ -73,6 +134,22 @@ def app_has_witness(app:Element, siglum:str) -> bool:
     return any(reading_has_witness(reading, siglum) for reading in readings)
 
 
+def get_witnessed_app_indexes(apparatus:ElementTree|Element, siglum:str) -> set[int]:
+    """
+    Returns the positions of the <app> elements (in document order) which already have a <rdg> with the specified siglum.
+
+    The readings are scanned in a single pass so that resuming a mostly completed apparatus
+    does not need to search the readings of each <app> separately.
+    """
+    witnessed_apps = set()
+    for reading in find_elements(apparatus, ".//rdg"):
+        if reading_has_witness(reading, siglum):
+            witnessed_apps.add(find_parent(reading, "app"))
+
+    apps = find_elements(apparatus, ".//app")
+    return set(index for index, app in enumerate(apps) if app in witnessed_apps)
+
+
 def get_verses(doc:ElementTree|Element) -> list[str]:
     """ Returns a list of "n" attributes in <ab> elements."""
     ab_elements = find_elements(doc, ".//ab")
@@ -102,10 +179,10 @@ def get_reading_permutations(
 
     apps = []
     for child in verse_element.getchildren():
-        if not isinstance(child.tag, str):
+        tag = element_local_name(child)
+        if tag is None:
             continue
 
-        tag = re.sub(r"\{.*\}", "", child.tag)
         if tag == "app":
             has_witness = bool(witness) and app_has_witness(child, witness)
 
@@ -129,7 +206,7 @@ def get_reading_permutations(
                 permutation.text = (permutation.text + " " + extract_text(child)).strip()
 
     def clean_text(text:str) -> str:
-        return re.sub(r"\s+", " ", text.strip())
+        return WHITESPACE_REGEX.sub(" ", text.strip())
 
     perumutations = [Permutation(text=clean_text(permutation.text), readings=permutation.readings, apps=apps) for permutation in permutations]
 
@@ -194,7 +271,7 @@ def get_reading_permutations(
 
 
 def get_verse_element(doc:ElementTree|Element, verse:str) -> Element|None:
-    return find_element(doc, f".//ab[@n='{verse}']")
+    return find_element(doc, ".//ab[@n=$verse]", verse=verse)
 
 
 def get_verse_text(doc:ElementTree|Element, verse:str) -> str|None:
@@ -235,9 +312,29 @@ def remove_witnesss_readings(readings:Element|list[Element], siglum:str) -> None
         reading.attrib['wit'] = " ".join(witnesses)
 
 
-def write_tei(doc:ElementTree, path:Path|str) -> None:
-    Path(path).parent.mkdir(parents=True, exist_ok=True)
-    doc.write(str(path), encoding="utf-8", xml_declaration=True, pretty_print=True)
+def write_tei(doc:ElementTree, path:Path|str, pretty_print:bool=True, compression:str|None=None, compresslevel:int|None=None) -> None:
+    """
+    Writes a TEI XML file.
+
+    The file is written to a temporary file in the same directory which then replaces the path 
+    so that the output is never left half-written if the process is interrupted.
+
+    Args:
+        doc (ElementTree): The document to write.
+        path (Path|str): The output path. Paths ending in '.gz' or '.zst' are compressed with gzip or zstd.
+        pretty_print (bool): Whether or not to indent the XML. Compact output is faster to write for large files. Defaults to True.
+        compression (str|None): 'gzip' or 'zstd' to compress the output regardless of the suffix of the path.
+        compresslevel (int|None): The level of compression. Defaults to 6 for gzip and 3 for zstd.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open_tei_file(temporary_path, "wb", compression=compression or compression_for_path(path), compresslevel=compresslevel) as f:
+            doc.write(f, encoding="utf-8", xml_declaration=True, pretty_print=pretty_print)
+        os.replace(temporary_path, path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
 
 
 def get_witness_list(apparatus:ElementTree|Element) -> Element:
@@ -256,7 +353,7 @@ def add_siglum(apparatus:ElementTree|Element, siglum:str) -> Element:
     list_wit = get_witness_list(apparatus)
     
     # Check if the witness already exists
-    witness_element = find_element(list_wit, f".//witness[@n='{siglum}']")
+    witness_element = find_element(list_wit, ".//witness[@n=$siglum]", siglum=siglum)
     if not witness_element:
         witness_element = ET.Element("witness", attrib={"n": siglum})
         list_wit.append(witness_element)
@@ -266,15 +363,54 @@ def add_siglum(apparatus:ElementTree|Element, siglum:str) -> Element:
 
 def has_witness(apparatus:ElementTree|Element, siglum:str) -> bool:
     list_wit = get_witness_list(apparatus)
-    return find_element(list_wit, f".//witness[@n='{siglum}']") is not None
+    return find_element(list_wit, ".//witness[@n=$siglum]", siglum=siglum) is not None
+
+
+@lru_cache(maxsize=2**16)
+def parse_witnesses(wit:str) -> frozenset[str]:
+    """ Splits the value of a 'wit' attribute into a set of sigla. The result is cached for each distinct attribute value. """
+    return frozenset(wit.split())
+
+
+def reading_witnesses(reading:Element) -> frozenset[str]:
+    """
+    Returns the sigla in the 'wit' attribute of a <rdg> element exactly as they are written (i.e. with any '#' prefix).
+
+    The sets are cached by the value of the attribute so they stay in sync 
+    when the attribute is changed with `add_witness_readings` or `remove_witnesss_readings`.
+    """
+    return parse_witnesses(reading.attrib.get('wit', ""))
 
 
 def reading_has_witness(reading:Element, siglum:str) -> bool:
-    if 'wit' not in reading.attrib:
-        return False
-    
-    witnesses = reading.attrib['wit'].split()
+    witnesses = reading_witnesses(reading)
     return (siglum in witnesses or f"#{siglum}" in witnesses)
+
+
+def witness_sets_matrix(witness_sets:list[frozenset[str]], sigla:list[str]) -> np.ndarray:
+    """
+    Builds a boolean matrix with a row for each set of witnesses and a column for each siglum.
+
+    Sigla match with or without a '#' prefix in the same way as `reading_has_witness`.
+    """
+    columns = dict()
+    for column, siglum in enumerate(sigla):
+        columns.setdefault(siglum, []).append(column)
+        columns.setdefault(f"#{siglum}", []).append(column)
+
+    matrix = np.zeros((len(witness_sets), len(sigla)), dtype=bool)
+    for row, witnesses in enumerate(witness_sets):
+        for witness in witnesses:
+            for column in columns.get(witness, []):
+                matrix[row, column] = True
+    return matrix
+
+
+def witness_matrix(readings:list[Element], sigla:list[str]) -> np.ndarray:
+    """ 
+    Builds a boolean matrix where element [i,j] is True if the i-th <rdg> element has the j-th siglum as a witness.
+    """
+    return witness_sets_matrix([reading_witnesses(reading) for reading in readings], sigla)
     
 
 def add_wit_detail(apps:Element|set[Element], siglum:str, note:str="", phrase:str="", phrase_lang:str="", resp_id:str="VorlageLLM") -> None:
@@ -317,8 +453,7 @@ def find_parent(element:Element, tag:str) -> Element|None:
         This will find the <ab> ancestor of the <target> element.
     """
     while element is not None:
-        element_tag = re.sub(r"{.*}", "", element.tag)
-        if element_tag == tag:
+        if element_local_name(element) == tag:
             return element
         element = element.getparent()
     return None
@@ -354,88 +489,133 @@ def write_elements(elements:list[Element], output_file:Path, root_tag:str="body"
     write_tei(tree, output_file)
 
 
-def get_apparatus_verse_text(app:Element, witness:str="") -> str:
-    parent = find_parent(app, 'ab')
-    text = parent.text or ""
-    text = text.strip()
-    text += " "
-    for child in parent:
-        if isinstance(child.tag, str):
-            tag = re.sub(r"{.*}", "", child.tag)
-        else:
-            continue
+def get_app_lemma(app:Element, witness:str="") -> Element:
+    """ 
+    Returns the reading to display for an <app>. 
+    
+    This is the first reading with the witness (if given) and otherwise the <lem> or the first <rdg>. 
+    If there are no readings then the <app> itself is returned.
+    """
+    if witness and app_has_witness(app, witness):
+        for reading in find_elements(app, ".//rdg"):
+            if reading_has_witness(reading, witness):
+                return reading
+
+    lemma = find_element(app, ".//lem")
+    if lemma is None:
+        lemma = find_element(app, ".//rdg")
+    if lemma is None:
+        lemma = app
+    return lemma
+
+
+def get_verse_segments(verse_element:Element, witness:str="") -> tuple[list[str], dict[Element,int]]:
+    """
+    Extracts the text of each segment of a verse once.
 
-        if tag in ["pc", "witDetail", "note"]:
+    Returns:
+        list[str]: The text of each segment with the whitespace normalized. The <app> elements which are children of the verse are segments on their own.
+        dict[Element,int]: The index of the segment for each <app>.
+    """
+    def normalize(text:str) -> str:
+        return WHITESPACE_REGEX.sub(" ", text).strip()
+
+    segments = [normalize(verse_element.text or "")]
+    app_segments = dict()
+    for child in verse_element:
+        tag = element_local_name(child)
+        if tag is None or tag in SKIPPED_TEXT_TAGS:
             continue
 
         if tag == "app":
-            if witness and app_has_witness(child, witness):
-                for reading in find_elements(child, ".//rdg"):
-                    if reading_has_witness(reading, witness):
-                        lemma = reading
-                        break
-            else:
-                lemma = find_element(child, ".//lem")
-                if lemma is None:
-                    lemma = find_element(child, ".//rdg")
-                if lemma is None:
-                    lemma = app
-            app_text = extract_text(lemma, include_tail=False) or ""
-            app_text = app_text.strip()
-            if child == app:
-                app_text = f"⸂{app_text}⸃"
-            text += app_text
-            if app.tail:
-                text += " " + app.tail.strip()
+            app_segments[child] = len(segments)
+            segments.append(normalize(extract_text(get_app_lemma(child, witness), include_tail=False) or ""))
+            segments.append(normalize(child.tail or ""))
         else:
-            child_text = extract_text(child) or ""
-            child_text = child_text.strip()
-            text += child_text or ""
-        
-        text += " "
+            segments.append(normalize(extract_text(child) or ""))
 
-    text += parent.tail or ""
-    text = re.sub(r"\s+", " ", text.strip())
-    return text    
+    segments.append(normalize(verse_element.tail or ""))
+    return segments, app_segments
 
 
-def extract_text(node:Element, include_tail:bool=True, strip:bool=True) -> str:
-    if node is None:
-        return ""
-    
-    if isinstance(node.tag, str):
-        tag = re.sub(r"{.*}", "", node.tag)
-    else:
-        return ""
+def render_verse_segments(segments:list[str], bracket_index:int) -> str:
+    """ Joins the segments of a verse with the segment at `bracket_index` in brackets like this: ⸂ ⸃. """
+    bracketed = segments[:bracket_index] + [f"⸂{segments[bracket_index]}⸃"] + segments[bracket_index+1:]
+    return " ".join(segment for segment in bracketed if segment)
 
-    if tag in ["pc", "witDetail", "note"]:
-        return ""
-    if tag == "app":            
-        lemma = find_element(node, ".//lem")
-        if lemma is None:
-            lemma = find_element(node, ".//rdg")
+
+def get_apparatus_verse_texts(verse_element:Element, witness:str="") -> dict[Element,str]:
+    """
+    Returns the text of a verse for each of its <app> elements with the text of that <app> in brackets like this: ⸂ ⸃.
+
+    The text of each segment is only extracted once for the verse so this is linear in the number of <app> elements
+    rather than calling `get_apparatus_verse_text` for each one.
+    """
+    segments, app_segments = get_verse_segments(verse_element, witness=witness)
+    return {app: render_verse_segments(segments, index) for app, index in app_segments.items()}
+
+
+def get_apparatus_verse_text(app:Element, witness:str="") -> str:
+    """ Returns the text of the verse with the text of the <app> in brackets like this: ⸂ ⸃. """
+    segments, app_segments = get_verse_segments(find_parent(app, 'ab'), witness=witness)
+    if app not in app_segments:
+        return " ".join(segment for segment in segments if segment)
+    return render_verse_segments(segments, app_segments[app])
+
+
+def get_text_lemma(app:Element) -> Element|None:
+    """ Returns the <lem> of an <app> or the first <rdg> if there is no <lem>. """
+    lemma = find_element(app, ".//lem")
+    if lemma is None:
+        lemma = find_element(app, ".//rdg")
+    return lemma
+
+
+def collect_text(node:Element, parts:list[str], include_tail:bool=True) -> None:
+    """
+    Appends the text of an element and its descendants to a list of strings, without normalizing the whitespace.
+
+    This is used by `extract_text` so that the whitespace is only normalized once for the whole element.
+    """
+    tag = element_local_name(node)
+    if tag is None or tag in SKIPPED_TEXT_TAGS:
+        return
+
+    if tag == "app":
+        lemma = get_text_lemma(node)
         if lemma: 
-            return extract_text(lemma, strip=False) or ""
+            collect_text(lemma, parts)
+            return
     if tag == "ref":
-        root = node.getroottree().getroot()
-        target_id = node.attrib['target'].lstrip("#")
-        ns = {"tei": "http://www.tei-c.org/ns/1.0"}
-        target = root.xpath(f"//*[@xml:id='{target_id}']", namespaces=ns)
-
+        target = REF_TARGET_XPATH(node.getroottree().getroot(), target_id=node.attrib['target'].lstrip("#"))
         if target:
-            return extract_text(target[0], strip=strip)
+            collect_text(target[0], parts)
+            return
 
-    text = node.text or ""
+    if node.text:
+        parts.append(node.text)
     for child in node:
-        text += extract_text(child, strip=False)
+        collect_text(child, parts)
 
     if include_tail and node.tail:
-        text += node.tail
-
-    text = re.sub(r"\s+", " ", text)
+        parts.append(node.tail)
 
     if tag == "w" or (tag == "lb" and node.attrib.get("break", "").lower() != "no"):
-        text += " "
+        parts.append(" ")
+
+
+def extract_text(node:Element, include_tail:bool=True, strip:bool=True) -> str:
+    if node is None:
+        return ""
+
+    if element_local_name(node) == "app":
+        lemma = get_text_lemma(node)
+        if lemma:
+            return extract_text(lemma, strip=False)
+
+    parts = []
+    collect_text(node, parts, include_tail=include_tail)
+    text = WHITESPACE_REGEX.sub(" ", "".join(parts))
 
     if strip:
         text = text.strip()
@@ -514,7 +694,7 @@ def add_responsibility_statement(doc:ElementTree, xml_id:str, description:str) -
 
     # Get unique ID
     counter = 1
-    while find_element(title_statement, f".//respStmt[@{{http://www.w3.org/XML/1998/namespace}}id='{xml_id}']") is not None:
+    while find_element(title_statement, ".//respStmt[@xml:id=$xml_id]", xml_id=xml_id) is not None:
         counter += 1
         xml_id = f"VorlageLLM-{counter}"
 
@@ -545,5 +725,5 @@ def add_responsibility_statement_llm(doc:ElementTree, siglum:str, model_id:str)
         str: The unique ID of the responsibility statement.
     """
     description = f"Witness '{siglum}' added using VorlageLLM using LLM '{model_id}'"
-    xml_id = f"VorlageLLM-{siglum}-{model_id}"
+    xml_id = re.sub(r"[^\w.-]+", "-", f"VorlageLLM-{siglum}-{model_id}")
     return add_responsibility_statement(doc, xml_id, description)
\ No newline at end of file